@@ -41,6 +41,26 @@ export interface NfseApi {
 
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || '';
 const TUS_ENDPOINT = import.meta.env.VITE_TUS_ENDPOINT || '';
+// files above this size go through the resumable /api/uploads/sessions/ protocol
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const CHUNK_RETRIES = 5;
+
+interface UploadSession {
+  sessionId: string;
+  offset: number;
+  chunkSize: number;
+  completed: boolean;
+}
+
+const sha256Hex = async (blob: Blob): Promise<string> => {
+  if (!globalThis.crypto?.subtle) return '';
+  const digest = await globalThis.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, '0'))
+    .join('');
+};
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
 const USE_MOCK_API = import.meta.env.VITE_USE_MOCK_API !== 'false';
 
 class HttpNfseApi implements NfseApi {
@@ -49,6 +69,9 @@ class HttpNfseApi implements NfseApi {
       if (TUS_ENDPOINT) {
         return this.uploadWithTus(file, options);
       }
+      if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+        return this.uploadInChunks(file, options);
+      }
       const form = new FormData();
       form.append('file', file);
 
@@ -155,6 +178,49 @@ class HttpNfseApi implements NfseApi {
     return this.withAuthRetry(send);
   }
 
+  private async uploadInChunks(file: File, options?: UploadFileOptions) {
+    const sessionsUrl = `${API_BASE_URL}/api/uploads/sessions/`;
+    const config = () => ({ withCredentials: true, headers: authHeaders(), signal: options?.signal });
+
+    const created = await this.withAuthRetry(() =>
+      axios.post<UploadSession>(sessionsUrl, { fileName: file.name, size: file.size }, config()),
+    );
+    const { sessionId, chunkSize } = created.data;
+    let offset = created.data.offset;
+    let failures = 0;
+
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + chunkSize);
+      try {
+        const checksum = await sha256Hex(chunk);
+        const response = await this.withAuthRetry(() =>
+          axios.put<UploadSession>(`${sessionsUrl}${sessionId}/`, chunk, {
+            ...config(),
+            headers: { ...authHeaders(), 'Content-Type': 'application/octet-stream' },
+            params: { offset, ...(checksum ? { checksum } : {}) },
+          }),
+        );
+        offset = response.data.offset;
+        failures = 0;
+        options?.onProgress?.(Math.round((offset / file.size) * 100));
+      } catch (error: any) {
+        if (options?.signal?.aborted || failures >= CHUNK_RETRIES) throw error;
+        failures += 1;
+        await sleep(500 * 2 ** failures);
+        // resume from whatever the server actually stored
+        const status = await this.withAuthRetry(() =>
+          axios.get<UploadSession>(`${sessionsUrl}${sessionId}/`, config()),
+        );
+        offset = status.data.offset;
+      }
+    }
+
+    const finalized = await this.withAuthRetry(() =>
+      axios.post<UploadDescriptor>(`${sessionsUrl}${sessionId}/finalize/`, {}, config()),
+    );
+    return finalized.data;
+  }
+
   private uploadWithTus(file: File, options?: UploadFileOptions) {
     return new Promise<UploadDescriptor>((resolve, reject) => {
       const upload = new Upload(file, {
@@ -154,6 +154,8 @@ const ImportacaoNfsPage = () => {
     accept: {
       'application/pdf': ['.pdf'],
       'application/zip': ['.zip'],
+      'application/xml': ['.xml'],
+      'text/xml': ['.xml'],
     },
     onDropAccepted: (files) => handleAddFiles(files),
     maxSize: 150 * 1024 * 1024,
@@ -407,7 +409,7 @@ const ImportacaoNfsPage = () => {
             <input {...getInputProps()} />
             <CloudUpload size={32} />
             <p>
-              Arraste até 1000 PDFs ou um arquivo .zip
+              Arraste até 1000 PDFs/XMLs ou um arquivo .zip
               <br />
               <span>ou clique para selecionar</span>
             </p>
@@ -1,8 +1,27 @@
-from django.db.models.signals import post_save, pre_delete, pre_save
+import functools
+
+from django.db.models.signals import post_init, post_save, pre_delete, pre_save
 
 _registered_models = set()
 
 
+def _snapshot_on_refresh(refresh_from_db):
+    """Wraps `Model.refresh_from_db`, which sends no signal, to retake the audit snapshot."""
+    from . import signals
+
+    @functools.wraps(refresh_from_db)
+    def wrapper(self, using=None, fields=None, from_queryset=None):
+        refresh_from_db(self, using=using, fields=fields, from_queryset=from_queryset)
+        signals.after_refresh(self, fields)
+
+    wrapper.audit_snapshot = True
+    return wrapper
+
+
+def is_registered(model) -> bool:
+    return model in _registered_models
+
+
 def register_model(model):
     from . import signals
 
@@ -12,6 +31,11 @@ def register_model(model):
         return
 
     _registered_models.add(model)
+    if not getattr(model.refresh_from_db, 'audit_snapshot', False):
+        model.refresh_from_db = _snapshot_on_refresh(model.refresh_from_db)
+    post_init.connect(
+        signals.after_init, sender=model, weak=False, dispatch_uid=f'audit_init_{model.__name__}'
+    )
     pre_save.connect(signals.before_save, sender=model, weak=False, dispatch_uid=f'audit_pre_{model.__name__}')
     post_save.connect(
         signals.after_save, sender=model, weak=False, dispatch_uid=f'audit_post_{model.__name__}'
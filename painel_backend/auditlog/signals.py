@@ -1,35 +1,132 @@
-import json
-from typing import Any
+import copy
+from typing import Any, Iterable, Optional
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import transaction
-from django.db.models.signals import post_save, pre_delete, pre_save
-from django.forms.models import model_to_dict
+from django.db import models, transaction
+from django.db.backends.utils import format_number
+from django.db.models.fields.files import FieldFile
 
 from .middleware import get_current_request
 from .models import AuditLog
+from .registry import is_registered
 
+_ENCODER = DjangoJSONEncoder()
+_JSON_SCALARS = (str, int, float, bool, type(None))
 
-def serialize_instance(instance) -> dict[str, Any]:
+
+def json_value(value: Any) -> Any:
+    """JSON-serializable form of a field value (files become their name)."""
+    if isinstance(value, _JSON_SCALARS):
+        return value
+    if isinstance(value, FieldFile):
+        return value.name or None
+    if isinstance(value, dict):
+        return {str(key): json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_value(item) for item in value]
+    return _ENCODER.default(value)
+
+
+def field_value(field, value: Any) -> Any:
+    """`json_value`, with decimals at the field scale (1000 and 1000.00 are equal)."""
+    if isinstance(field, models.DecimalField) and value is not None:
+        try:
+            return format_number(field.to_python(value), None, field.decimal_places)
+        except ValidationError:
+            pass
+    return json_value(value)
+
+
+def audited_fields(model, names: Optional[Iterable[str]] = None) -> list:
+    """Concrete fields of `model` that are audited, limited to `names` if given."""
+    exclude_fields = set(getattr(settings, 'AUDITLOG_EXCLUDE_FIELDS', []))
+    wanted = set(names) if names is not None else None
+    return [
+        field
+        for field in model._meta.concrete_fields
+        if field.name not in exclude_fields
+        and (wanted is None or field.name in wanted or field.attname in wanted)
+    ]
+
+
+def serialize_instance(instance, fields: Optional[list] = None) -> dict[str, Any]:
     """
     Convert a model instance to a JSON-serializable dict.
     """
-    field_values = {}
-    for field in instance._meta.fields:
-        if field.is_relation and field.many_to_one and field.remote_field:
-            value = getattr(instance, field.attname, None)
-        else:
-            value = getattr(instance, field.name, None)
-        field_values[field.name] = value
+    if fields is None:
+        fields = audited_fields(instance.__class__)
+    field_values = {
+        field.name: field_value(field, getattr(instance, field.attname, None)) for field in fields
+    }
+    field_values['pk'] = json_value(getattr(instance, instance._meta.pk.attname))
+    return field_values
 
-    field_values['pk'] = getattr(instance, instance._meta.pk.attname)
-    exclude_fields = set(getattr(settings, 'AUDITLOG_EXCLUDE_FIELDS', []))
-    for exclude in exclude_fields:
-        field_values.pop(exclude, None)
 
-    serialized = json.dumps(field_values, cls=DjangoJSONEncoder)
-    return json.loads(serialized)
+def snapshot_on_load() -> bool:
+    return bool(getattr(settings, 'AUDITLOG_SNAPSHOT_ON_LOAD', True))
+
+
+def _remember(instance, fields: Optional[Iterable] = None) -> None:
+    """Keeps the current values of `fields` (all loaded ones by default) to diff later."""
+    snapshot = instance.__dict__.setdefault('_audit_snapshot', {})
+    for field in fields if fields is not None else instance._meta.concrete_fields:
+        if field.attname in instance.__dict__:  # deferred fields are not loaded
+            value = instance.__dict__[field.attname]
+            if isinstance(value, FieldFile):
+                value = value.name
+            elif isinstance(value, (dict, list)):
+                # JSON fields may be changed in place
+                value = copy.deepcopy(value)
+            snapshot[field.attname] = value
+
+
+def _previous_values(sender, instance, fields: list, using: Optional[str]) -> Optional[dict]:
+    return previous_values(sender, [instance], fields, using)[0]
+
+
+def previous_values(
+    model, instances: list, fields: list, using: Optional[str] = None
+) -> list[Optional[dict]]:
+    """Stored values of `fields` per instance (None when the row does not exist).
+
+    They come from the load snapshot; what it lacks is read with one query.
+    """
+    use_snapshot = snapshot_on_load()
+    found = []
+    missing_pks = set()
+    missing_attnames = set()
+    for instance in instances:
+        snapshot = instance.__dict__.get('_audit_snapshot') if use_snapshot else None
+        values = {}
+        for field in fields:
+            if snapshot is not None and field.attname in snapshot:
+                values[field.attname] = snapshot[field.attname]
+            else:
+                missing_pks.add(instance.pk)
+                missing_attnames.add(field.attname)
+        found.append(values)
+
+    rows = {}
+    if missing_pks:
+        rows = {
+            row['pk']: row
+            for row in model._base_manager.using(using)
+            .filter(pk__in=missing_pks)
+            .values('pk', *missing_attnames)
+        }
+    result = []
+    for instance, values in zip(instances, found):
+        if instance.pk in missing_pks:
+            if instance.pk not in rows:
+                result.append(None)
+                continue
+            values = {**rows[instance.pk], **values}
+        previous = {field.name: field_value(field, values.get(field.attname)) for field in fields}
+        previous['pk'] = json_value(instance.pk)
+        result.append(previous)
+    return result
 
 
 def diff_changes(before: dict[str, Any] | None, after: dict[str, Any] | None) -> dict[str, Any]:
@@ -60,8 +157,16 @@ def _get_actor_meta():
 
 
 def _create_audit_log(instance, action: str, before: dict[str, Any] | None, after: dict[str, Any] | None):
+    audit_log = _build_audit_log(instance, action, before, after)
+    if audit_log is not None:
+        audit_log.save()
+
+
+def _build_audit_log(
+    instance, action: str, before: dict[str, Any] | None, after: dict[str, Any] | None
+) -> Optional[AuditLog]:
     if instance.__class__ is AuditLog:
-        return
+        return None
 
     actor, meta = _get_actor_meta()
     changes = {}
@@ -72,10 +177,10 @@ def _create_audit_log(instance, action: str, before: dict[str, Any] | None, afte
     else:
         diff = diff_changes(before, after)
         if not diff:
-            return
+            return None
         changes = diff
 
-    AuditLog.objects.create(
+    return AuditLog(
         action=action,
         app_label=instance._meta.app_label,
         model_name=instance.__class__.__name__,
@@ -89,21 +194,71 @@ def _create_audit_log(instance, action: str, before: dict[str, Any] | None, afte
     )
 
 
-def before_save(sender, instance, **kwargs):
+def log_bulk_save(model, saved: list[tuple[Any, Optional[dict]]], fields: Optional[list] = None):
+    """Audit rows for instances written by bulk_create/bulk_update, which send no signals.
+
+    `saved` pairs each instance (with its pk) with its `previous_values`, None
+    for a new row. Updates compare only `fields` (all audited ones by
+    default). Every row is written with one INSERT.
+    """
+    if not is_registered(model):
+        return
+    audit_logs = []
+    for instance, previous in saved:
+        if previous is None:
+            audit_log = _build_audit_log(
+                instance, AuditLog.Action.CREATE, None, serialize_instance(instance)
+            )
+        else:
+            audit_log = _build_audit_log(
+                instance, AuditLog.Action.UPDATE, previous, serialize_instance(instance, fields)
+            )
+        if audit_log is not None:
+            audit_logs.append(audit_log)
+        if snapshot_on_load():
+            _remember(instance, fields)
+    if audit_logs:
+        AuditLog.objects.bulk_create(audit_logs)
+
+
+def after_init(sender, instance, **kwargs):
+    # `_state.adding` is only set after post_init, so new instances get one
+    # too; the save that creates them replaces it
+    if snapshot_on_load():
+        _remember(instance)
+
+
+def after_refresh(instance, fields: Optional[Iterable[str]] = None):
+    """Values reloaded by refresh_from_db are the stored ones (e.g. after a queryset update)."""
+    if snapshot_on_load():
+        _remember(instance, None if fields is None else audited_fields(instance.__class__, fields))
+
+
+def before_save(sender, instance, update_fields=None, using=None, **kwargs):
+    """Keeps the stored values of the fields being written.
+
+    Only `update_fields` are compared when given. The values come from the
+    snapshot taken when the instance was loaded (AUDITLOG_SNAPSHOT_ON_LOAD),
+    so an update costs no extra query unless some field was deferred.
+    """
+    instance._audit_fields = None
     if instance._state.adding:
         instance._audit_previous = None
         return
-    try:
-        previous = sender.objects.get(pk=instance.pk)
-        instance._audit_previous = serialize_instance(previous)
-    except sender.DoesNotExist:
-        instance._audit_previous = None
+    fields = audited_fields(sender, update_fields)
+    if update_fields is not None:
+        instance._audit_fields = fields
+    instance._audit_previous = _previous_values(sender, instance, fields, using)
 
 
-def after_save(sender, instance, created, **kwargs):
+def after_save(sender, instance, created, update_fields=None, **kwargs):
     previous = getattr(instance, '_audit_previous', None)
-    after = serialize_instance(instance)
     action = AuditLog.Action.CREATE if created or previous is None else AuditLog.Action.UPDATE
+    fields = None if action == AuditLog.Action.CREATE else getattr(instance, '_audit_fields', None)
+    after = serialize_instance(instance, fields)
+    if snapshot_on_load():
+        # what was just written is what the next save is compared with
+        _remember(instance, sender._meta.concrete_fields if update_fields is None else fields)
 
     # Ensure log is written with the main transaction
     using_db = kwargs.get('using', None)
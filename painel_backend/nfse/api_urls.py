@@ -4,6 +4,21 @@ from . import api_views
 
 urlpatterns = [
     path('uploads/', api_views.upload_file, name='nfse_upload'),
+    path(
+        'uploads/sessions/',
+        api_views.UploadSessionCreateView.as_view(),
+        name='nfse_upload_session_create',
+    ),
+    path(
+        'uploads/sessions/<uuid:pk>/',
+        api_views.UploadSessionDetailView.as_view(),
+        name='nfse_upload_session_detail',
+    ),
+    path(
+        'uploads/sessions/<uuid:pk>/finalize/',
+        api_views.UploadSessionFinalizeView.as_view(),
+        name='nfse_upload_session_finalize',
+    ),
     path('nfse/companies/', api_views.CompanySearchView.as_view(), name='nfse_company_search'),
     path('nfse/import-jobs/', api_views.ImportJobListCreateView.as_view(), name='nfse_job_list'),
     path(
@@ -1,12 +1,11 @@
-import io
+import tempfile
 import uuid
-import zipfile
 from pathlib import Path
 
+from django.conf import settings
 from django.db import models
-from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
-from django.http import HttpResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from openpyxl import Workbook
@@ -18,14 +17,25 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import ImportJob, ImportJobFile, PayrollCompany
+from .models import ImportJob, ImportJobFile, PayrollCompany, UploadSession
 from .serializers import (
     ImportJobCreateSerializer,
     ImportJobDetailSerializer,
     ImportJobSerializer,
     ReprocessSerializer,
+    UploadSessionCreateSerializer,
 )
 from .tasks import enqueue_job
+from .uploads import (
+    JobFileBuilder,
+    append_chunk,
+    finalize_upload,
+    max_chunk_bytes,
+    start_upload_session,
+)
+from .zipstream import iter_zip
+
+EXPORT_CHUNK_SIZE = 500
 
 
 @api_view(['POST'])
@@ -49,6 +59,77 @@ def upload_file(request):
     return Response(payload, status=status.HTTP_201_CREATED)
 
 
+def _upload_session_payload(session: UploadSession) -> dict:
+    return {
+        'sessionId': str(session.id),
+        'fileName': session.file_name,
+        'size': session.size,
+        'offset': session.offset,
+        'chunkSize': max_chunk_bytes(),
+        'completed': session.completed,
+    }
+
+
+class UploadSessionCreateView(APIView):
+    """Starts a chunked upload (see `UploadSessionDetailView` for the chunks)."""
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = UploadSessionCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated = serializer.validated_data
+        session = start_upload_session(
+            request.user,
+            file_name=validated['fileName'],
+            size=validated['size'],
+            checksum=validated.get('checksum') or '',
+        )
+        return Response(_upload_session_payload(session), status=status.HTTP_201_CREATED)
+
+
+class UploadSessionDetailView(APIView):
+    """GET reports how much was received; PUT appends a raw chunk at `?offset=`."""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, created_by=request.user)
+        return Response(_upload_session_payload(session))
+
+    def put(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, created_by=request.user)
+        try:
+            offset = int(request.query_params.get('offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError as exc:
+            raise ValidationError({'detail': 'Informe o offset do trecho.'}) from exc
+        # the body is read straight from the stream, never through request.data
+        session.offset = append_chunk(
+            session,
+            offset=offset,
+            stream=request,
+            length=length,
+            checksum=request.query_params.get('checksum', ''),
+        )
+        return Response(_upload_session_payload(session))
+
+
+class UploadSessionFinalizeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, created_by=request.user)
+        session = finalize_upload(session, checksum=request.data.get('checksum') or '')
+        payload = {
+            'fileId': str(session.id),
+            'fileName': session.file_name,
+            'size': session.size,
+            'uploadToken': session.upload_token,
+        }
+        return Response(payload, status=status.HTTP_201_CREATED)
+
+
 class ImportJobListCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -70,7 +151,9 @@ class ImportJobListCreateView(APIView):
             status=ImportJob.Status.PENDING,
         )
 
-        helper = JobFileBuilder()
+        helper = JobFileBuilder(
+            expand_async=getattr(settings, 'NFSE_EXPAND_ZIP_ASYNC', False)
+        )
         job_files = []
         try:
             for descriptor in validated['files']:
@@ -82,7 +165,7 @@ class ImportJobListCreateView(APIView):
         if not job_files:
             job.delete()
             return Response(
-                {'detail': 'Nenhum arquivo PDF válido foi encontrado.'},
+                {'detail': 'Nenhum arquivo PDF ou XML válido foi encontrado.'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
@@ -132,7 +215,11 @@ class ImportJobReprocessView(APIView):
             job_file.progress = 0
             job_file.message = ''
             job_file.result = None
-            job_file.save(update_fields=['status', 'stage', 'progress', 'message', 'result'])
+            job_file.interruptions = 0
+            job_file.save(
+                update_fields=['status', 'stage', 'progress', 'message', 'result', 'interruptions']
+            )
+            job_file.extra_results.clear()
 
         job.status = ImportJob.Status.PENDING
         job.save(update_fields=['status'])
@@ -165,7 +252,7 @@ class JobDownloadView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk, category: str):
-        job = get_object_or_404(ImportJob.objects.prefetch_related('files'), pk=pk)
+        job = get_object_or_404(ImportJob, pk=pk)
         category = category.lower()
         if category not in {'services', 'others', 'services-excel'}:
             return Response(
@@ -176,9 +263,11 @@ class JobDownloadView(APIView):
             files = job.files.filter(status=ImportJobFile.Status.COMPLETED)
             suffix = 'servicos'
         elif category == 'services-excel':
-            files = job.files.filter(
-                status=ImportJobFile.Status.COMPLETED, result__isnull=False
-            ).select_related('result')
+            files = (
+                job.files.filter(status=ImportJobFile.Status.COMPLETED, result__isnull=False)
+                .select_related('result')
+                .prefetch_related('extra_results')
+            )
             if not files.exists():
                 return Response(
                     {'detail': 'Nenhum dado disponível para exportar.'},
@@ -200,23 +289,22 @@ class JobDownloadView(APIView):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        buffer = io.BytesIO()
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
-            for job_file in files:
-                if not job_file.stored_file:
-                    continue
-                with job_file.stored_file.open('rb') as handler:
-                    archive.writestr(job_file.file_name, handler.read())
-        buffer.seek(0)
+        entries = (
+            (job_file.file_name, lambda job_file=job_file: job_file.stored_file.open('rb'))
+            for job_file in files.iterator()
+            if job_file.stored_file
+        )
         filename = f'job-{str(job.id)[:8]}-{suffix}.zip'
-        response = HttpResponse(buffer.getvalue(), content_type='application/zip')
+        response = StreamingHttpResponse(iter_zip(entries), content_type='application/zip')
         response['Content-Disposition'] = f'attachment; filename=\"{filename}\"'
+        # let nginx pass the archive through as it is produced
+        response['X-Accel-Buffering'] = 'no'
         return response
 
-    def _build_excel(self, job: ImportJob, files) -> HttpResponse:
-        wb = Workbook()
-        ws = wb.active
-        ws.title = 'Notas de serviço'
+    def _build_excel(self, job: ImportJob, files) -> FileResponse:
+        # write-only: rows are serialized to a temporary file as they are appended
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Notas de serviço')
         company_name = (job.options or {}).get('companyName', '')
         headers = [
             'Arquivo',
@@ -276,126 +364,70 @@ class JobDownloadView(APIView):
         def _num(value):
             return float(value) if value not in (None, '') else ''
 
-        for job_file in files:
-            nf = job_file.result
-            ws.append(
-                [
-                    nf.file_name,
-                    nf.company_code,
-                    company_name,
-                    nf.municipality,
-                    nf.number,
-                    nf.access_key,
-                    _dt(nf.competence),
-                    nf.competence_period,
-                    _dt(nf.emission_datetime),
-                    nf.dps_number,
-                    nf.dps_series,
-                    _dt(nf.dps_emission_datetime),
-                    nf.emitter_name,
-                    nf.emitter_cnpj,
-                    nf.emitter_inscription,
-                    nf.emitter_phone,
-                    nf.emitter_email,
-                    nf.emitter_address,
-                    nf.emitter_zipcode,
-                    bool(nf.emitter_optante_simples),
-                    nf.emitter_regime_especial,
-                    nf.taker_name,
-                    nf.taker_cnpj,
-                    nf.taker_phone,
-                    nf.taker_email,
-                    nf.taker_address,
-                    nf.taker_zipcode,
-                    nf.service_national_code,
-                    nf.service_municipal_code,
-                    nf.service_location,
-                    nf.service_description,
-                    _num(nf.service_value),
-                    _num(nf.service_base_calculo),
-                    _num(nf.service_iss_rate),
-                    _num(nf.service_iss_value),
-                    bool(nf.service_iss_retido),
-                    nf.municipal_regime,
-                    nf.municipal_incidence_city,
-                    nf.municipal_taxation,
-                    nf.tax_comment,
-                    nf.federal_tax_comment,
-                    _num(nf.totals_service_value),
-                    bool(nf.totals_iss_retido),
-                    _num(nf.totals_retained_value),
-                    _num(nf.totals_net_value),
-                    nf.complementary_info,
-                    _dt(nf.created_at),
-                    _dt(nf.updated_at),
-                ]
-            )
+        for job_file in files.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            # an XML with many notes has the others in extra_results
+            for nf in [job_file.result, *job_file.extra_results.all()]:
+                ws.append(
+                    [
+                        nf.file_name,
+                        nf.company_code,
+                        company_name,
+                        nf.municipality,
+                        nf.number,
+                        nf.access_key,
+                        _dt(nf.competence),
+                        nf.competence_period,
+                        _dt(nf.emission_datetime),
+                        nf.dps_number,
+                        nf.dps_series,
+                        _dt(nf.dps_emission_datetime),
+                        nf.emitter_name,
+                        nf.emitter_cnpj,
+                        nf.emitter_inscription,
+                        nf.emitter_phone,
+                        nf.emitter_email,
+                        nf.emitter_address,
+                        nf.emitter_zipcode,
+                        bool(nf.emitter_optante_simples),
+                        nf.emitter_regime_especial,
+                        nf.taker_name,
+                        nf.taker_cnpj,
+                        nf.taker_phone,
+                        nf.taker_email,
+                        nf.taker_address,
+                        nf.taker_zipcode,
+                        nf.service_national_code,
+                        nf.service_municipal_code,
+                        nf.service_location,
+                        nf.service_description,
+                        _num(nf.service_value),
+                        _num(nf.service_base_calculo),
+                        _num(nf.service_iss_rate),
+                        _num(nf.service_iss_value),
+                        bool(nf.service_iss_retido),
+                        nf.municipal_regime,
+                        nf.municipal_incidence_city,
+                        nf.municipal_taxation,
+                        nf.tax_comment,
+                        nf.federal_tax_comment,
+                        _num(nf.totals_service_value),
+                        bool(nf.totals_iss_retido),
+                        _num(nf.totals_retained_value),
+                        _num(nf.totals_net_value),
+                        nf.complementary_info,
+                        _dt(nf.created_at),
+                        _dt(nf.updated_at),
+                    ]
+                )
 
-        buffer = io.BytesIO()
-        wb.save(buffer)
-        buffer.seek(0)
+        # the temporary file is removed when the response closes it
+        output = tempfile.TemporaryFile()
+        wb.save(output)
+        output.seek(0)
         filename = f'job-{str(job.id)[:8]}-servicos.xlsx'
-        response = HttpResponse(
-            buffer.getvalue(),
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=filename,
             content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         )
-        response['Content-Disposition'] = f'attachment; filename=\"{filename}\"'
-        return response
-
-
-class JobFileBuilder:
-    def prepare_job_files(self, job: ImportJob, descriptor: dict) -> list[ImportJobFile]:
-        file_name = descriptor['fileName']
-        upload_token = descriptor['uploadToken']
-        is_zip = file_name.lower().endswith('.zip')
-        if not is_zip:
-            job_file = ImportJobFile(
-                job=job,
-                file_name=file_name,
-                file_size=descriptor.get('size') or 0,
-            )
-            job_file.stored_file.name = upload_token
-            return [job_file]
-        return self._expand_zip(job, file_name, upload_token)
-
-    def _expand_zip(self, job: ImportJob, original_name: str, upload_token: str) -> list[ImportJobFile]:
-        extracted_files: list[ImportJobFile] = []
-        try:
-            with default_storage.open(upload_token, 'rb') as uploaded_file:
-                with zipfile.ZipFile(uploaded_file) as archive:
-                    for member in archive.namelist():
-                        if member.endswith('/'):
-                            continue
-                        if not member.lower().endswith('.pdf'):
-                            continue
-                        data = archive.read(member)
-                        extracted_name = Path(member).name
-                        content = ContentFile(data)
-                        storage_name = self._generate_storage_name(extracted_name)
-                        saved_name = default_storage.save(storage_name, content)
-                        job_file = ImportJobFile(
-                            job=job,
-                            file_name=extracted_name,
-                            file_size=len(data),
-                        )
-                        job_file.stored_file.name = saved_name
-                        extracted_files.append(job_file)
-        except zipfile.BadZipFile as exc:
-            raise ValidationError({'detail': f'Arquivo ZIP inválido ({original_name}).'}) from exc
-        finally:
-            try:
-                default_storage.delete(upload_token)
-            except Exception:  # pragma: no cover - limpeza best-effort
-                pass
-
-        if not extracted_files:
-            raise ValidationError(
-                {'detail': f'O arquivo ZIP {original_name} não contém PDFs válidos.'}
-            )
-        return extracted_files
-
-    @staticmethod
-    def _generate_storage_name(filename: str) -> str:
-        today_path = timezone.now().strftime('%Y/%m/%d')
-        safe_name = Path(filename).name
-        return str(Path('nfse/uploads') / today_path / f'{uuid.uuid4()}_{safe_name}')
@@ -0,0 +1,293 @@
+import hashlib
+import logging
+import os
+import re
+from concurrent.futures import Executor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pdfplumber
+import pytesseract
+from PIL import Image
+from pdf2image import convert_from_path
+
+from .imaging import preprocess
+from .layouts import LayoutTemplate, crop, match_layout, registered_layouts
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class OCRSettings:
+    """How scanned pages are rendered and read.
+
+    Pages are rendered at the first resolution in `dpi_steps`; a higher one
+    is only tried when the mean word confidence reported by Tesseract is
+    below `min_confidence`.
+    """
+
+    dpi_steps: tuple[int, ...] = (200, 300)
+    min_confidence: float = 70.0
+    preprocess: bool = True
+    # OCR only the zones of a recognized layout (see layouts.py)
+    use_layouts: bool = True
+    # layouts to try; None means those registered in the running process,
+    # which for an OCR pool process are only the built-in ones
+    layouts: Optional[tuple[LayoutTemplate, ...]] = None
+
+    def fingerprint(self) -> str:
+        """Short hash of the settings that change the OCR output (part of the text cache key)."""
+        layouts = self.layouts if self.layouts is not None else tuple(registered_layouts())
+        data = (self.dpi_steps, self.min_confidence, self.preprocess, self.use_layouts and layouts)
+        return hashlib.sha256(repr(data).encode('utf-8')).hexdigest()[:16]
+
+
+def normalize_text(text: Optional[str]) -> str:
+    if not text:
+        return ''
+    text = text.replace('\r', '\n')
+    cleaned_lines = []
+    for line in text.splitlines():
+        normalized_line = re.sub(r'\s+', ' ', line).strip()
+        if normalized_line:
+            cleaned_lines.append(normalized_line)
+    return '\n'.join(cleaned_lines)
+
+
+class PDFTextExtractor:
+    """Reads the text layer of a PDF, running OCR only on pages without text.
+
+    With an `ocr_executor` (a process pool), scanned pages are OCR'd in
+    parallel, one task per page, and put back in page order. This module
+    does not touch Django, so it can be executed inside worker processes.
+    """
+
+    def __init__(
+        self,
+        ocr_language: str = 'por',
+        ocr_executor: Optional[Executor] = None,
+        ocr_settings: Optional[OCRSettings] = None,
+    ):
+        self.ocr_language = ocr_language
+        self.ocr_executor = ocr_executor
+        self.ocr_settings = ocr_settings or OCRSettings()
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    def extract_text(self, pdf_path: Path) -> str:
+        return join_pages(self.extract_pages(pdf_path))
+
+    def extract_pages(
+        self, pdf_path: Path, known_pages: Optional[Dict[int, str]] = None
+    ) -> list[str]:
+        """Returns the normalized text of every page (1-based `known_pages` are reused)."""
+        pdf_path = Path(pdf_path)
+        pages: Dict[int, object] = {}
+        with pdfplumber.open(pdf_path) as pdf:
+            for idx, page in enumerate(pdf.pages, start=1):
+                if known_pages and idx in known_pages:
+                    pages[idx] = known_pages[idx]
+                    continue
+                text = self._text_layer(pdf_path, page)
+                if text:
+                    pages[idx] = text
+                elif self.ocr_executor is not None:
+                    self._log_ocr(pdf_path, idx)
+                    pages[idx] = self.ocr_executor.submit(
+                        ocr_pdf_page, str(pdf_path), idx, self.ocr_language, self.ocr_settings
+                    )
+                else:
+                    self._log_ocr(pdf_path, idx)
+                    pages[idx] = self._ocr_page(pdf_path, idx, page)
+        return [
+            value.result() if hasattr(value, 'result') else value
+            for _, value in sorted(pages.items())
+        ]
+
+    def metadata(self, pdf_path: Path) -> tuple[str, int]:
+        """(title, subject and keywords of the PDF, page count)."""
+        with pdfplumber.open(pdf_path) as pdf:
+            text = '\n'.join(
+                str(pdf.metadata.get(key) or '') for key in ('Title', 'Subject', 'Keywords')
+            )
+            return normalize_text(text), len(pdf.pages)
+
+    def first_page(self, pdf_path: Path, ocr_dpi: Optional[int]) -> tuple[str, bool]:
+        """(text of page 1, whether it came from OCR).
+
+        A page without text layer gets one quick OCR at `ocr_dpi`, without
+        layout zones or a second resolution; none at all when it is None.
+        """
+        pdf_path = Path(pdf_path)
+        with pdfplumber.open(pdf_path) as pdf:
+            if not pdf.pages:
+                return '', False
+            text = self._text_layer(pdf_path, pdf.pages[0])
+        if text or ocr_dpi is None:
+            return text, False
+
+        quick = replace(
+            self.ocr_settings, dpi_steps=(ocr_dpi,), min_confidence=0, use_layouts=False
+        )
+        if self.ocr_executor is not None:
+            text = self.ocr_executor.submit(
+                ocr_pdf_page, str(pdf_path), 1, self.ocr_language, quick
+            ).result()
+        else:
+            text = ocr_pdf_page(str(pdf_path), 1, self.ocr_language, quick)
+        return text, True
+
+    def _text_layer(self, pdf_path: Path, page) -> str:
+        try:
+            page_text = page.extract_text() or ''
+        except Exception as exc:  # pragma: no cover - PDF parsing edge case
+            self.logger.warning(
+                'Falha ao extrair texto bruto (%s): %s', pdf_path.name, exc
+            )
+            page_text = ''
+        return normalize_text(page_text)
+
+    def _log_ocr(self, pdf_path: Path, idx: int) -> None:
+        self.logger.info('Executando OCR no arquivo %s página %s.', pdf_path.name, idx)
+        print(f'OCR necessário para {pdf_path.name} (página {idx})')
+
+    def _ocr_page(self, pdf_path: Path, idx: int, page) -> str:
+        # the zone pass and the first full-page attempt share the render
+        rendered = None
+        if self.ocr_settings.use_layouts:
+            rendered = self._render(pdf_path, idx, page, self.ocr_settings.dpi_steps[0])
+            text = self._ocr_layout_zones(pdf_path, idx, rendered)
+            if text is not None:
+                return normalize_text(text)
+
+        best_text, best_confidence = '', -1.0
+        for step, dpi in enumerate(self.ocr_settings.dpi_steps):
+            if step == 0 and rendered is not None:
+                image = rendered
+            else:
+                image = self._render(pdf_path, idx, page, dpi)
+            text, confidence, _ = self._ocr_image(image)
+            if confidence > best_confidence:
+                best_text, best_confidence = text, confidence
+            if confidence >= self.ocr_settings.min_confidence:
+                break
+            self.logger.info(
+                'OCR de %s página %s com confiança %.0f a %s dpi.',
+                pdf_path.name,
+                idx,
+                confidence,
+                dpi,
+            )
+        return normalize_text(best_text)
+
+    def _ocr_layout_zones(self, pdf_path: Path, idx: int, image: Image.Image) -> Optional[str]:
+        """OCRs only the zones of a known layout; None means "use the full page".
+
+        `image` is the page rendered (and preprocessed) at the first DPI step.
+        """
+        layouts = self.ocr_settings.layouts
+        if layouts is None:
+            layouts = tuple(registered_layouts())
+        detected = {}
+        for layout in layouts:
+            if layout.detect_box not in detected:
+                detected[layout.detect_box] = self._ocr_image(crop(image, layout.detect_box))
+        layout = match_layout({box: result[0] for box, result in detected.items()}, layouts)
+        if layout is None:
+            return None
+
+        results = [
+            detected[zone.box] if zone.box in detected else self._ocr_image(crop(image, zone.box))
+            for zone in layout.zones
+        ]
+        words = sum(count for _, _, count in results)
+        confidence = (
+            sum(zone_confidence * count for _, zone_confidence, count in results) / words
+            if words
+            else 0.0
+        )
+        if confidence < self.ocr_settings.min_confidence:
+            self.logger.info(
+                'Zonas do layout %s com confiança %.0f em %s página %s; OCR da página inteira.',
+                layout.name,
+                confidence,
+                pdf_path.name,
+                idx,
+            )
+            return None
+        return '\n'.join(text for text, _, _ in results if text)
+
+    def _render(self, pdf_path: Path, idx: int, page, dpi: int) -> Image.Image:
+        image = self._page_to_image(pdf_path, idx, page, dpi)
+        if self.ocr_settings.preprocess:
+            image = preprocess(image)
+        return image
+
+    def _ocr_image(self, image: Image.Image) -> tuple[str, float, int]:
+        """Returns (text, mean word confidence, word count)."""
+        data = pytesseract.image_to_data(
+            image, lang=self.ocr_language, output_type=pytesseract.Output.DICT
+        )
+        text, confidence = ocr_data_to_text(data)
+        return text, confidence, len(text.split())
+
+    @staticmethod
+    def _page_to_image(pdf_path: Path, page_number: int, page, dpi: int) -> Image.Image:
+        try:
+            return page.to_image(resolution=dpi).original
+        except Exception:  # pragma: no cover - fallback path
+            images = convert_from_path(
+                str(pdf_path),
+                dpi=dpi,
+                first_page=page_number,
+                last_page=page_number,
+                grayscale=True,
+            )
+            return images[0]
+
+
+def ocr_data_to_text(data: Dict[str, list[Any]]) -> tuple[str, float]:
+    """Rebuilds the lines of a `image_to_data` result; returns (text, mean confidence)."""
+    lines: Dict[tuple, list[str]] = {}
+    confidences = []
+    for idx, word in enumerate(data.get('text', [])):
+        word = (word or '').strip()
+        confidence = float(data['conf'][idx])
+        if not word or confidence < 0:
+            continue
+        key = (data['block_num'][idx], data['par_num'][idx], data['line_num'][idx])
+        lines.setdefault(key, []).append(word)
+        confidences.append(confidence)
+    text = '\n'.join(' '.join(words) for words in lines.values())
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return text, confidence
+
+
+def join_pages(pages: list[str]) -> str:
+    return '\n'.join(page for page in pages if page)
+
+
+def init_ocr_process() -> None:
+    """Process-pool initializer: one Tesseract thread per page task.
+
+    Pages already run in parallel, so Tesseract's own OpenMP threads would
+    only oversubscribe the cores.
+    """
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+
+def ocr_pdf_page(
+    pdf_path: str,
+    page_number: int,
+    ocr_language: str,
+    ocr_settings: Optional[OCRSettings] = None,
+) -> str:
+    """Process-pool entry point: renders and OCRs a single (1-based) page."""
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            page = pdf.pages[page_number - 1]
+            extractor = PDFTextExtractor(ocr_language, ocr_settings=ocr_settings)
+            return extractor._ocr_page(Path(pdf_path), page_number, page)
+    except Exception as exc:
+        # some pytesseract errors cannot be unpickled and would break the pool
+        raise RuntimeError(f'{type(exc).__name__}: {exc}') from None
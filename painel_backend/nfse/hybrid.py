@@ -0,0 +1,275 @@
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Optional
+
+# fields the regex pass must deliver (valid) for a document to skip the LLM
+REQUIRED_FIELDS = (
+    'access_key',
+    'number',
+    'competence',
+    'emission_datetime',
+    'municipality',
+    'emitter_name',
+    'emitter_cnpj',
+    'taker_name',
+    'taker_cnpj',
+    'service_description',
+    'service_value',
+    'totals_net_value',
+)
+# past this many fields to ask, the full prompt is used instead
+MAX_PARTIAL_FIELDS = len(REQUIRED_FIELDS) // 2
+
+DATE_FIELDS = ('competence',)
+DATETIME_FIELDS = ('emission_datetime', 'dps_emission_datetime')
+DECIMAL_FIELDS = (
+    'service_value',
+    'service_base_calculo',
+    'service_iss_rate',
+    'service_iss_value',
+    'totals_service_value',
+    'totals_retained_value',
+    'totals_net_value',
+)
+BOOL_FIELDS = ('emitter_optante_simples', 'service_iss_retido', 'totals_iss_retido')
+AMOUNT_FIELDS = (
+    'service_value',
+    'service_base_calculo',
+    'service_iss_rate',
+    'service_iss_value',
+    'totals_net_value',
+)
+# taker fields and the emitter field read with the same regex pattern; the
+# taker ones are taken from the taker block of the text instead
+TAKER_ECHO_FIELDS = {
+    'taker_name': 'emitter_name',
+    'taker_cnpj': 'emitter_cnpj',
+    'taker_phone': 'emitter_phone',
+    'taker_email': 'emitter_email',
+    'taker_address': 'emitter_address',
+    'taker_zipcode': 'emitter_zipcode',
+}
+
+# words near which each field is printed; used to cut the text sent to the LLM
+FIELD_HINTS = {
+    'access_key': ('chave',),
+    'number': ('número',),
+    'competence': ('competência',),
+    'emission_datetime': ('emissão',),
+    'dps_emission_datetime': ('emissão',),
+    'municipality': ('município', 'prefeitura', 'local da prestação'),
+    'service_description': ('descrição', 'discriminação'),
+}
+FIELD_HINT_PREFIXES = {
+    'emitter_': ('emitente', 'prestador'),
+    'taker_': ('tomador',),
+    'service_': ('serviço', 'valor', 'base de cálculo', 'alíquota', 'iss'),
+    'totals_': ('valor', 'retid', 'líquido'),
+    'municipal_': ('município', 'tributação', 'regime'),
+    'dps_': ('dps',),
+}
+HINT_LINES_BEFORE = 1
+HINT_LINES_AFTER = 4
+
+_NON_DIGITS = re.compile(r'\D')
+# digit runs long enough for an access key, printed grouped ("3106 2002 ...") or not
+_KEY_DIGITS = re.compile(r'\d(?:[ .]?\d){43,}')
+_TAKER_HEADING = re.compile(r'^[^\n]*\btomador\b', re.IGNORECASE | re.MULTILINE)
+
+
+def only_digits(value: Optional[str]) -> str:
+    return _NON_DIGITS.sub('', value or '')
+
+
+def valid_access_key(value: Optional[str]) -> bool:
+    # 44 digits (municipal NFS-e following the NF-e key) or 50 (national NFS-e)
+    return len(only_digits(value)) in (44, 50)
+
+
+def access_key_candidates(text: Optional[str]) -> set[str]:
+    """Possible access keys in a text or file name (44 and 50 digit prefixes)."""
+    candidates = set()
+    for match in _KEY_DIGITS.finditer(text or ''):
+        digits = only_digits(match.group())
+        candidates.update(digits[:size] for size in (44, 50) if len(digits) >= size)
+    return candidates
+
+
+def valid_cnpj(value: Optional[str]) -> bool:
+    digits = only_digits(value)
+    if len(digits) != 14 or len(set(digits)) == 1:
+        return False
+    for size in (12, 13):
+        weights = list(range(size - 7, 1, -1)) + list(range(9, 1, -1))
+        total = sum(int(digit) * weight for digit, weight in zip(digits, weights))
+        check = 11 - total % 11
+        if (0 if check >= 10 else check) != int(digits[size]):
+            return False
+    return True
+
+
+def valid_cpf(value: Optional[str]) -> bool:
+    digits = only_digits(value)
+    if len(digits) != 11 or len(set(digits)) == 1:
+        return False
+    for size in (9, 10):
+        total = sum(int(digit) * weight for digit, weight in zip(digits, range(size + 1, 1, -1)))
+        check = total * 10 % 11
+        if (0 if check == 10 else check) != int(digits[size]):
+            return False
+    return True
+
+
+def valid_document(value: Optional[str]) -> bool:
+    return valid_cnpj(value) or valid_cpf(value)
+
+
+def taker_section(text: str) -> str:
+    """The text from the taker heading on, or '' when there is no such heading."""
+    match = _TAKER_HEADING.search(text)
+    return text[match.start():] if match else ''
+
+
+def merge_taker_fields(data: Dict[str, Any], taker: Dict[str, Any]) -> Dict[str, Any]:
+    """Fills the taker fields of `data` with what the regex read in the taker block."""
+    merged = dict(data)
+    for taker_field, emitter_field in TAKER_ECHO_FIELDS.items():
+        merged[taker_field] = taker.get(taker_field) or taker.get(emitter_field) or ''
+    # in the taker block the first CPF/CNPJ is the taker's own document
+    merged['taker_cnpj'] = taker.get('taker_cnpj') or ''
+    return merged
+
+
+def regex_to_payload(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Converts the regex importer output to the LLM payload format (ISO dates, numbers)."""
+    payload = dict(data)
+    payload['access_key'] = only_digits(payload.get('access_key'))
+    for field in DATE_FIELDS:
+        payload[field] = _iso(payload.get(field), ('%d/%m/%Y',), date_only=True)
+    for field in DATETIME_FIELDS:
+        payload[field] = _iso(payload.get(field), ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M'))
+    for field in DECIMAL_FIELDS:
+        payload[field] = _decimal(payload.get(field))
+    for field in BOOL_FIELDS:
+        payload[field] = _bool(payload.get(field))
+    for taker_field, emitter_field in TAKER_ECHO_FIELDS.items():
+        if payload.get(taker_field) and payload.get(taker_field) == payload.get(emitter_field):
+            payload[taker_field] = ''
+    return payload
+
+
+def fields_to_complete(payload: Dict[str, Any]) -> list[str]:
+    """Required fields that are missing or fail validation (amounts when totals disagree)."""
+    invalid = {field for field in REQUIRED_FIELDS if payload.get(field) in (None, '')}
+    if payload.get('access_key') and not valid_access_key(payload['access_key']):
+        invalid.add('access_key')
+    for field in ('emitter_cnpj', 'taker_cnpj'):
+        if payload.get(field) and not valid_document(payload[field]):
+            invalid.add(field)
+    if not totals_consistent(payload):
+        invalid.update(AMOUNT_FIELDS)
+    ordered = dict.fromkeys((*REQUIRED_FIELDS, *AMOUNT_FIELDS))
+    return [field for field in ordered if field in invalid]
+
+
+def totals_consistent(payload: Dict[str, Any]) -> bool:
+    service = _as_decimal(payload.get('service_value'))
+    net = _as_decimal(payload.get('totals_net_value'))
+    if service is not None and service <= 0:
+        return False
+    if service is not None and net is not None and net > service + Decimal('0.01'):
+        return False
+    base = _as_decimal(payload.get('service_base_calculo'))
+    rate = _as_decimal(payload.get('service_iss_rate'))
+    iss = _as_decimal(payload.get('service_iss_value'))
+    if service is not None and base is not None and base > service + Decimal('0.01'):
+        return False
+    if base and rate and iss is not None:
+        return abs(base * rate / 100 - iss) <= Decimal('0.05')
+    return True
+
+
+def focus_text(text: str, fields: list[str]) -> str:
+    """Keeps only the lines around the labels of `fields`; the whole text if none is found."""
+    hints = set()
+    for field in fields:
+        hints.update(FIELD_HINTS.get(field, ()))
+        for prefix, words in FIELD_HINT_PREFIXES.items():
+            if field.startswith(prefix):
+                hints.update(words)
+    lines = text.split('\n')
+    keep = set()
+    for idx, line in enumerate(lines):
+        lower_line = line.lower()
+        if any(hint in lower_line for hint in hints):
+            keep.update(
+                range(max(0, idx - HINT_LINES_BEFORE), min(len(lines), idx + HINT_LINES_AFTER + 1))
+            )
+    if not keep:
+        return text
+    return '\n'.join(lines[idx] for idx in sorted(keep))
+
+
+class HybridStats:
+    """Counts how each document was resolved (regex only, partial or full prompt)."""
+
+    def __init__(self):
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, mode: str, fields: int = 0) -> None:
+        with self._lock:
+            self._counts[mode] += 1
+            self._counts['llmFields'] += fields
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'regexOnly': self._counts['regexOnly'],
+                'partial': self._counts['partial'],
+                'full': self._counts['full'],
+                'llmFields': self._counts['llmFields'],
+            }
+
+
+def _iso(value: Optional[str], formats: tuple[str, ...], date_only: bool = False) -> Optional[str]:
+    if not value:
+        return None
+    for fmt in formats:
+        try:
+            parsed = datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            continue
+        return parsed.date().isoformat() if date_only else parsed.isoformat()
+    return None
+
+
+def _decimal(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    normalized = value.replace('R$', '').replace(' ', '').replace('.', '').replace(',', '.')
+    parsed = _as_decimal(normalized)
+    return str(parsed) if parsed is not None else None
+
+
+def _as_decimal(value: Any) -> Optional[Decimal]:
+    if value in (None, ''):
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+def _bool(value: Optional[str]) -> Optional[bool]:
+    if not value:
+        return None
+    lowered = value.strip().lower()
+    if lowered.startswith(('sim', 'yes', 'true')) or lowered in {'s'}:
+        return True
+    if lowered.startswith(('não', 'nao', 'false')) or lowered in {'n'}:
+        return False
+    return None
@@ -0,0 +1,72 @@
+from PIL import Image, ImageOps
+
+# deskew search: +/- MAX_SKEW degrees, measured on a small copy of the page
+MAX_SKEW = 5.0
+SKEW_STEP = 0.5
+SKEW_SAMPLE_WIDTH = 600
+
+
+def preprocess(image: Image.Image) -> Image.Image:
+    """Grayscale, binarize (Otsu) and deskew a rendered page for Tesseract."""
+    gray = ImageOps.autocontrast(image.convert('L'))
+    threshold = otsu_threshold(gray.histogram())
+    binary = gray.point(lambda value: 255 if value > threshold else 0)
+    angle = estimate_skew(binary)
+    if angle:
+        binary = binary.rotate(angle, resample=Image.NEAREST, expand=False, fillcolor=255)
+    return binary
+
+
+def otsu_threshold(histogram: list[int]) -> int:
+    total = sum(histogram)
+    if not total:
+        return 127
+    weighted_total = sum(idx * count for idx, count in enumerate(histogram))
+    background = weighted_background = 0
+    best_threshold, best_variance = 127, -1.0
+    for idx, count in enumerate(histogram):
+        background += count
+        if not background:
+            continue
+        foreground = total - background
+        if not foreground:
+            break
+        weighted_background += idx * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = idx, variance
+    return best_threshold
+
+
+def estimate_skew(binary: Image.Image) -> float:
+    """Returns the rotation (degrees) that best aligns text lines horizontally.
+
+    Uses the projection profile: when lines are level, the ink per row
+    alternates sharply between text and gaps, so its variance peaks.
+    """
+    scale = min(1.0, SKEW_SAMPLE_WIDTH / binary.width)
+    sample = binary.resize(
+        (max(1, int(binary.width * scale)), max(1, int(binary.height * scale))),
+        Image.BOX,
+    )
+    sample = ImageOps.invert(sample)  # ink = bright, so row means measure ink
+
+    best_angle, best_score = 0.0, _profile_variance(sample)
+    steps = int(MAX_SKEW / SKEW_STEP)
+    for step in range(-steps, steps + 1):
+        angle = step * SKEW_STEP
+        if not angle:
+            continue
+        score = _profile_variance(sample.rotate(angle, resample=Image.NEAREST, fillcolor=0))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def _profile_variance(image: Image.Image) -> float:
+    # a 1-pixel-wide BOX resize yields the mean of every row
+    rows = list(image.resize((1, image.height), Image.BOX).getdata())
+    mean = sum(rows) / len(rows)
+    return sum((value - mean) ** 2 for value in rows) / len(rows)
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from PIL import Image
+
+# (left, top, right, bottom) as fractions of the page size
+Box = tuple[float, float, float, float]
+
+
+@dataclass(frozen=True)
+class Zone:
+    name: str
+    box: Box
+
+
+@dataclass(frozen=True)
+class LayoutTemplate:
+    """Where the fields we import sit on a known invoice layout.
+
+    A page matches when the OCR of `detect_box` contains any of `markers`.
+    Only `zones` are OCR'd afterwards, in the given order. Municipal layouts
+    can be added with `register_layout`.
+    """
+
+    name: str
+    markers: tuple[str, ...]
+    detect_box: Box
+    zones: tuple[Zone, ...]
+
+    def matches(self, text: str) -> bool:
+        upper = text.upper()
+        return any(marker in upper for marker in self.markers)
+
+
+_LAYOUTS: Dict[str, LayoutTemplate] = {}
+
+
+def register_layout(layout: LayoutTemplate) -> LayoutTemplate:
+    """Adds a layout in this process (e.g. from an `AppConfig.ready`).
+
+    OCR pool processes do not see it through this registry: the layouts
+    travel inside the `OCRSettings` of each task (`configured_ocr_settings`).
+    """
+    _LAYOUTS[layout.name] = layout
+    return layout
+
+
+def registered_layouts() -> list[LayoutTemplate]:
+    return list(_LAYOUTS.values())
+
+
+def crop(image: Image.Image, box: Box) -> Image.Image:
+    left, top, right, bottom = box
+    width, height = image.size
+    return image.crop(
+        (int(left * width), int(top * height), int(right * width), int(bottom * height))
+    )
+
+
+def match_layout(
+    detect_text: Dict[Box, str], layouts: Optional[Iterable[LayoutTemplate]] = None
+) -> Optional[LayoutTemplate]:
+    for layout in _LAYOUTS.values() if layouts is None else layouts:
+        text = detect_text.get(layout.detect_box)
+        if text and layout.matches(text):
+            return layout
+    return None
+
+
+# National DANFSe (portrait A4). Neighbouring boxes overlap by 1% so a slightly
+# shifted scan does not cut lines in half. The intermediary block, the
+# approximate-taxes strip and the bottom margin are left out.
+DANFSE_NACIONAL = register_layout(
+    LayoutTemplate(
+        name='danfse-nacional',
+        markers=('DANFSE', 'DOCUMENTO AUXILIAR DA NFS'),
+        detect_box=(0.0, 0.0, 1.0, 0.14),
+        zones=(
+            Zone('cabecalho', (0.0, 0.0, 1.0, 0.14)),
+            Zone('emitente', (0.0, 0.13, 1.0, 0.26)),
+            Zone('tomador', (0.0, 0.25, 1.0, 0.36)),
+            Zone('servico', (0.0, 0.41, 1.0, 0.51)),
+            Zone('tributacao', (0.0, 0.50, 1.0, 0.68)),
+            Zone('totais', (0.0, 0.67, 1.0, 0.81)),
+            Zone('informacoes', (0.0, 0.80, 1.0, 0.96)),
+        ),
+    )
+)
@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    AsyncOpenAI,
+    RateLimitError,
+)
+
+from .model_registry import ModelRegistry, endpoint_key
+
+logger = logging.getLogger(__name__)
+
+# jittered exponential backoff when the server gives no Retry-After
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+# never sleep longer than this, whatever Retry-After says
+RETRY_AFTER_MAX_SECONDS = 600.0
+# rough prompt size in tokens, refined with the usage the API reports
+CHARS_PER_TOKEN = 4
+RETRYABLE_STATUS = {408, 409, 429}
+# structured output modes, from the best one down to plain text
+OUTPUT_MODES = ('json_schema', 'json_object', 'text')
+
+_LOCK = threading.Lock()
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_CLIENTS: Dict[tuple[str, str], 'LLMClient'] = {}
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """The loop every LLM request of the process runs on, in a daemon thread."""
+    global _LOOP
+    with _LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='nfse-llm-loop', daemon=True).start()
+            _LOOP = loop
+        return _LOOP
+
+
+def llm_client(api_key: str, base_url: Optional[str] = None) -> 'LLMClient':
+    """Process-wide client per endpoint/key, so limits are shared by every job."""
+    key = (api_key, base_url or '')
+    with _LOCK:
+        if key not in _CLIENTS:
+            _CLIENTS[key] = LLMClient(api_key, base_url)
+        return _CLIENTS[key]
+
+
+class TokenBucket:
+    """Allows `per_minute` units per minute, bursting up to a minute's worth.
+
+    `reserve` always takes the units and returns how long the caller must
+    wait before using them, so waiting callers are served in order.
+    """
+
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60
+        self.capacity = float(per_minute)
+        self.available = self.capacity
+        self.updated = monotonic()
+
+    def reserve(self, amount: float) -> float:
+        if not self.rate:
+            return 0.0
+        now = monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+        self.available -= amount
+        return max(0.0, -self.available / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """Charges (or refunds, when negative) units after the fact."""
+        if self.rate:
+            self.available -= amount
+
+
+class ModelLimiter:
+    """Requests and tokens per minute of one model, plus pauses asked by the API."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+
+    async def acquire(self, tokens: int) -> None:
+        wait = max(
+            self.requests.reserve(1),
+            self.tokens.reserve(tokens),
+            self.paused_until - monotonic(),
+        )
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+
+class LLMClient:
+    """Asyncio OpenAI-compatible client shared by the worker threads.
+
+    Requests run on a single event loop. At most NFSE_LLM_MAX_CONCURRENCY
+    are in flight, each model is held to its requests/tokens per minute, and
+    429/5xx/connection errors are retried with jittered exponential backoff.
+    A `Retry-After` from the server wins over the backoff and, on a 429,
+    pauses every request to that model.
+
+    Requests given a `schema` ask for structured output (NFSE_LLM_OUTPUT_MODE);
+    a model that rejects it is remembered and asked in the next mode down.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        max_in_flight: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ):
+        if timeout is None:
+            timeout = float(getattr(settings, 'NFSE_LLM_TIMEOUT_SECONDS', 120))
+        # retries are ours: the SDK ones ignore the shared rate limiters
+        self._client = AsyncOpenAI(
+            api_key=api_key, base_url=base_url or None, timeout=timeout, max_retries=0
+        )
+        if max_in_flight is None:
+            max_in_flight = int(getattr(settings, 'NFSE_LLM_MAX_CONCURRENCY', 8))
+        self._in_flight = asyncio.Semaphore(max(1, max_in_flight))
+        if max_retries is None:
+            max_retries = int(getattr(settings, 'NFSE_LLM_MAX_RETRIES', 5))
+        self.max_retries = max(0, max_retries)
+        self._limiters: Dict[str, ModelLimiter] = {}
+        mode = getattr(settings, 'NFSE_LLM_OUTPUT_MODE', 'json_schema')
+        self.output_mode = mode if mode in OUTPUT_MODES else 'text'
+        self._output_modes: Dict[str, str] = {}
+        self.registry = ModelRegistry(endpoint_key(api_key, base_url), self.list_models)
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    def complete(self, schema: Optional[Dict[str, Any]] = None, **request) -> Any:
+        """Blocking `chat.completions.create` for worker threads."""
+        future = asyncio.run_coroutine_threadsafe(
+            self.acomplete(schema, **request), _event_loop()
+        )
+        return future.result()
+
+    def list_models(self) -> set[str]:
+        """Ids served by the endpoint (`GET /models`)."""
+
+        async def fetch() -> set[str]:
+            return {model.id async for model in self._client.models.list()}
+
+        return asyncio.run_coroutine_threadsafe(fetch(), _event_loop()).result()
+
+    async def acomplete(self, schema: Optional[Dict[str, Any]] = None, **request) -> Any:
+        """`schema` is `{'name': ..., 'schema': <JSON schema>}` for a JSON answer."""
+        model = request['model']
+        limiter = self._limiter(model)
+        estimated = estimate_tokens(request.get('messages') or [])
+        attempt = 0
+        while True:
+            await limiter.acquire(estimated)
+            mode = self._output_modes.get(model, self.output_mode) if schema else 'text'
+            if mode == 'json_schema':
+                request['response_format'] = {
+                    'type': 'json_schema',
+                    'json_schema': {**schema, 'strict': True},
+                }
+            elif mode == 'json_object':
+                request['response_format'] = {'type': 'json_object'}
+            else:
+                request.pop('response_format', None)
+            try:
+                async with self._in_flight:
+                    response = await self._client.chat.completions.create(**request)
+            except (APIStatusError, APIConnectionError) as exc:
+                if mode != 'text' and is_output_mode_unsupported(exc):
+                    self._output_modes[model] = OUTPUT_MODES[OUTPUT_MODES.index(mode) + 1]
+                    self.logger.warning(
+                        'Modelo %s não aceita saída %s; usando %s.',
+                        model,
+                        mode,
+                        self._output_modes[model],
+                    )
+                    continue
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                delay = retry_after(exc)
+                if delay is not None and isinstance(exc, RateLimitError):
+                    limiter.pause(delay)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                attempt += 1
+                self.logger.warning(
+                    'Requisição ao modelo %s falhou (%s); tentativa %s de %s em %.1fs.',
+                    model,
+                    getattr(exc, 'status_code', None) or exc.__class__.__name__,
+                    attempt,
+                    self.max_retries,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            usage = getattr(response, 'usage', None)
+            total_tokens = getattr(usage, 'total_tokens', None)
+            if total_tokens:
+                limiter.tokens.adjust(total_tokens - estimated)
+            return response
+
+    def _limiter(self, model: str) -> ModelLimiter:
+        # only touched from the event loop thread
+        if model not in self._limiters:
+            requests_per_minute, tokens_per_minute = rate_limits_for(model)
+            self._limiters[model] = ModelLimiter(requests_per_minute, tokens_per_minute)
+        return self._limiters[model]
+
+
+def rate_limits_for(model: str) -> tuple[int, int]:
+    """(requests, tokens) per minute for the model; 0 means unlimited."""
+    overrides = getattr(settings, 'NFSE_LLM_RATE_LIMITS', {}) or {}
+    if model in overrides:
+        limits = list(overrides[model]) + [0, 0]
+        return int(limits[0]), int(limits[1])
+    return (
+        int(getattr(settings, 'NFSE_LLM_REQUESTS_PER_MINUTE', 0)),
+        int(getattr(settings, 'NFSE_LLM_TOKENS_PER_MINUTE', 0)),
+    )
+
+
+def estimate_tokens(messages: list[Dict[str, Any]]) -> int:
+    chars = sum(len(str(message.get('content') or '')) for message in messages)
+    return max(1, chars // CHARS_PER_TOKEN)
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, APIConnectionError):  # includes timeouts
+        return True
+    if isinstance(exc, RateLimitError):
+        # an exhausted quota does not come back by waiting
+        return getattr(exc, 'code', None) != 'insufficient_quota'
+    status = getattr(exc, 'status_code', None) or 0
+    return status in RETRYABLE_STATUS or status >= 500
+
+
+def is_output_mode_unsupported(exc: Exception) -> bool:
+    """Whether the request was refused because of its `response_format`."""
+    if getattr(exc, 'status_code', None) not in (400, 422):
+        return False
+    message = (getattr(exc, 'message', None) or str(exc)).lower()
+    return any(word in message for word in ('response_format', 'json_schema', 'json_object'))
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """Seconds asked by `Retry-After`/`retry-after-ms`, if the response has them."""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return min(RETRY_AFTER_MAX_SECONDS, max(0.0, float(value) / 1000))
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(RETRY_AFTER_MAX_SECONDS, max(0.0, seconds))
+
+
+def backoff_delay(attempt: int) -> float:
+    # "equal jitter": half fixed, half random, so retries never bunch up at 0
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
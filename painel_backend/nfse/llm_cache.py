@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CachedLLMResponse
+
+logger = logging.getLogger(__name__)
+
+# writes between two evictions; the first write of each instance evicts too
+EVICT_EVERY = 50
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """Persistent cache of parsed model answers keyed by (model, prompt hash).
+
+    Entries expire after `ttl_seconds`; once there are more than
+    `max_entries`, the least recently used ones are removed (checked every
+    EVICT_EVERY writes). Hits and misses are counted per instance so callers
+    can report them per job.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        ttl_seconds: Optional[int] = None,
+        max_entries: Optional[int] = None,
+    ):
+        if ttl_seconds is None:
+            ttl_seconds = int(getattr(settings, 'NFSE_LLM_CACHE_TTL_SECONDS', 0))
+        if max_entries is None:
+            max_entries = int(getattr(settings, 'NFSE_LLM_CACHE_MAX_ENTRIES', 0))
+        self.enabled = enabled and max_entries > 0
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    def get(self, models: list[str], key: str) -> Optional[Dict[str, Any]]:
+        """Returns the cached payload, preferring the first model in `models`."""
+        if not self.enabled:
+            return None
+        entries = {
+            entry.model: entry
+            for entry in CachedLLMResponse.objects.filter(model__in=models, prompt_hash=key)
+        }
+        entry = next((entries[model] for model in models if model in entries), None)
+        if entry is not None and self._is_expired(entry):
+            entry.delete()
+            entry = None
+        if entry is None:
+            self._count(hit=False)
+            return None
+
+        CachedLLMResponse.objects.filter(pk=entry.pk).update(
+            hits=F('hits') + 1, last_used_at=timezone.now()
+        )
+        self._count(hit=True)
+        return dict(entry.payload)
+
+    def set(self, model: str, key: str, payload: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        CachedLLMResponse.objects.update_or_create(
+            model=model,
+            prompt_hash=key,
+            defaults={'payload': payload, 'last_used_at': timezone.now()},
+        )
+        with self._lock:
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 1
+        if due:
+            self.evict()
+
+    def evict(self) -> None:
+        if self.ttl_seconds:
+            cutoff = timezone.now() - timedelta(seconds=self.ttl_seconds)
+            CachedLLMResponse.objects.filter(created_at__lt=cutoff).delete()
+        excess = CachedLLMResponse.objects.count() - self.max_entries
+        if excess <= 0:
+            return
+        stale_ids = list(
+            CachedLLMResponse.objects.order_by('last_used_at').values_list('pk', flat=True)[
+                : excess + self.max_entries // 10
+            ]
+        )
+        CachedLLMResponse.objects.filter(pk__in=stale_ids).delete()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'enabled': self.enabled,
+            'hits': hits,
+            'misses': misses,
+            'hitRatio': round(hits / lookups, 3) if lookups else 0,
+        }
+
+    def _is_expired(self, entry: CachedLLMResponse) -> bool:
+        if not self.ttl_seconds:
+            return False
+        return entry.created_at < timezone.now() - timedelta(seconds=self.ttl_seconds)
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
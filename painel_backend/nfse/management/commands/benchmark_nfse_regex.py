@@ -0,0 +1,73 @@
+from pathlib import Path
+from statistics import mean
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nfse.regex_importer import RegexNFSeImporter
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede o tempo de análise (regex) por documento, sem gravar nada. '
+        'A extração do texto não entra na medição.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input_path',
+            help='Arquivo PDF/TXT ou pasta contendo PDFs/TXTs de NFSe.',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help='Quantas vezes cada documento é analisado (padrão: 20).',
+        )
+
+    def handle(self, *args, **options):
+        input_path = Path(options['input_path'])
+        if not input_path.exists():
+            raise CommandError(f'Caminho não encontrado: {input_path}')
+        iterations = max(1, options['iterations'])
+
+        if input_path.is_dir():
+            files = sorted(
+                p for p in input_path.rglob('*') if p.suffix.lower() in {'.pdf', '.txt'}
+            )
+        else:
+            files = [input_path]
+        if not files:
+            self.stdout.write(self.style.WARNING('Nenhum PDF/TXT encontrado na pasta.'))
+            return
+
+        importer = RegexNFSeImporter()
+        texts = []
+        for path in files:
+            if path.suffix.lower() == '.txt':
+                text = path.read_text(encoding='utf-8', errors='replace')
+            else:
+                text = importer.extract_text(path)
+            texts.append((path, importer._normalize_text(text)))
+
+        timings = []
+        for _ in range(iterations):
+            for path, text in texts:
+                start = perf_counter()
+                try:
+                    importer.parse_file(path, text)
+                except ValueError:  # no access key: still a parsed document
+                    pass
+                timings.append(perf_counter() - start)
+
+        timings.sort()
+        total = sum(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{len(texts)} documento(s) x {iterations}: '
+                f'média {mean(timings) * 1000:.3f} ms/doc, '
+                f'p95 {p95 * 1000:.3f} ms/doc, '
+                f'{len(timings) / total:.0f} docs/s'
+            )
+        )
@@ -5,15 +5,16 @@ from time import perf_counter
 from django.core.management.base import BaseCommand, CommandError
 
 from nfse.services import NFSeImporter
+from nfse.xml_importer import is_xml, parse_nfse_xml
 
 
 class Command(BaseCommand):
-    help = 'Importa NFS-e em PDF utilizando OCR + ChatGPT e grava na reinf_NFS.'
+    help = 'Importa NFS-e em PDF (OCR + ChatGPT) ou XML e grava na reinf_NFS.'
 
     def add_arguments(self, parser):
         parser.add_argument(
             'input_path',
-            help='Caminho do arquivo PDF ou de uma pasta contendo PDFs de NFSe.',
+            help='Caminho do arquivo PDF/XML ou de uma pasta contendo PDFs e XMLs de NFSe.',
         )
         parser.add_argument(
             '--api-key',
@@ -33,6 +34,24 @@ class Command(BaseCommand):
             default=None,
             help='Endpoint compatível com OpenAI (ex.: http://127.0.0.1:11434/v1 para Ollama).',
         )
+        parser.add_argument(
+            '--no-llm-cache',
+            dest='no_llm_cache',
+            action='store_true',
+            help='Ignora o cache de respostas do modelo e sempre consulta a API.',
+        )
+        parser.add_argument(
+            '--hybrid',
+            dest='hybrid',
+            action='store_true',
+            help='Extrai por regex e só consulta o modelo para os campos faltantes ou inválidos.',
+        )
+        parser.add_argument(
+            '--force-refresh',
+            dest='force_refresh',
+            action='store_true',
+            help='Reprocessa PDFs cuja chave de acesso já está importada.',
+        )
 
     def handle(self, *args, **options):
         api_key = options.get('api_key') or self._get_api_key()
@@ -43,44 +62,89 @@ class Command(BaseCommand):
         if not input_path.exists():
             raise CommandError(f'Caminho não encontrado: {input_path}')
 
-        importer = NFSeImporter(api_key=api_key, model=options['model'], base_url=options['base_url'])
+        importer = NFSeImporter(
+            api_key=api_key,
+            model=options['model'],
+            base_url=options['base_url'],
+            use_llm_cache=not options['no_llm_cache'],
+            hybrid=True if options['hybrid'] else None,
+            force_refresh=options['force_refresh'],
+        )
         service_dir, other_dir = self._prepare_output_dirs(input_path)
         self.service_dir = service_dir
         self.other_dir = other_dir
         if input_path.is_dir():
             files = sorted(
                 p
-                for p in input_path.rglob('*.pdf')
-                if service_dir not in p.parents and other_dir not in p.parents
+                for p in input_path.rglob('*')
+                if p.suffix.lower() in {'.pdf', '.xml'}
+                and service_dir not in p.parents
+                and other_dir not in p.parents
             )
             if not files:
-                self.stdout.write(self.style.WARNING('Nenhum PDF encontrado na pasta.'))
+                self.stdout.write(self.style.WARNING('Nenhum PDF ou XML encontrado na pasta.'))
                 return
-            for pdf_path in files:
-                self._process_pdf(importer, pdf_path)
+            for file_path in files:
+                self._process(importer, file_path)
         else:
-            self._process_pdf(importer, input_path)
+            self._process(importer, input_path)
 
     def _get_api_key(self):
         import os
 
         return os.getenv('OPENAI_API_KEY')
 
+    def _process(self, importer: NFSeImporter, file_path: Path):
+        if is_xml(file_path.name):
+            self._process_xml(importer, file_path)
+        else:
+            self._process_pdf(importer, file_path)
+
+    def _process_xml(self, importer: NFSeImporter, xml_path: Path):
+        start = perf_counter()
+        try:
+            payloads, voided = parse_nfse_xml(xml_path, xml_path.name)
+            importer.save_payloads(payloads)
+            numbers = ', '.join(payload['number'] for payload in payloads)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'NFSe importada do XML: {numbers} - {xml_path.name} '
+                    f'({perf_counter() - start:.2f}s)'
+                )
+            )
+            if voided:
+                self.stdout.write(
+                    self.style.WARNING(f'{voided} NFSe canceladas ou substituídas ignoradas.')
+                )
+            self._move_file(xml_path, self.service_dir)
+        except Exception as exc:  # pylint: disable=broad-except
+            self.stderr.write(self.style.ERROR(f'Falha em {xml_path}: {exc}'))
+            self._move_file(xml_path, self.other_dir)
+
     def _process_pdf(self, importer: NFSeImporter, pdf_path: Path):
         start = perf_counter()
         try:
+            if importer.known_nfse_id(pdf_path, pdf_path.name) is not None:
+                self.stdout.write(f'Já importada (mesma chave de acesso): {pdf_path.name}')
+                self._move_file(pdf_path, self.service_dir)
+                return
+
             text_start = perf_counter()
-            text = importer.extract_text(pdf_path)
+            is_service, _ = importer.classify_early(pdf_path)
+            if is_service is not False:
+                text = importer.extract_text(pdf_path)
+                if is_service is None:
+                    is_service = importer.is_service_invoice(text)
             text_time = perf_counter() - text_start
-            text_payload = {'text': text, 'time': text_time}
 
-            if not importer.is_service_invoice(text):
+            if not is_service:
                 self.stdout.write(
                     self.style.WARNING(f'Ignorando (não é serviço): {pdf_path.name}')
                 )
                 self._move_file(pdf_path, self.other_dir)
                 return
 
+            text_payload = {'text': text, 'time': text_time}
             nfse = importer.process_file(str(pdf_path), pre_extracted=text_payload)
             self.stdout.write(
                 self.style.SUCCESS(
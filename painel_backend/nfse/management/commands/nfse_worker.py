@@ -0,0 +1,60 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from nfse.worker import JobWorker
+
+
+class Command(BaseCommand):
+    help = 'Processa a fila de jobs de importação de NFSe (rode um ou mais processos).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Quantidade de jobs processados em paralelo por este processo.',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            dest='poll_interval',
+            type=float,
+            default=None,
+            help='Intervalo (s) entre consultas à fila quando não há jobs.',
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            dest='lease_seconds',
+            type=int,
+            default=None,
+            help='Duração do lease de cada job; leases vencidos são recuperados por outros workers.',
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Encerra quando a fila estiver vazia, em vez de aguardar novos jobs.',
+        )
+
+    def handle(self, *args, **options):
+        worker = JobWorker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            lease_duration=options['lease_seconds'],
+        )
+
+        def _shutdown(signum, frame):  # pylint: disable=unused-argument
+            self.stdout.write(
+                self.style.WARNING('Encerrando worker após os arquivos em andamento...')
+            )
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, _shutdown)
+        signal.signal(signal.SIGINT, _shutdown)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Worker {worker.worker_id} iniciado (concorrência: {worker.concurrency}).'
+            )
+        )
+        worker.run(burst=options['burst'])
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker.worker_id} finalizado.'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nfse', '0009_importjob_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='metrics',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
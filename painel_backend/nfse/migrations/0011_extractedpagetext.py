@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nfse', '0010_importjob_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractedPageText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('ocr_language', models.CharField(max_length=20)),
+                ('page_number', models.PositiveIntegerField()),
+                ('page_count', models.PositiveIntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'ocr_language', 'page_number'), name='nfse_page_text_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nfse', '0011_extractedpagetext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedLLMResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=120)),
+                ('prompt_hash', models.CharField(max_length=64)),
+                ('payload', models.JSONField(default=dict)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('model', 'prompt_hash'), name='nfse_llm_response_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nfse', '0013_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMModelAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=64)),
+                ('model', models.CharField(max_length=120)),
+                ('available', models.BooleanField()),
+                ('checked_at', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('endpoint', 'model'), name='nfse_llm_model_availability_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nfse', '0014_llmmodelavailability'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjobfile',
+            name='classified_by',
+            field=models.CharField(blank=True, choices=[('metadata', 'Metadados do PDF'), ('first_page', 'Primeira página'), ('first_page_ocr', 'OCR rápido da primeira página'), ('full', 'Documento completo')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nfse', '0015_importjobfile_classified_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjobfile',
+            name='extra_results',
+            field=models.ManyToManyField(blank=True, related_name='extra_job_files', to='nfse.reinfnfs'),
+        ),
+    ]
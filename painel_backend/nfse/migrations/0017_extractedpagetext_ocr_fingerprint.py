@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nfse', '0016_importjobfile_extra_results'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='extractedpagetext',
+            name='nfse_page_text_unique',
+        ),
+        migrations.AddField(
+            model_name='extractedpagetext',
+            name='ocr_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddConstraint(
+            model_name='extractedpagetext',
+            constraint=models.UniqueConstraint(fields=('content_hash', 'ocr_language', 'ocr_fingerprint', 'page_number'), name='nfse_page_text_unique'),
+        ),
+    ]
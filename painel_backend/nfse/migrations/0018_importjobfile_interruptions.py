@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nfse', '0017_extractedpagetext_ocr_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjobfile',
+            name='interruptions',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
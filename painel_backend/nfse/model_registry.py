@@ -0,0 +1,130 @@
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+from time import monotonic
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .models import LLMModelAvailability
+
+logger = logging.getLogger(__name__)
+
+
+def endpoint_key(api_key: str, base_url: Optional[str]) -> str:
+    # the key is part of it (access differs per account) but never stored
+    return hashlib.sha256(f'{base_url or "openai"}|{api_key}'.encode('utf-8')).hexdigest()
+
+
+def is_listed(model: str, served: set[str]) -> bool:
+    """Whether `model` is in a `/models` listing, `name` and `name:latest` being the same."""
+    if model in served:
+        return True
+    if model.endswith(':latest'):
+        return model[: -len(':latest')] in served
+    return f'{model}:latest' in served
+
+
+class ModelRegistry:
+    """Which models an endpoint serves, so requests skip the unavailable ones.
+
+    A model is only taken as unavailable after a `model_not_found` answer.
+    The `/models` listing just confirms the models it names, since servers
+    accept names it does not list (Ollama lists `llama3.2:latest` and serves
+    `llama3.2`). Entries expire after NFSE_LLM_MODEL_TTL_SECONDS. With
+    NFSE_LLM_MODEL_REGISTRY_DB they are also kept in `LLMModelAvailability`,
+    so other workers and restarts start from what is already known.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        list_models: Callable[[], set[str]],
+        ttl_seconds: Optional[int] = None,
+        persist: Optional[bool] = None,
+    ):
+        if ttl_seconds is None:
+            ttl_seconds = int(getattr(settings, 'NFSE_LLM_MODEL_TTL_SECONDS', 3600))
+        if persist is None:
+            persist = bool(getattr(settings, 'NFSE_LLM_MODEL_REGISTRY_DB', True))
+        self.endpoint = endpoint
+        self.ttl_seconds = ttl_seconds
+        self.persist = persist
+        self._list_models = list_models
+        # model -> (available, monotonic expiry)
+        self._known: Dict[str, tuple[bool, float]] = {}
+        self._refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    def usable(self, candidates: list[str]) -> list[str]:
+        """`candidates` minus the models known to be unavailable (all of them if none is left)."""
+        self._refresh(candidates)
+        usable = [model for model in candidates if self.is_available(model) is not False]
+        return usable or list(candidates)
+
+    def is_available(self, model: str) -> Optional[bool]:
+        with self._lock:
+            entry = self._known.get(model)
+        if entry is None or entry[1] < monotonic():
+            return None
+        return entry[0]
+
+    def mark(self, model: str, available: bool) -> None:
+        if self.is_available(model) is available:
+            return
+        with self._lock:
+            self._known[model] = (available, monotonic() + self.ttl_seconds)
+        if not available:
+            self.logger.info('Modelo %s marcado como indisponível.', model)
+        if self.persist:
+            try:
+                LLMModelAvailability.objects.update_or_create(
+                    endpoint=self.endpoint,
+                    model=model,
+                    defaults={'available': available, 'checked_at': timezone.now()},
+                )
+            except DatabaseError as exc:
+                # only a shortcut for other workers: never fails the request
+                self.logger.warning('Não foi possível gravar o modelo %s (%s).', model, exc)
+
+    def _refresh(self, candidates: list[str]) -> None:
+        with self._lock:
+            now = monotonic()
+            if self._refreshed_at is not None and now - self._refreshed_at < self.ttl_seconds:
+                return
+            # set first: a failing listing is not retried on every request
+            self._refreshed_at = now
+        if self.persist:
+            self._load_persisted()
+        if all(self.is_available(model) is not None for model in candidates):
+            return
+        try:
+            served = self._list_models()
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.info('Lista de modelos indisponível (%s); aprendendo pelas falhas.', exc)
+            return
+        for model in candidates:
+            if is_listed(model, served):
+                self.mark(model, True)
+
+    def _load_persisted(self) -> None:
+        now = timezone.now()
+        try:
+            rows = list(
+                LLMModelAvailability.objects.filter(
+                    endpoint=self.endpoint,
+                    checked_at__gte=now - timedelta(seconds=self.ttl_seconds),
+                )
+            )
+        except DatabaseError as exc:
+            # as in `mark`: the in-memory state is enough to serve the request
+            self.logger.warning('Não foi possível ler os modelos gravados (%s).', exc)
+            return
+        with self._lock:
+            for row in rows:
+                remaining = self.ttl_seconds - (now - row.checked_at).total_seconds()
+                self._known[row.model] = (row.available, monotonic() + remaining)
@@ -1,7 +1,9 @@
 from uuid import uuid4
 
+from django.conf import settings
 from django.db import models
-from django.db.models import Count, Q
+from django.db.models import Case, Count, F, Q, When
+from django.utils import timezone
 
 
 class PayrollCompanyManager(models.Manager):
@@ -96,6 +98,72 @@ class ReinfNFS(models.Model):
         return f'NFSe {self.number} - {self.emitter_name}'
 
 
+class ExtractedPageText(models.Model):
+    """Normalized text of a PDF page, keyed by the SHA-256 of the PDF bytes."""
+
+    content_hash = models.CharField(max_length=64)
+    ocr_language = models.CharField(max_length=20)
+    # OCRSettings.fingerprint(): text OCR'd with other settings is not reused
+    ocr_fingerprint = models.CharField(max_length=16, blank=True, default='')
+    page_number = models.PositiveIntegerField()
+    page_count = models.PositiveIntegerField()
+    text = models.TextField(blank=True)
+    size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['content_hash', 'ocr_language', 'ocr_fingerprint', 'page_number'],
+                name='nfse_page_text_unique',
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.content_hash[:12]} p{self.page_number}/{self.page_count}'
+
+
+class CachedLLMResponse(models.Model):
+    """Parsed JSON answer of the model for a given prompt."""
+
+    model = models.CharField(max_length=120)
+    prompt_hash = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['model', 'prompt_hash'], name='nfse_llm_response_unique'
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.model} {self.prompt_hash[:12]}'
+
+
+class LLMModelAvailability(models.Model):
+    """Whether a model answered on an endpoint, shared by every worker."""
+
+    endpoint = models.CharField(max_length=64)
+    model = models.CharField(max_length=120)
+    available = models.BooleanField()
+    checked_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['endpoint', 'model'], name='nfse_llm_model_availability_unique'
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.model} ({"disponível" if self.available else "indisponível"})'
+
+
 class ImportJob(models.Model):
     class Status(models.TextChoices):
         PENDING = 'pending', 'Pendente'
@@ -111,15 +179,45 @@ class ImportJob(models.Model):
     totals_completed = models.PositiveIntegerField(default=0)
     totals_failed = models.PositiveIntegerField(default=0)
     totals_ignored = models.PositiveIntegerField(default=0)
+    lease_owner = models.CharField(max_length=120, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    metrics = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
 
+    # file status -> counter it is tallied in (mirrors refresh_totals)
+    TOTALS_FIELD_BY_FILE_STATUS = {
+        'pending': 'totals_processing',
+        'uploading': 'totals_processing',
+        'processing': 'totals_processing',
+        'completed': 'totals_completed',
+        'error': 'totals_failed',
+        'ignored': 'totals_ignored',
+        'skipped': 'totals_ignored',
+    }
+
     def __str__(self) -> str:
         return f'Job {self.id}'
 
+    def add_to_totals(self, deltas: dict) -> None:
+        """Applies counter deltas in place, without recounting the files."""
+        updates = {}
+        for name, delta in deltas.items():
+            if delta > 0:
+                updates[name] = F(name) + delta
+            elif delta < 0:
+                # counters are unsigned on MySQL: never compute a negative value
+                updates[name] = Case(
+                    When(**{f'{name}__gte': -delta}, then=F(name) + delta), default=0
+                )
+        if updates:
+            ImportJob.objects.filter(pk=self.pk).update(updated_at=timezone.now(), **updates)
+
     def refresh_totals(self):
         agg = self.files.aggregate(
             total=Count('id'),
@@ -176,6 +274,14 @@ class ImportJobFile(models.Model):
         DONE = 'done', 'Finalizado'
         ERROR = 'error', 'Erro'
 
+    class Classification(models.TextChoices):
+        """What decided whether the file is a service invoice."""
+
+        METADATA = 'metadata', 'Metadados do PDF'
+        FIRST_PAGE = 'first_page', 'Primeira página'
+        FIRST_PAGE_OCR = 'first_page_ocr', 'OCR rápido da primeira página'
+        FULL = 'full', 'Documento completo'
+
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     job = models.ForeignKey(
         ImportJob, related_name='files', on_delete=models.CASCADE, db_index=True
@@ -188,9 +294,16 @@ class ImportJobFile(models.Model):
     progress = models.PositiveSmallIntegerField(default=0)
     message = models.TextField(blank=True)
     export_to_others = models.BooleanField(default=False)
+    classified_by = models.CharField(max_length=20, choices=Classification.choices, blank=True)
+    # times a worker died while the file was being processed
+    interruptions = models.PositiveSmallIntegerField(default=0)
     result = models.ForeignKey(
         ReinfNFS, null=True, blank=True, on_delete=models.SET_NULL, related_name='job_files'
     )
+    # the other notes of a file holding many (XML), `result` being the first
+    extra_results = models.ManyToManyField(
+        ReinfNFS, blank=True, related_name='extra_job_files'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -199,3 +312,31 @@ class ImportJobFile(models.Model):
 
     def __str__(self) -> str:
         return f'{self.file_name} ({self.status})'
+
+
+class UploadSession(models.Model):
+    """A chunked upload in progress; bytes are appended to `partial_path`."""
+
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='nfse_upload_sessions',
+    )
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    checksum = models.CharField(max_length=64, blank=True)
+    offset = models.BigIntegerField(default=0)
+    partial_path = models.CharField(max_length=500)
+    upload_token = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f'{self.file_name} ({self.offset}/{self.size})'
+
+    @property
+    def completed(self) -> bool:
+        return bool(self.upload_token)
@@ -0,0 +1,16 @@
+from django.conf import settings
+
+from .extraction import OCRSettings
+from .layouts import registered_layouts
+
+
+def configured_ocr_settings() -> OCRSettings:
+    """OCRSettings from the NFSE_OCR_* settings (extraction.py stays free of Django)."""
+    return OCRSettings(
+        dpi_steps=tuple(int(dpi) for dpi in getattr(settings, 'NFSE_OCR_DPI_STEPS', (200, 300))),
+        min_confidence=float(getattr(settings, 'NFSE_OCR_MIN_CONFIDENCE', 70)),
+        preprocess=bool(getattr(settings, 'NFSE_OCR_PREPROCESS', True)),
+        use_layouts=bool(getattr(settings, 'NFSE_OCR_LAYOUT_ZONES', True)),
+        # sent with every page task, so layouts registered at runtime reach the pool
+        layouts=tuple(registered_layouts()),
+    )
@@ -0,0 +1,78 @@
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db import connections, router
+
+from auditlog.registry import is_registered
+from auditlog.signals import audited_fields, log_bulk_save, previous_values
+
+from .models import ReinfNFS
+
+UPSERT_FIELDS = [
+    field.name
+    for field in ReinfNFS._meta.concrete_fields
+    if field.name not in {'id', 'access_key', 'created_at'}
+]
+
+
+def persist_batch_size() -> int:
+    return max(1, int(getattr(settings, 'NFSE_PERSIST_BATCH_SIZE', 200)))
+
+
+def bulk_upsert(
+    records: list[tuple[str, Dict[str, Any]]], chunk_size: Optional[int] = None
+) -> Dict[str, int]:
+    """Creates or updates ReinfNFS rows from (access_key, values) pairs.
+
+    Each chunk is written with a single `INSERT ... ON DUPLICATE KEY UPDATE`
+    (`ON CONFLICT` on other backends) and the ids are read back with one
+    SELECT. Model signals are not sent, so when ReinfNFS is audited the
+    previous rows are read first and the audit logs of the chunk are
+    written with one more INSERT. Returns the ReinfNFS id per access key.
+    """
+    chunk_size = chunk_size or persist_batch_size()
+    latest: Dict[str, Dict[str, Any]] = {}
+    for access_key, values in records:
+        # the same key twice in one statement is an error on some backends
+        latest[access_key] = values
+    keys = list(latest)
+
+    db_alias = router.db_for_write(ReinfNFS)
+    # MySQL's ON DUPLICATE KEY UPDATE has no conflict target; Django refuses
+    # unique_fields there and the unique index on access_key is used instead
+    features = connections[db_alias].features
+    unique_fields = ['access_key'] if features.supports_update_conflicts_with_target else None
+    audited = is_registered(ReinfNFS)
+    fields = audited_fields(ReinfNFS, UPSERT_FIELDS)
+
+    ids: Dict[str, int] = {}
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start : start + chunk_size]
+        previous: Dict[str, Optional[dict]] = {}
+        if audited:
+            existing = list(ReinfNFS.objects.filter(access_key__in=chunk))
+            previous = dict(
+                zip(
+                    (nfse.access_key for nfse in existing),
+                    previous_values(ReinfNFS, existing, fields),
+                )
+            )
+        instances = [ReinfNFS(access_key=key, **latest[key]) for key in chunk]
+        ReinfNFS.objects.bulk_create(
+            instances,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=UPSERT_FIELDS,
+        )
+        ids.update(
+            ReinfNFS.objects.filter(access_key__in=chunk).values_list('access_key', 'pk')
+        )
+        if audited:
+            for instance in instances:
+                instance.pk = ids[instance.access_key]
+            log_bulk_save(
+                ReinfNFS,
+                [(instance, previous.get(instance.access_key)) for instance in instances],
+                fields,
+            )
+    return ids
@@ -0,0 +1,636 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import monotonic, perf_counter
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.utils import timezone
+
+from auditlog.registry import is_registered
+from auditlog.signals import audited_fields, log_bulk_save, previous_values
+
+from .extraction import init_ocr_process
+from .models import ImportJob, ImportJobFile, ReinfNFS
+from .persistence import bulk_upsert, persist_batch_size
+from .services import NFSeImporter
+from .text_cache import file_digest
+from .xml_importer import is_xml, parse_nfse_xml
+
+logger = logging.getLogger(__name__)
+
+STAGE_EXTRACT = 'extract'
+STAGE_LLM = 'llm'
+STAGE_PERSIST = 'persist'
+STAGES = (STAGE_EXTRACT, STAGE_LLM, STAGE_PERSIST)
+
+_OCR_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+_DONE = object()
+
+
+@dataclass
+class JobRun:
+    """State shared by the files of one job while it is being processed."""
+
+    job: ImportJob
+    importer: NFSeImporter
+    parallel: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    pending_totals: Counter = field(default_factory=Counter)
+    totals_flushed_at: float = field(default_factory=monotonic)
+
+    def file_finished(self, status: str, count: int = 1) -> None:
+        """Moves `count` open files to the counter of `status`.
+
+        Deltas are accumulated in memory and written by `flush_totals`, so
+        the job row is touched at most once per flush interval instead of
+        being recounted after every file. `run_job` recounts once at the end.
+        """
+        with self.lock:
+            self.pending_totals['totals_processing'] -= count
+            self.pending_totals[ImportJob.TOTALS_FIELD_BY_FILE_STATUS[status]] += count
+        self.flush_totals()
+
+    def flush_totals(self, force: bool = False) -> None:
+        interval = float(getattr(settings, 'NFSE_JOB_TOTALS_FLUSH_INTERVAL', 1))
+        with self.lock:
+            if not self.pending_totals:
+                return
+            if not force and monotonic() - self.totals_flushed_at < interval:
+                return
+            self.job.add_to_totals(self.pending_totals)
+            self.pending_totals.clear()
+            self.totals_flushed_at = monotonic()
+
+    def save_metrics(self, **sections) -> None:
+        with self.lock:
+            self.job.metrics = {
+                **(self.job.metrics or {}),
+                **sections,
+                'llmCache': self.importer.llm_cache.stats(),
+                'llmRequests': self.importer.llm_requests,
+            }
+            if self.importer.hybrid:
+                self.job.metrics['hybrid'] = self.importer.hybrid_stats.as_dict()
+            ImportJob.objects.filter(pk=self.job.pk).update(metrics=self.job.metrics)
+
+
+@dataclass
+class FileWork:
+    """A file travelling through the pipeline stages."""
+
+    job_file: ImportJobFile
+    file_path: str = ''
+    # SHA-256 of the file, hashed once for the text cache lookups
+    digest: Optional[str] = None
+    text: str = ''
+    text_time: float = 0
+    has_billing_markers: bool = False
+    payload: Optional[Dict[str, Any]] = None
+
+
+def ocr_pool() -> ProcessPoolExecutor:
+    global _OCR_POOL
+    with _POOL_LOCK:
+        if _OCR_POOL is None:
+            # spawn: the worker process is multi-threaded, forking it is unsafe
+            # one page per task: the pool size caps concurrent Tesseract runs
+            _OCR_POOL = ProcessPoolExecutor(
+                max_workers=int(getattr(settings, 'NFSE_OCR_PROCESSES', 2)),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_ocr_process,
+            )
+        return _OCR_POOL
+
+
+def resolve_path(stored_name: str) -> str:
+    storage = default_storage
+    if hasattr(storage, 'path'):
+        return storage.path(stored_name)
+    # fallback: download to a temporary file
+    tmp_dir = Path('/tmp/nfse_uploads')
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    destination = tmp_dir / Path(stored_name).name
+    with storage.open(stored_name, 'rb') as source, open(destination, 'wb') as target:
+        target.write(source.read())
+    return str(destination)
+
+
+def extract_text(run: JobRun, file_path: str, digest: Optional[str] = None) -> tuple[str, float]:
+    text_start = perf_counter()
+    text = run.importer.extract_text(Path(file_path), digest)
+    return text, perf_counter() - text_start
+
+
+def _start_file(job_file: ImportJobFile) -> None:
+    job_file.status = ImportJobFile.Status.PROCESSING
+    job_file.stage = ImportJobFile.Stage.OCR
+    job_file.progress = 5
+    job_file.message = ''
+    job_file.save(update_fields=['status', 'stage', 'progress', 'message', 'updated_at'])
+
+
+def _set_stage(job_file: ImportJobFile, stage: str, progress: int) -> None:
+    job_file.stage = stage
+    job_file.progress = progress
+    job_file.save(update_fields=['stage', 'progress', 'updated_at'])
+
+
+def _ignore_file(run: JobRun, job_file: ImportJobFile) -> None:
+    job_file.status = ImportJobFile.Status.IGNORED
+    job_file.stage = ImportJobFile.Stage.DONE
+    job_file.progress = 100
+    job_file.message = 'Ignorado: não parece ser NF de serviços.'
+    job_file.save(
+        update_fields=['status', 'stage', 'progress', 'message', 'classified_by', 'updated_at']
+    )
+    run.file_finished(job_file.status)
+
+
+def _complete_file(
+    run: JobRun,
+    job_file: ImportJobFile,
+    result_id: int,
+    has_billing_markers: bool,
+    message: str = 'NF importada com sucesso.',
+) -> None:
+    job_file.status = ImportJobFile.Status.COMPLETED
+    job_file.stage = ImportJobFile.Stage.DONE
+    job_file.progress = 100
+    job_file.message = message
+    job_file.result_id = result_id
+    job_file.export_to_others = has_billing_markers
+    job_file.save(
+        update_fields=[
+            'status',
+            'stage',
+            'progress',
+            'message',
+            'result',
+            'export_to_others',
+            'classified_by',
+            'updated_at',
+        ]
+    )
+    run.file_finished(job_file.status)
+
+
+def _complete_batch(
+    run: JobRun, works: list['FileWork'], ids: Dict[str, int], access_keys: list[str]
+) -> None:
+    """Marks many files as completed with a single UPDATE round."""
+    now = timezone.now()
+    job_files = []
+    for work, access_key in zip(works, access_keys):
+        job_file = work.job_file
+        job_file.status = ImportJobFile.Status.COMPLETED
+        job_file.stage = ImportJobFile.Stage.DONE
+        job_file.progress = 100
+        job_file.message = 'NF importada com sucesso.'
+        job_file.result_id = ids[access_key]
+        job_file.export_to_others = work.has_billing_markers
+        job_file.updated_at = now
+        job_files.append(job_file)
+    update_fields = [
+        'status',
+        'stage',
+        'progress',
+        'message',
+        'result',
+        'export_to_others',
+        'classified_by',
+        'updated_at',
+    ]
+    # bulk_update sends no signals: the audit logs are written here
+    audited = is_registered(ImportJobFile)
+    if audited:
+        fields = audited_fields(ImportJobFile, update_fields)
+        previous = previous_values(ImportJobFile, job_files, fields)
+    ImportJobFile.objects.bulk_update(job_files, update_fields)
+    if audited:
+        log_bulk_save(ImportJobFile, list(zip(job_files, previous)), fields)
+    run.file_finished(ImportJobFile.Status.COMPLETED, count=len(job_files))
+
+
+def _fail_file(run: JobRun, job_file: ImportJobFile, exc: Exception) -> None:
+    job_file.status = ImportJobFile.Status.ERROR
+    job_file.stage = ImportJobFile.Stage.ERROR
+    job_file.progress = 100
+    job_file.message = str(exc)
+    job_file.save(
+        update_fields=['status', 'stage', 'progress', 'message', 'classified_by', 'updated_at']
+    )
+    run.file_finished(job_file.status)
+
+
+def _link_known(run: JobRun, job_file: ImportJobFile, nfse_id: int) -> None:
+    """Completes a file already imported before, pointing to the same ReinfNFS.
+
+    The note takes the company and competence period of this job, as a new
+    extraction of it would.
+    """
+    # the latest earlier file knows whether the document had billing markers
+    export_to_others = (
+        ImportJobFile.objects.filter(result_id=nfse_id)
+        .exclude(pk=job_file.pk)
+        .order_by('-updated_at')
+        .values_list('export_to_others', flat=True)
+        .first()
+    )
+    nfse = ReinfNFS.objects.only('company_code', 'competence_period').get(pk=nfse_id)
+    changed = [
+        name
+        for name in ('company_code', 'competence_period')
+        if getattr(nfse, name) != getattr(run.importer, name)
+    ]
+    if changed:
+        for name in changed:
+            setattr(nfse, name, getattr(run.importer, name))
+        nfse.save(update_fields=[*changed, 'updated_at'])
+    _complete_file(
+        run,
+        job_file,
+        nfse_id,
+        bool(export_to_others),
+        'NF já importada anteriormente; vinculada ao registro existente.',
+    )
+
+
+def _import_xml(run: JobRun, work: FileWork) -> None:
+    """Saves the notes of an NFS-e XML as they are: no OCR and no model."""
+    _set_stage(work.job_file, ImportJobFile.Stage.PERSISTING, 90)
+    payloads, voided = parse_nfse_xml(Path(work.file_path), work.job_file.file_name)
+    ids = run.importer.save_payloads(payloads)
+    note_ids = list(dict.fromkeys(ids[payload['access_key']] for payload in payloads))
+    work.job_file.extra_results.set(note_ids[1:])
+    if len(payloads) == 1:
+        message = 'NF importada do XML.'
+    else:
+        message = f'{len(payloads)} NF importadas do XML.'
+    if voided:
+        message += f' {voided} cancelada(s) ou substituída(s) ignorada(s).'
+    _complete_file(run, work.job_file, note_ids[0], False, message)
+
+
+def _extract_stage(run: JobRun, work: FileWork) -> bool:
+    """Classifies and extracts the file; returns False when it needs no more stages.
+
+    Files whose access key is already imported are linked to that note.
+    Then the metadata and first page are looked at, so files that are
+    clearly not service invoices are dropped before the rest is read.
+    XML files are imported right here.
+    """
+    _start_file(work.job_file)
+    work.file_path = resolve_path(work.job_file.stored_file.name)
+    if is_xml(work.job_file.file_name):
+        _import_xml(run, work)
+        return False
+
+    if run.importer.text_cache.enabled:
+        work.digest = file_digest(Path(work.file_path))
+    nfse_id = run.importer.known_nfse_id(
+        Path(work.file_path), work.job_file.file_name, work.digest
+    )
+    if nfse_id is not None:
+        _link_known(run, work.job_file, nfse_id)
+        return False
+
+    classify_start = perf_counter()
+    is_service, work.job_file.classified_by = run.importer.classify_early(
+        Path(work.file_path), work.digest
+    )
+    classify_time = perf_counter() - classify_start
+    if is_service is False:
+        _ignore_file(run, work.job_file)
+        return False
+
+    work.text, work.text_time = extract_text(run, work.file_path, work.digest)
+    work.text_time += classify_time
+    work.has_billing_markers = run.importer.has_billing_markers(work.text)
+    if is_service is None:
+        work.job_file.classified_by = ImportJobFile.Classification.FULL
+        if not run.importer.is_service_invoice(work.text):
+            _ignore_file(run, work.job_file)
+            return False
+    return True
+
+
+def _llm_stage(run: JobRun, work: FileWork) -> None:
+    _set_stage(work.job_file, ImportJobFile.Stage.AI, 65)
+    work.payload = run.importer.extract_payload(work.text, work.job_file.file_name)
+
+
+def _persist_stage(run: JobRun, work: FileWork) -> None:
+    _set_stage(work.job_file, ImportJobFile.Stage.PERSISTING, 90)
+    nfse = run.importer.save_payload(work.payload)
+    _complete_file(run, work.job_file, nfse.pk, work.has_billing_markers)
+
+
+def process_file(run: JobRun, job_file: ImportJobFile) -> None:
+    """Runs every stage for a single file (sequential mode)."""
+    work = FileWork(job_file=job_file)
+    try:
+        if not _extract_stage(run, work):
+            return
+        _llm_stage(run, work)
+        _persist_stage(run, work)
+    except Exception as exc:  # pylint: disable=broad-except
+        _fail_file(run, job_file, exc)
+
+
+@dataclass
+class StageStats:
+    workers: int
+    processed: int = 0
+    failed: int = 0
+    busy_seconds: float = 0
+    max_seconds: float = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        done = self.processed + self.failed
+        return {
+            'workers': self.workers,
+            'processed': self.processed,
+            'failed': self.failed,
+            'busySeconds': round(self.busy_seconds, 3),
+            'avgSeconds': round(self.busy_seconds / done, 3) if done else 0,
+            'maxSeconds': round(self.max_seconds, 3),
+        }
+
+
+class ImportPipeline:
+    """Runs the files of a job through extract → LLM → persist stages.
+
+    Stages are connected by bounded queues, so file N+1 is extracted while
+    file N waits on the model and a slow stage applies back-pressure to the
+    one before it. Queue depths and per-stage timings are published to
+    `ImportJob.metrics['pipeline']` while the job runs.
+    """
+
+    def __init__(
+        self,
+        run: JobRun,
+        stop_event: Optional[threading.Event] = None,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+    ):
+        self.run = run
+        self.stop_event = stop_event or threading.Event()
+        workers = max(1, workers or int(getattr(settings, 'NFSE_JOB_MAX_PARALLEL_FILES', 4)))
+        queue_size = queue_size or int(getattr(settings, 'NFSE_PIPELINE_QUEUE_SIZE', 8))
+        self.workers = {STAGE_EXTRACT: workers, STAGE_LLM: workers, STAGE_PERSIST: 1}
+        self.batch_size = persist_batch_size()
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in STAGES}
+        # room for a full batch to pile up while the previous one is written
+        self.queues[STAGE_PERSIST] = queue.Queue(maxsize=max(queue_size, self.batch_size))
+        self.stats = {stage: StageStats(workers=count) for stage, count in self.workers.items()}
+        self._stats_lock = threading.Lock()
+        self._finished = threading.Event()
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    def process(self, files: list[ImportJobFile]) -> None:
+        monitor = threading.Thread(
+            target=self._monitor_loop, name='nfse-pipeline-metrics', daemon=True
+        )
+        monitor.start()
+
+        if self.run.importer.batch_size > 1:
+            llm_loop = (self._llm_batch_loop, ())
+        else:
+            llm_loop = (self._stage_loop, (STAGE_LLM, self._handle_llm))
+        loops = {
+            STAGE_EXTRACT: (self._stage_loop, (STAGE_EXTRACT, self._handle_extract)),
+            STAGE_LLM: llm_loop,
+            STAGE_PERSIST: (self._persist_loop, ()),
+        }
+        threads = {
+            stage: [
+                threading.Thread(
+                    target=loops[stage][0],
+                    args=loops[stage][1],
+                    name=f'nfse-{stage}-{idx}',
+                )
+                for idx in range(self.workers[stage])
+            ]
+            for stage in STAGES
+        }
+        for stage_threads in threads.values():
+            for thread in stage_threads:
+                thread.start()
+
+        try:
+            for job_file in files:
+                if self.stop_event.is_set():
+                    break
+                self.queues[STAGE_EXTRACT].put(FileWork(job_file=job_file))
+        finally:
+            # drain stage by stage: a stage is told to finish only after the
+            # previous one has pushed all of its work downstream
+            for stage in STAGES:
+                for _ in threads[stage]:
+                    self.queues[stage].put(_DONE)
+                for thread in threads[stage]:
+                    thread.join()
+            self._finished.set()
+            monitor.join()
+            self._publish_metrics()
+
+        self.logger.info(
+            'Pipeline do job %s finalizado: %s', self.run.job.pk, self.metrics()
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stages = {stage: stats.as_dict() for stage, stats in self.stats.items()}
+            per_worker = {
+                stage: stats.busy_seconds / stats.workers
+                for stage, stats in self.stats.items()
+            }
+        bottleneck = max(per_worker, key=per_worker.get) if any(per_worker.values()) else ''
+        return {
+            'stages': stages,
+            'queues': {stage: self.queues[stage].qsize() for stage in STAGES},
+            'bottleneck': bottleneck,
+            'running': not self._finished.is_set(),
+            'updatedAt': timezone.now().isoformat(),
+        }
+
+    def _stage_loop(self, stage: str, handler) -> None:
+        try:
+            while True:
+                work = self.queues[stage].get()
+                if work is _DONE:
+                    return
+                if stage == STAGE_EXTRACT and self.stop_event.is_set():
+                    # leave the file pending for the next claim of the job
+                    continue
+                start = perf_counter()
+                ok = True
+                try:
+                    handler(work)
+                except Exception as exc:  # pylint: disable=broad-except
+                    ok = False
+                    self._fail(work, exc)
+                self._record(stage, perf_counter() - start, processed=int(ok), failed=int(not ok))
+        finally:
+            connection.close()
+
+    def _persist_loop(self) -> None:
+        """Writes whatever has piled up in the persist queue as one batch."""
+        persist_queue = self.queues[STAGE_PERSIST]
+        finished = False
+        try:
+            while not finished:
+                work = persist_queue.get()
+                if work is _DONE:
+                    return
+                batch = [work]
+                while len(batch) < self.batch_size:
+                    try:
+                        work = persist_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if work is _DONE:
+                        finished = True
+                        break
+                    batch.append(work)
+
+                start = perf_counter()
+                failed = self._persist_batch(batch)
+                self._record(
+                    STAGE_PERSIST,
+                    perf_counter() - start,
+                    processed=len(batch) - failed,
+                    failed=failed,
+                )
+        finally:
+            connection.close()
+
+    def _llm_batch_loop(self) -> None:
+        """Sends the files that reach the LLM queue close together in one request.
+
+        A batch waits at most NFSE_LLM_BATCH_LINGER_SECONDS for more files.
+        """
+        llm_queue = self.queues[STAGE_LLM]
+        batch_size = self.run.importer.batch_size
+        linger = float(getattr(settings, 'NFSE_LLM_BATCH_LINGER_SECONDS', 1))
+        finished = False
+        try:
+            while not finished:
+                work = llm_queue.get()
+                if work is _DONE:
+                    return
+                batch = [work]
+                deadline = monotonic() + linger
+                while len(batch) < batch_size:
+                    try:
+                        work = llm_queue.get(timeout=max(0, deadline - monotonic()))
+                    except queue.Empty:
+                        break
+                    if work is _DONE:
+                        finished = True
+                        break
+                    batch.append(work)
+
+                start = perf_counter()
+                try:
+                    failed = self._llm_batch(batch)
+                except Exception as exc:  # pylint: disable=broad-except
+                    # a dead batch thread would leave the extract stage blocked on a full queue
+                    failed = len(batch)
+                    for work in batch:
+                        self._fail(work, exc)
+                self._record(
+                    STAGE_LLM, perf_counter() - start, processed=len(batch) - failed, failed=failed
+                )
+        finally:
+            connection.close()
+
+    def _llm_batch(self, batch: list[FileWork]) -> int:
+        """Extracts the payloads of the batch; returns how many files failed."""
+        for work in batch:
+            _set_stage(work.job_file, ImportJobFile.Stage.AI, 65)
+        results = self.run.importer.extract_payloads(
+            [(work.text, work.job_file.file_name) for work in batch]
+        )
+        failed = 0
+        for work, result in zip(batch, results):
+            if isinstance(result, Exception):
+                failed += 1
+                self._fail(work, result)
+                continue
+            work.payload = result
+            self.queues[STAGE_PERSIST].put(work)
+        return failed
+
+    def _persist_batch(self, batch: list[FileWork]) -> int:
+        """Upserts the batch; returns how many files failed."""
+        failed = 0
+        ready, records = [], []
+        for work in batch:
+            try:
+                records.append(self.run.importer.build_record(work.payload))
+                ready.append(work)
+            except Exception as exc:  # pylint: disable=broad-except
+                failed += 1
+                self._fail(work, exc)
+        if not ready:
+            return failed
+
+        try:
+            ids = bulk_upsert(records)
+            _complete_batch(self.run, ready, ids, [access_key for access_key, _ in records])
+        except Exception:  # pylint: disable=broad-except
+            # one bad row must not sink the whole batch: retry row by row
+            self.logger.exception(
+                'Falha ao gravar lote de %s NFSe; gravando individualmente.', len(ready)
+            )
+            for work in ready:
+                try:
+                    _persist_stage(self.run, work)
+                except Exception as exc:  # pylint: disable=broad-except
+                    failed += 1
+                    self._fail(work, exc)
+        return failed
+
+    def _fail(self, work: FileWork, exc: Exception) -> None:
+        try:
+            _fail_file(self.run, work.job_file, exc)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception('Falha ao registrar erro do arquivo %s.', work.job_file.pk)
+
+    def _handle_extract(self, work: FileWork) -> None:
+        if _extract_stage(self.run, work):
+            self.queues[STAGE_LLM].put(work)
+
+    def _handle_llm(self, work: FileWork) -> None:
+        _llm_stage(self.run, work)
+        self.queues[STAGE_PERSIST].put(work)
+
+    def _record(self, stage: str, elapsed: float, processed: int = 0, failed: int = 0) -> None:
+        with self._stats_lock:
+            stats = self.stats[stage]
+            stats.processed += processed
+            stats.failed += failed
+            stats.busy_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+
+    def _monitor_loop(self) -> None:
+        interval = float(getattr(settings, 'NFSE_PIPELINE_METRICS_INTERVAL', 2))
+        try:
+            while not self._finished.wait(interval):
+                self._publish_metrics()
+        finally:
+            connection.close()
+
+    def _publish_metrics(self) -> None:
+        self.run.flush_totals()
+        self.run.save_metrics(pipeline=self.metrics())
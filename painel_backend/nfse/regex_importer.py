@@ -3,18 +3,67 @@ import re
 from datetime import datetime
 from decimal import Decimal
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, NamedTuple, Optional
 
-import pdfplumber
-import pytesseract
-from PIL import Image
 from django.utils import timezone as django_timezone
-from pdf2image import convert_from_path
 
+from .extraction import PDFTextExtractor, normalize_text
 from .models import ReinfNFS
+from .ocr_config import configured_ocr_settings
+from .persistence import bulk_upsert
+from .text_analysis import KeywordSets
+from .text_cache import PageTextCache
 
 logger = logging.getLogger(__name__)
 
+# free text that runs until the next numbered item or "Label:" line
+_BLOCK_TAIL = r'[:\-–]*\s*(.+?)(?:\n\d+\.\s|\n[A-Z][^\n]{0,40}:|$)'
+_NON_DIGITS = re.compile(r'\D')
+
+
+class FieldRule(NamedTuple):
+    """`pattern` must start with one of `labels` (lowercase literals)."""
+
+    field: str
+    labels: tuple[str, ...]
+    pattern: str
+    block: bool = False
+
+
+def _block_rule(field: str, labels: tuple[str, ...], label: str) -> FieldRule:
+    return FieldRule(field, labels, label + _BLOCK_TAIL, block=True)
+
+
+def _compile_rules(rules: list[FieldRule]):
+    """Builds the field order, the label -> rules dispatch table and the label scanner.
+
+    Labels must not contain one another past their first character, otherwise
+    the scanner would step over an occurrence.
+    """
+    order: list[str] = []
+    priorities: Dict[str, int] = {}
+    dispatch: Dict[str, list[tuple[str, int, re.Pattern, bool]]] = {}
+    labels = {label for rule in rules for label in rule.labels}
+    for label in labels:
+        if any(other in label[1:] for other in labels):
+            raise ValueError(f'O rótulo {label!r} contém outro rótulo.')
+    for rule in rules:
+        if rule.field not in priorities:
+            order.append(rule.field)
+        priority = priorities.get(rule.field, 0)
+        priorities[rule.field] = priority + 1
+        flags = re.IGNORECASE | re.DOTALL if rule.block else re.IGNORECASE
+        regex = re.compile(rule.pattern, flags)
+        for label in rule.labels:
+            dispatch.setdefault(label, []).append((rule.field, priority, regex, rule.block))
+    alternatives = '|'.join(re.escape(label) for label in sorted(dispatch, key=len, reverse=True))
+    return (
+        tuple(order),
+        dispatch,
+        re.compile(alternatives),
+        re.compile(alternatives, re.IGNORECASE),
+    )
+
 
 class RegexNFSeImporter:
     """Extracts NFSe data with heuristics/regex only (sem OpenAI)."""
@@ -35,11 +84,6 @@ class RegexNFSeImporter:
         'serviço prestado',
     ]
     SERVICE_MIN_MATCHES = 2
-    EXCLUDED_PATTERNS = [
-        r'\bnota fiscal de fatura\b',
-        r'\bfatura fiscal\b',
-        r'\bfatura\b',
-    ]
     BILLING_KEYWORDS = [
         'fatura',
         'faturamento',
@@ -48,9 +92,97 @@ class RegexNFSeImporter:
         'código de barras',
         'linha digitável',
     ]
+    KEYWORD_SETS = KeywordSets(service=SERVICE_KEYWORDS, billing=BILLING_KEYWORDS)
+
+    # priority follows the order of the rules of each field; fields sharing a
+    # pattern (emitter/taker) keep the first occurrence, as before
+    FIELD_RULES = [
+        FieldRule('municipality', ('nfse',), r'nfse\s+\d+\s+[—-]\s+([^\n]+)'),
+        FieldRule('municipality', ('munic',), r'município(?: de incidência)?:\s*([^\n]+)'),
+        FieldRule('municipality', ('local da',), r'local da prestação:\s*([^\n]+)'),
+        FieldRule('access_key', ('chave',), r'chave de acesso[:\- ]*([\d\s]+)'),
+        FieldRule('access_key', ('chave',), r'chave[:\- ]*([\d\s]{30,})'),
+        FieldRule('number', ('número',), r'Número[:\- ]+([\d\.]+)'),
+        FieldRule('number', ('número',), r'Número da dps[:\- ]+([\d\.]+)'),
+        FieldRule('competence', ('compet',), r'Compet[êe]ncia[:\- ]+(\d{2}/\d{2}/\d{4})'),
+        FieldRule(
+            'emission_datetime',
+            ('data/hora',),
+            r'Data/Hora da emissão[:\- ]+(\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2})',
+        ),
+        FieldRule('dps_number', ('número',), r'Número da DPS[:\- ]+([\w\d]+)'),
+        FieldRule('dps_series', ('série',), r'Série da DPS[:\- ]+([\w\d]+)'),
+        FieldRule(
+            'dps_emission_datetime',
+            ('data/hora',),
+            r'Data/Hora da emissão da DPS[:\- ]+(\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2})',
+        ),
+        FieldRule(
+            'dps_emission_datetime',
+            ('data/hora',),
+            r'Data/Hora da emiss[aã]o da DPS[:\- ]+(\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2})',
+        ),
+        FieldRule('emitter_name', ('raz',), r'Raz[aã]o Social[:\- ]+(.+)'),
+        FieldRule('emitter_cnpj', ('cnpj',), r'CNPJ[:\- ]+([\d\./-]+)'),
+        FieldRule('emitter_inscription', ('inscri',), r'Inscriç[aã]o Municipal[:\- ]+([\w\d]+)'),
+        FieldRule('emitter_phone', ('telefone',), r'Telefone[:\- ]+([^\n]+)'),
+        FieldRule('emitter_email', ('e-mail',), r'E-mail[:\- ]+([^\s]+)'),
+        FieldRule('emitter_address', ('endere',), r'Endere[cç]o[:\- ]+(.+)'),
+        FieldRule('emitter_zipcode', ('cep',), r'CEP[:\- ]+([\d\.-]+)'),
+        FieldRule(
+            'emitter_optante_simples', ('optante',), r'Optante Simples Nacional[:\- ]+([^\n]+)'
+        ),
+        FieldRule('emitter_regime_especial', ('regime',), r'Regime especial[:\- ]+([^\n]+)'),
+        FieldRule('taker_name', ('nome/',), r'Nome/Raz[aã]o Social[:\- ]+(.+)'),
+        FieldRule('taker_cnpj', ('cpf', 'cnpj'), r'(?:CPF|CNPJ)[:\- ]+([\d\./-]+)'),
+        FieldRule('taker_phone', ('telefone',), r'Telefone[:\- ]+([^\n]+)'),
+        FieldRule('taker_email', ('e-mail',), r'E-mail[:\- ]+([^\s]+)'),
+        FieldRule('taker_address', ('endere',), r'Endere[cç]o[:\- ]+(.+)'),
+        FieldRule('taker_zipcode', ('cep',), r'CEP[:\- ]+([\d\.-]+)'),
+        FieldRule(
+            'service_national_code',
+            ('código',),
+            r'Código Tributação Nacional[:\- ]+([\w\.\-]+)',
+        ),
+        FieldRule(
+            'service_municipal_code',
+            ('código',),
+            r'Código Tributação Municipal[:\- ]+([\w\.\-]+)',
+        ),
+        FieldRule('service_location', ('local da',), r'Local da prestação[:\- ]+([^\n]+)'),
+        _block_rule('service_description', ('descri',), 'Descrição do serviço'),
+        FieldRule('service_value', ('valor',), r'Valor do serviço[:\- ]+R?\$?\s*([\d\.,]+)'),
+        FieldRule(
+            'service_base_calculo',
+            ('base de',),
+            r'Base de c[aá]lculo ISS[:\- ]+R?\$?\s*([\d\.,]+)',
+        ),
+        FieldRule('service_iss_rate', ('alíquota',), r'Alíquota[:\- ]+([\d,\.]+)%'),
+        FieldRule('service_iss_value', ('iss',), r'ISS apurado[:\- ]+R?\$?\s*([\d\.,]+)'),
+        FieldRule('service_iss_retido', ('iss',), r'ISS\s+retido[:\- ]+([^\n]+)'),
+        FieldRule('municipal_regime', ('regime',), r'Regime especial[:\- ]+([^\n]+)'),
+        FieldRule(
+            'municipal_incidence_city', ('munic',), r'Município de incidência[:\- ]+([^\n]+)'
+        ),
+        FieldRule('municipal_taxation', ('tributa',), r'Tributa[cç][aã]o[:\- ]+([^\n]+)'),
+        _block_rule('tax_comment', ('tributo',), 'Tributos aproximados'),
+        _block_rule('federal_tax_comment', ('tributa',), 'Tributa[cç][aã]o Federal'),
+        FieldRule(
+            'totals_service_value', ('valor',), r'Valor do serviço[:\- ]+R?\$?\s*([\d\.,]+)'
+        ),
+        FieldRule('totals_iss_retido', ('iss',), r'ISS retido[:\- ]+([^\n]+)'),
+        FieldRule('totals_retained_value', ('irrf',), r'IRRF.*retidos[:\- ]+R?\$?\s*([\d\.,]+)'),
+        FieldRule(
+            'totals_net_value', ('valor',), r'Valor Líquido da NFSe[:\- ]+R?\$?\s*([\d\.,]+)'
+        ),
+        _block_rule('complementary_info', ('informa',), 'Informações Complementares'),
+    ]
+    _FIELD_ORDER, _DISPATCH, _LABEL_SCANNER, _LABEL_SCANNER_ANYCASE = _compile_rules(FIELD_RULES)
 
     def __init__(self):
         self.logger = logger.getChild(self.__class__.__name__)
+        self.extractor = PDFTextExtractor('por', ocr_settings=configured_ocr_settings())
+        self.text_cache = PageTextCache(ocr_fingerprint=self.extractor.ocr_settings.fingerprint())
 
     def process_file(self, pdf_path: Path, text: Optional[str] = None) -> ReinfNFS:
         pdf_path = Path(pdf_path)
@@ -64,142 +196,82 @@ class RegexNFSeImporter:
         if not self.is_service_invoice(normalized):
             raise ValueError('Documento não parece ser uma NFSe.')
 
-        payload = self._parse_text(normalized)
-        payload['file_name'] = pdf_path.name
-        if not payload.get('access_key'):
-            payload['access_key'] = self._extract_access_key(normalized, pdf_path.name)
+        payload = self.parse_file(pdf_path, normalized)
         nfse = self._persist_payload(payload)
         return nfse
 
-    def extract_text(self, pdf_path: Path) -> str:
-        text_chunks = []
-        with pdfplumber.open(pdf_path) as pdf:
-            for idx, page in enumerate(pdf.pages, start=1):
-                page_text = page.extract_text() or ''
-                normalized = self._normalize_text(page_text)
-                if normalized:
-                    text_chunks.append(normalized)
-                    continue
+    def parse_file(self, pdf_path: Path, normalized: str) -> Dict[str, Any]:
+        """Extracts the payload from the normalized text without saving it."""
+        payload = self.parse_text(normalized)
+        payload['file_name'] = Path(pdf_path).name
+        if not payload.get('access_key'):
+            payload['access_key'] = self._extract_access_key(normalized, payload['file_name'])
+        return payload
 
-                self.logger.info(
-                    'Executando OCR no arquivo %s página %s.', pdf_path.name, idx
-                )
-                image = self._page_to_image(pdf_path, idx, page)
-                ocr_text = pytesseract.image_to_string(image, lang='por')
-                normalized_ocr = self._normalize_text(ocr_text)
-                if normalized_ocr:
-                    text_chunks.append(normalized_ocr)
+    def save_payloads(self, payloads: list[Dict[str, Any]]) -> Dict[str, int]:
+        """Upserts many payloads at once; returns the ReinfNFS id per access key."""
+        return bulk_upsert([self.build_record(payload) for payload in payloads])
 
-        return '\n'.join(text_chunks)
+    def extract_text(self, pdf_path: Path, digest: Optional[str] = None) -> str:
+        return self.text_cache.get_or_extract(
+            pdf_path, 'por', self.extractor.extract_pages, digest
+        )
 
     def is_service_invoice(self, text: str) -> bool:
-        normalized = self._normalize_text(text).lower()
-        matches = sum(1 for keyword in self.SERVICE_KEYWORDS if keyword in normalized)
-        if matches >= self.SERVICE_MIN_MATCHES:
-            return True
-        if any(re.search(pattern, normalized) for pattern in self.EXCLUDED_PATTERNS):
-            return False
-        return False
+        analysis = self.KEYWORD_SETS.analyze(text)
+        return len(analysis.keywords('service')) >= self.SERVICE_MIN_MATCHES
 
     def has_billing_markers(self, text: str) -> bool:
-        normalized = self._normalize_text(text).lower()
-        if not normalized:
-            return False
-        return any(keyword in normalized for keyword in self.BILLING_KEYWORDS)
-
-    def _parse_text(self, text: str) -> Dict[str, Any]:
-        def search(patterns, flags=re.IGNORECASE):
-            for pattern in patterns:
-                match = re.search(pattern, text, flags)
-                if match:
-                    return match.group(1).strip()
-            return ''
-
-        def search_block(label: str):
-            pattern = (
-                label + r'[:\-–]*\s*(.+?)(?:\n\d+\.\s|\n[A-Z][^\n]{0,40}:|$)'
-            )
-            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-            if match:
-                return self._normalize_text(match.group(1))
-            return ''
-
-        def parse_bool(value: str):
-            return value.strip().lower().startswith('s')
-
-        data = {
-            'municipality': search(
-                [
-                    r'nfse\s+\d+\s+[—-]\s+([^\n]+)',
-                    r'município(?: de incidência)?:\s*([^\n]+)',
-                    r'local da prestação:\s*([^\n]+)',
-                ]
-            ),
-            'access_key': re.sub(
-                r'\D', '',
-                search([r'chave de acesso[:\- ]*([\d\s]+)', r'chave[:\- ]*([\d\s]{30,})'])
-            ),
-            'number': search([r'Número[:\- ]+([\d\.]+)', r'Número da dps[:\- ]+([\d\.]+)']),
-            'competence': search([r'Compet[êe]ncia[:\- ]+(\d{2}/\d{2}/\d{4})']),
-            'emission_datetime': search(
-                [r'Data/Hora da emissão[:\- ]+(\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2})']
-            ),
-            'dps_number': search([r'Número da DPS[:\- ]+([\w\d]+)']),
-            'dps_series': search([r'Série da DPS[:\- ]+([\w\d]+)']),
-            'dps_emission_datetime': search(
-                [
-                    r'Data/Hora da emissão da DPS[:\- ]+(\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2})',
-                    r'Data/Hora da emiss[aã]o da DPS[:\- ]+(\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2})',
-                ]
-            ),
-            'emitter_name': search([r'Raz[aã]o Social[:\- ]+(.+)']),
-            'emitter_cnpj': search([r'CNPJ[:\- ]+([\d\./-]+)']),
-            'emitter_inscription': search([r'Inscriç[aã]o Municipal[:\- ]+([\w\d]+)']),
-            'emitter_phone': search([r'Telefone[:\- ]+([^\n]+)']),
-            'emitter_email': search([r'E-mail[:\- ]+([^\s]+)']),
-            'emitter_address': search([r'Endere[cç]o[:\- ]+(.+)']),
-            'emitter_zipcode': search([r'CEP[:\- ]+([\d\.-]+)']),
-            'emitter_optante_simples': search(
-                [r'Optante Simples Nacional[:\- ]+([^\n]+)']
-            ),
-            'emitter_regime_especial': search([r'Regime especial[:\- ]+([^\n]+)']),
-            'taker_name': search([r'Nome/Raz[aã]o Social[:\- ]+(.+)']),
-            'taker_cnpj': search([r'(?:CPF|CNPJ)[:\- ]+([\d\./-]+)']),
-            'taker_phone': search(
-                [r'Telefone[:\- ]+([^\n]+)'],
-                flags=re.IGNORECASE | re.MULTILINE,
-            ),
-            'taker_email': search([r'E-mail[:\- ]+([^\s]+)']),
-            'taker_address': search([r'Endere[cç]o[:\- ]+(.+)']),
-            'taker_zipcode': search([r'CEP[:\- ]+([\d\.-]+)']),
-            'service_national_code': search(
-                [r'Código Tributação Nacional[:\- ]+([\w\.\-]+)']
-            ),
-            'service_municipal_code': search(
-                [r'Código Tributação Municipal[:\- ]+([\w\.\-]+)']
-            ),
-            'service_location': search([r'Local da prestação[:\- ]+([^\n]+)']),
-            'service_description': search_block('Descrição do serviço'),
-            'service_value': search([r'Valor do serviço[:\- ]+R?\$?\s*([\d\.,]+)']),
-            'service_base_calculo': search([r'Base de c[aá]lculo ISS[:\- ]+R?\$?\s*([\d\.,]+)']),
-            'service_iss_rate': search([r'Alíquota[:\- ]+([\d,\.]+)%']),
-            'service_iss_value': search([r'ISS apurado[:\- ]+R?\$?\s*([\d\.,]+)']),
-            'service_iss_retido': search([r'ISS\s+retido[:\- ]+([^\n]+)']),
-            'municipal_regime': search([r'Regime especial[:\- ]+([^\n]+)']),
-            'municipal_incidence_city': search([r'Município de incidência[:\- ]+([^\n]+)']),
-            'municipal_taxation': search([r'Tributa[cç][aã]o[:\- ]+([^\n]+)']),
-            'tax_comment': search_block('Tributos aproximados'),
-            'federal_tax_comment': search_block('Tributa[cç][aã]o Federal'),
-            'totals_service_value': search([r'Valor do serviço[:\- ]+R?\$?\s*([\d\.,]+)']),
-            'totals_iss_retido': search([r'ISS retido[:\- ]+([^\n]+)']),
-            'totals_retained_value': search([r'IRRF.*retidos[:\- ]+R?\$?\s*([\d\.,]+)']),
-            'totals_net_value': search([r'Valor Líquido da NFSe[:\- ]+R?\$?\s*([\d\.,]+)']),
-            'complementary_info': search_block('Informações Complementares'),
-        }
+        return bool(self.KEYWORD_SETS.analyze(text).hits['billing'])
+
+    @classmethod
+    def parse_text(cls, text: str) -> Dict[str, Any]:
+        """Fills every field in a single pass over the label occurrences.
+
+        Each rule only tries its pattern where one of its labels starts, so a
+        field still gets the first match of its highest-priority pattern, as
+        a plain `re.search` per pattern would give.
+        """
+        found: Dict[str, tuple[int, str]] = {}
+        settled = 0
+        lowered = text.lower()
+        if len(lowered) == len(text):
+            hits = cls._LABEL_SCANNER.finditer(lowered)
+        else:  # lower() changed offsets (rare ligatures): scan the original text
+            hits = cls._LABEL_SCANNER_ANYCASE.finditer(text)
+        for hit in hits:
+            position = hit.start()
+            for field, priority, regex, is_block in cls._DISPATCH.get(hit.group().lower(), ()):
+                current = found.get(field)
+                if current is not None and current[0] <= priority:
+                    continue
+                match = regex.match(text, position)
+                if not match:
+                    continue
+                value = match.group(1)
+                found[field] = (
+                    priority,
+                    cls._normalize_text(value) if is_block else value.strip(),
+                )
+                if priority == 0:
+                    settled += 1
+            if settled == len(cls._FIELD_ORDER):
+                break
 
+        data = {field: found[field][1] if field in found else '' for field in cls._FIELD_ORDER}
+        data['access_key'] = _NON_DIGITS.sub('', data['access_key'])
         return data
 
     def _persist_payload(self, payload: Dict[str, Any]) -> ReinfNFS:
+        access_key, defaults = self.build_record(payload)
+        nfse, _ = ReinfNFS.objects.update_or_create(
+            access_key=access_key,
+            defaults=defaults,
+        )
+        return nfse
+
+    def build_record(self, payload: Dict[str, Any]) -> tuple[str, Dict[str, Any]]:
+        """Maps a payload to the ReinfNFS access key and column values."""
         access_key = payload.get('access_key') or ''
         access_key = re.sub(r'\D', '', access_key)
         if not access_key:
@@ -298,34 +370,11 @@ class RegexNFSeImporter:
             'totals_net_value': parse_decimal(payload.get('totals_net_value')),
             'complementary_info': payload.get('complementary_info', ''),
         }
-
-        nfse, _ = ReinfNFS.objects.update_or_create(
-            access_key=access_key,
-            defaults=defaults,
-        )
-        return nfse
+        return access_key, defaults
 
     @staticmethod
     def _normalize_text(text: Optional[str]) -> str:
-        if not text:
-            return ''
-        text = text.replace('\r', '\n')
-        cleaned_lines = []
-        for line in text.splitlines():
-            normalized_line = re.sub(r'\s+', ' ', line).strip()
-            if normalized_line:
-                cleaned_lines.append(normalized_line)
-        return '\n'.join(cleaned_lines)
-
-    @staticmethod
-    def _page_to_image(pdf_path: Path, page_number: int, page) -> Image.Image:
-        try:
-            return page.to_image(resolution=300).original
-        except Exception:  # pragma: no cover
-            images = convert_from_path(
-                str(pdf_path), first_page=page_number, last_page=page_number
-            )
-            return images[0]
+        return normalize_text(text)
 
     def _extract_access_key(self, text: str, file_name: str) -> str:
         candidates = re.findall(r'\d{30,}', text)
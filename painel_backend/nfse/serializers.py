@@ -13,6 +13,17 @@ class FileDescriptorSerializer(serializers.Serializer):
     uploadToken = serializers.CharField()
 
 
+class UploadSessionCreateSerializer(serializers.Serializer):
+    fileName = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+    checksum = serializers.RegexField(
+        regex=r'^[0-9a-fA-F]{64}$',
+        required=False,
+        allow_blank=True,
+        error_messages={'invalid': 'Informe o SHA-256 em hexadecimal.'},
+    )
+
+
 class ImportJobOptionsSerializer(serializers.Serializer):
     ocrLanguage = serializers.CharField(required=False, allow_blank=True)
     model = serializers.CharField(required=False, allow_blank=True)
@@ -23,6 +34,14 @@ class ImportJobOptionsSerializer(serializers.Serializer):
         regex=r'^(0[1-9]|1[0-2])[0-9]{4}$',
         error_messages={'invalid': 'Use o formato MMYYYY.'},
     )
+    concurrency = serializers.ChoiceField(
+        choices=['sequential', 'parallel'], required=False
+    )
+    maxParallelFiles = serializers.IntegerField(required=False, min_value=1)
+    bypassLlmCache = serializers.BooleanField(required=False)
+    hybridExtraction = serializers.BooleanField(required=False)
+    llmBatchSize = serializers.IntegerField(required=False, min_value=1)
+    forceRefresh = serializers.BooleanField(required=False)
 
     def validate_companyCode(self, value: str) -> str:
         cleaned = value.strip()
@@ -61,6 +80,7 @@ class ImportJobFileSerializer(serializers.ModelSerializer):
     downloadUrl = serializers.SerializerMethodField()
     updatedAt = serializers.DateTimeField(source='updated_at')
     createdAt = serializers.DateTimeField(source='created_at')
+    classifiedBy = serializers.CharField(source='classified_by', read_only=True)
 
     class Meta:
         model = ImportJobFile
@@ -72,6 +92,7 @@ class ImportJobFileSerializer(serializers.ModelSerializer):
             'stage',
             'progress',
             'message',
+            'classifiedBy',
             'updatedAt',
             'createdAt',
             'downloadUrl',
@@ -103,6 +124,7 @@ class ImportJobSerializer(serializers.ModelSerializer):
             'createdAt',
             'options',
             'totals',
+            'metrics',
             'files',
         ]
 
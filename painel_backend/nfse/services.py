@@ -1,7 +1,7 @@
-import json
 import logging
 import os
-import re
+import threading
+from concurrent.futures import Executor
 from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
@@ -9,14 +9,37 @@ from pathlib import Path
 from time import perf_counter
 from typing import Any, Dict, Optional
 
-import pdfplumber
-import pytesseract
-from PIL import Image
-from pdf2image import convert_from_path
+from django.conf import settings
 from django.utils import timezone as django_timezone
-from openai import OpenAI, OpenAIError
-
-from .models import ReinfNFS
+from openai import OpenAIError
+
+from .extraction import PDFTextExtractor, normalize_text
+from .hybrid import (
+    MAX_PARTIAL_FIELDS,
+    HybridStats,
+    access_key_candidates,
+    fields_to_complete,
+    focus_text,
+    merge_taker_fields,
+    regex_to_payload,
+    taker_section,
+)
+from .llm import llm_client
+from .llm_cache import LLMResponseCache, prompt_hash
+from .models import ImportJobFile, ReinfNFS
+from .ocr_config import configured_ocr_settings
+from .persistence import bulk_upsert
+from .regex_importer import RegexNFSeImporter
+from .structured_output import (
+    BATCH_KEY,
+    answer_content,
+    batch_schema,
+    field_list,
+    parse_json_answer,
+    payload_schema,
+)
+from .text_analysis import KeywordSets, TextAnalysis
+from .text_cache import PageTextCache, file_digest
 
 logger = logging.getLogger(__name__)
 
@@ -68,6 +91,24 @@ class NFSePayload:
     complementary_info: Optional[str] = None
 
 
+# answer format of the model, defined once from the payload dataclass
+PAYLOAD_SCHEMA = payload_schema(NFSePayload)
+
+
+# room left in a batch for the answer of each document
+BATCH_ANSWER_CHARS = 1500
+
+
+@dataclass
+class PendingDocument:
+    """A document waiting for a (batched) full-prompt request."""
+
+    index: int
+    file_name: str
+    clean_text: str
+    cache_key: str
+
+
 class NFSeImporter:
     """Reads PDF files and extracts NFSe data via OCR + GPT, persisting to the database."""
 
@@ -90,11 +131,6 @@ class NFSeImporter:
         'serviço prestado',
     ]
     SERVICE_MIN_MATCHES = 2
-    EXCLUDED_PATTERNS = [
-        r'\bnota fiscal de fatura\b',
-        r'\bfatura fiscal\b',
-        r'\bfatura\b',
-    ]
     BILLING_KEYWORDS = [
         'fatura',
         'faturamento',
@@ -123,6 +159,9 @@ class NFSeImporter:
         'valor do serviço',
         'informações complementares',
     ]
+    KEYWORD_SETS = KeywordSets(
+        service=SERVICE_KEYWORDS, billing=BILLING_KEYWORDS, relevant=RELEVANT_KEYWORDS
+    )
 
     def __init__(
         self,
@@ -132,15 +171,17 @@ class NFSeImporter:
         ocr_language: Optional[str] = None,
         company_code: Optional[str] = None,
         competence_period: Optional[str] = None,
+        use_llm_cache: bool = True,
+        ocr_executor: Optional[Executor] = None,
+        hybrid: Optional[bool] = None,
+        batch_size: Optional[int] = None,
+        force_refresh: bool = False,
     ):
         if not api_key:
             api_key = os.getenv('OPENAI_API_KEY', 'ollama')
 
         base_url = base_url or os.getenv('OPENAI_BASE_URL')
-        if base_url:
-            self.client = OpenAI(api_key=api_key, base_url=base_url)
-        else:
-            self.client = OpenAI(api_key=api_key)
+        self.client = llm_client(api_key, base_url)
 
         env_model = os.getenv('OPENAI_MODEL')
         default_candidates = ['gpt-4o-mini-fast', 'gpt-4o-mini', 'gpt-3.5-turbo']
@@ -157,6 +198,28 @@ class NFSeImporter:
         self.company_code = (company_code or '').strip()
         self.competence_period = (competence_period or '').strip()
         self.ocr_language = ocr_language or os.getenv('NFSE_OCR_LANGUAGE', 'por')
+        self.extractor = PDFTextExtractor(
+            self.ocr_language, ocr_executor=ocr_executor, ocr_settings=configured_ocr_settings()
+        )
+        self.text_cache = PageTextCache(ocr_fingerprint=self.extractor.ocr_settings.fingerprint())
+        self.llm_cache = LLMResponseCache(enabled=use_llm_cache)
+        self.early_classification = bool(getattr(settings, 'NFSE_EARLY_CLASSIFICATION', True))
+        self.classify_ocr_dpi = int(getattr(settings, 'NFSE_CLASSIFY_OCR_DPI', 100))
+        # files whose access key is already in reinf_NFS are linked, not processed
+        self.skip_known = (
+            bool(getattr(settings, 'NFSE_ACCESS_KEY_DEDUP', True)) and not force_refresh
+        )
+        if hybrid is None:
+            hybrid = getattr(settings, 'NFSE_HYBRID_EXTRACTION', False)
+        self.hybrid = bool(hybrid)
+        self.hybrid_stats = HybridStats()
+        # documents per model request (pipeline mode) and the prompt size a
+        # batch may reach; the budget halves when the model rejects a batch
+        # as too long for its context window
+        self.batch_size = max(1, int(batch_size or getattr(settings, 'NFSE_LLM_BATCH_SIZE', 1)))
+        self.batch_char_budget = int(getattr(settings, 'NFSE_LLM_CONTEXT_CHARS', 32000))
+        self.llm_requests = 0
+        self._requests_lock = threading.Lock()
         self.logger = logger.getChild(self.__class__.__name__)
 
     def process_file(
@@ -176,11 +239,11 @@ class NFSeImporter:
             text_time = perf_counter() - text_start
 
         prompt_start = perf_counter()
-        payload = self._query_chatgpt(text, pdf_path.name)
+        payload = self.extract_payload(text, pdf_path.name)
         prompt_time = perf_counter() - prompt_start
 
         persist_start = perf_counter()
-        nfse = self._persist_payload(payload)
+        nfse = self.save_payload(payload)
         persist_time = perf_counter() - persist_start
 
         total_time = perf_counter() - start
@@ -194,103 +257,262 @@ class NFSeImporter:
         print(message)
         return nfse
 
-    def extract_text(self, pdf_path: Path) -> str:
-        text_chunks = []
-        with pdfplumber.open(pdf_path) as pdf:
-            for idx, page in enumerate(pdf.pages, start=1):
-                try:
-                    page_text = page.extract_text() or ''
-                except Exception as exc:  # pragma: no cover - PDF parsing edge case
-                    self.logger.warning(
-                        'Falha ao extrair texto bruto (%s): %s', pdf_path.name, exc
-                    )
-                    page_text = ''
-                normalized = self._normalize_text(page_text)
-                if normalized:
-                    text_chunks.append(normalized)
-                    continue
-
-                self.logger.info(
-                    'Executando OCR no arquivo %s página %s.', pdf_path.name, idx
-                )
-                print(f'OCR necessário para {pdf_path.name} (página {idx})')
-                image = self._page_to_image(pdf_path, idx, page)
-                ocr_text = pytesseract.image_to_string(image, lang=self.ocr_language)
-                normalized_ocr = self._normalize_text(ocr_text)
-                if normalized_ocr:
-                    text_chunks.append(normalized_ocr)
+    def extract_text(self, pdf_path: Path, digest: Optional[str] = None) -> str:
+        return self.text_cache.get_or_extract(
+            pdf_path, self.ocr_language, self.extractor.extract_pages, digest
+        )
 
-        combined = '\n'.join(text_chunks)
-        return combined
+    def extract_payload(self, text: str, file_name: str) -> Dict[str, Any]:
+        """Turns the extracted text into the NFSePayload fields (LLM stage).
+
+        In hybrid mode the regex parser goes first and the model is only asked
+        for the required fields it missed or got wrong.
+        """
+        payload = self._hybrid_payload(text, file_name) if self.hybrid else None
+        if payload is None:
+            return self._query_chatgpt(text, file_name)
+        return payload
+
+    def extract_payloads(self, documents: list[tuple[str, str]]) -> list[Any]:
+        """Like `extract_payload` for many (text, file name) pairs, sharing model requests.
+
+        Documents that need the full prompt are packed up to `batch_size` per
+        request. Returns a payload or the exception raised, per document.
+        """
+        results: list[Any] = [None] * len(documents)
+        pending: list[PendingDocument] = []
+        for index, (text, file_name) in enumerate(documents):
+            try:
+                payload = self._hybrid_payload(text, file_name) if self.hybrid else None
+                if payload is None:
+                    clean_text = self._prepare_prompt_text(text)
+                    cache_key = prompt_hash(self._build_prompt(clean_text, ''))
+                    payload = self.llm_cache.get(self.model_candidates, cache_key)
+                    if payload is None:
+                        pending.append(PendingDocument(index, file_name, clean_text, cache_key))
+                        continue
+                    payload['file_name'] = file_name
+                results[index] = payload
+            except Exception as exc:  # pylint: disable=broad-except
+                results[index] = exc
+        for batch in self._pack_batches(pending):
+            self._query_batch(batch, results)
+        return results
+
+    def _hybrid_payload(self, text: str, file_name: str) -> Optional[Dict[str, Any]]:
+        """Regex payload completed by a partial prompt; None when the full prompt is needed.
+
+        The model is only asked for the required fields the regex parser
+        missed or got wrong.
+        """
+        payload = self._regex_payload(text, file_name)
+        missing = fields_to_complete(payload)
+        if not missing:
+            self.hybrid_stats.record('regexOnly')
+            return payload
+        if len(missing) > MAX_PARTIAL_FIELDS:
+            self.hybrid_stats.record('full', len(PAYLOAD_SCHEMA['properties']))
+            return None
 
-    def _page_to_image(self, pdf_path: Path, page_number: int, page) -> Image.Image:
-        try:
-            return page.to_image(resolution=300).original
-        except Exception:  # pragma: no cover - fallback path
-            images = convert_from_path(
-                str(pdf_path), first_page=page_number, last_page=page_number
-            )
-            return images[0]
+        self.hybrid_stats.record('partial', len(missing))
+        answer = self._query_fields(text, missing)
+        payload.update({field: answer.get(field) for field in missing})
+        return payload
+
+    def save_payload(self, payload: Dict[str, Any]) -> ReinfNFS:
+        """Creates or updates the ReinfNFS row for the payload (persist stage)."""
+        return self._persist_payload(payload)
 
     def _query_chatgpt(self, text: str, file_name: str) -> Dict[str, Any]:
         clean_text = self._prepare_prompt_text(text)
-        prompt = (
-            "Você é um assistente que lê o texto bruto de uma NFSe em português e devolve um JSON "
-            "com o seguinte formato (obrigatoriamente em JSON válido e com datas ISO):\n"
-            "{\n"
-            '  "file_name": "...",\n'
-            '  "municipality": "...",\n'
-            '  "access_key": "...",\n'
-            '  "number": "...",\n'
-            '  "competence": "AAAA-MM-DD",\n'
-            '  "emission_datetime": "AAAA-MM-DDTHH:MM:SS",\n'
-            '  "dps_number": "...",\n'
-            '  "dps_series": "...",\n'
-            '  "dps_emission_datetime": "AAAA-MM-DDTHH:MM:SS",\n'
-            '  "emitter_name": "...",\n'
-            '  "emitter_cnpj": "...",\n'
-            '  "emitter_inscription": "...",\n'
-            '  "emitter_phone": "...",\n'
-            '  "emitter_email": "...",\n'
-            '  "emitter_address": "...",\n'
-            '  "emitter_zipcode": "...",\n'
-            '  "emitter_optante_simples": true/false,\n'
-            '  "emitter_regime_especial": "...",\n'
-            '  "taker_name": "...",\n'
-            '  "taker_cnpj": "...",\n'
-            '  "taker_phone": "...",\n'
-            '  "taker_email": "...",\n'
-            '  "taker_address": "...",\n'
-            '  "taker_zipcode": "...",\n'
-            '  "service_national_code": "...",\n'
-            '  "service_municipal_code": "...",\n'
-            '  "service_location": "...",\n'
-            '  "service_description": "...",\n'
-            '  "service_value": number,\n'
-            '  "service_base_calculo": number,\n'
-            '  "service_iss_rate": number,\n'
-            '  "service_iss_value": number,\n'
-            '  "service_iss_retido": true/false,\n'
-            '  "municipal_regime": "...",\n'
-            '  "municipal_incidence_city": "...",\n'
-            '  "municipal_taxation": "...",\n'
-            '  "tax_comment": "...",\n'
-            '  "federal_tax_comment": "...",\n'
-            '  "totals_service_value": number,\n'
-            '  "totals_iss_retido": true/false,\n'
-            '  "totals_retained_value": number,\n'
-            '  "totals_net_value": number,\n'
-            '  "complementary_info": "..."\n'
-            "}\n"
-            "Retorne apenas o JSON, sem comentários. Texto da nota:\n"
+        # the file name is left out of the key so the same document sent
+        # under another name still hits the cache
+        cache_key = prompt_hash(self._build_prompt(clean_text, ''))
+        cached = self.llm_cache.get(self.model_candidates, cache_key)
+        if cached is not None:
+            cached['file_name'] = file_name
+            return cached
+
+        return self._ask_document(clean_text, file_name, cache_key)
+
+    def _ask_document(self, clean_text: str, file_name: str, cache_key: str) -> Dict[str, Any]:
+        prompt = self._build_prompt(clean_text, file_name)
+        response = self._request_completion(prompt, PAYLOAD_SCHEMA)
+        payload = parse_json_answer(answer_content(response))
+        self.llm_cache.set(self.model, cache_key, payload)
+        return payload
+
+    def _pack_batches(self, pending: list[PendingDocument]) -> list[list[PendingDocument]]:
+        """Groups documents by request, within `batch_size` and the prompt budget.
+
+        File names key the answer, so a name never repeats inside a batch.
+        """
+        batches: list[list[PendingDocument]] = []
+        current: list[PendingDocument] = []
+        used = 0
+        for document in pending:
+            cost = len(document.clean_text) + BATCH_ANSWER_CHARS
+            if current and (
+                len(current) >= self.batch_size
+                or used + cost > self.batch_char_budget
+                or any(item.file_name == document.file_name for item in current)
+            ):
+                batches.append(current)
+                current, used = [], 0
+            current.append(document)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def _query_batch(self, batch: list[PendingDocument], results: list[Any]) -> None:
+        """Asks for every document of the batch in one request.
+
+        Documents missing from the answer (or all of them, when the answer is
+        not a valid JSON array or was cut at the token limit) are split in two
+        halves and asked again; a single document falls back to the
+        one-document prompt.
+        """
+        if len(batch) == 1:
+            document = batch[0]
+            try:
+                results[document.index] = self._ask_document(
+                    document.clean_text, document.file_name, document.cache_key
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                results[document.index] = exc
+            return
+
+        try:
+            response = self._request_completion(
+                self._build_batch_prompt(batch), batch_schema(PAYLOAD_SCHEMA)
+            )
+            answers = self._parse_batch_answer(answer_content(response))
+        except (ValueError, TypeError) as exc:
+            self.logger.warning('Resposta do lote de %s NFSe inválida (%s).', len(batch), exc)
+            answers = {}
+        except OpenAIError as exc:  # pragma: no cover - depends on network
+            if not self._is_context_length_exceeded(exc):
+                for document in batch:
+                    results[document.index] = exc
+                return
+            used = sum(len(document.clean_text) + BATCH_ANSWER_CHARS for document in batch)
+            with self._requests_lock:
+                # half of what overflowed: batches failing together do not shrink it twice
+                self.batch_char_budget = max(1, min(self.batch_char_budget, used // 2))
+                budget = self.batch_char_budget
+            self.logger.warning(
+                'Lote de %s NFSe excede o contexto do modelo; limite reduzido para %s caracteres.',
+                len(batch),
+                budget,
+            )
+            answers = {}
+        except Exception as exc:  # pylint: disable=broad-except
+            # not worth splitting (no model, invalid key, database): every document fails
+            for document in batch:
+                results[document.index] = exc
+            return
+
+        unanswered = []
+        for document in batch:
+            payload = answers.get(document.file_name)
+            if payload is None:
+                unanswered.append(document)
+                continue
+            payload['file_name'] = document.file_name
+            self.llm_cache.set(self.model, document.cache_key, payload)
+            results[document.index] = payload
+        if unanswered:
+            middle = (len(unanswered) + 1) // 2
+            for half in (unanswered[:middle], unanswered[middle:]):
+                if half:
+                    self._query_batch(half, results)
+
+    @staticmethod
+    def _parse_batch_answer(content: str) -> Dict[str, Dict[str, Any]]:
+        data = parse_json_answer(content)
+        if isinstance(data, dict):
+            # JSON mode answers {"notas": [...]}; other keys are tolerated
+            data = next((value for value in data.values() if isinstance(value, list)), [data])
+        return {
+            str(item['file_name']): item
+            for item in data
+            if isinstance(item, dict) and item.get('file_name')
+        }
+
+    def _regex_payload(self, text: str, file_name: str) -> Dict[str, Any]:
+        normalized = self._normalize_text(text)
+        data = RegexNFSeImporter.parse_text(normalized)
+        section = taker_section(normalized)
+        if section:
+            data = merge_taker_fields(data, RegexNFSeImporter.parse_text(section))
+        payload = regex_to_payload(data)
+        payload['file_name'] = file_name
+        return payload
+
+    def _query_fields(self, text: str, fields: list[str]) -> Dict[str, Any]:
+        clean_text = focus_text(self._prepare_prompt_text(text), fields)
+        prompt = self._build_fields_prompt(clean_text, fields)
+        cache_key = prompt_hash(prompt)
+        cached = self.llm_cache.get(self.model_candidates, cache_key)
+        if cached is not None:
+            return cached
+
+        response = self._request_completion(prompt, payload_schema(NFSePayload, fields))
+        answer = parse_json_answer(answer_content(response))
+        self.llm_cache.set(self.model, cache_key, answer)
+        return answer
+
+    @staticmethod
+    def _build_prompt(clean_text: str, file_name: str) -> str:
+        return (
+            "Leia o texto bruto de uma NFSe em português e devolva um objeto JSON com os campos "
+            "abaixo, agrupados pelo formato do valor (null se o campo não existir na nota):\n"
+            f"{field_list(PAYLOAD_SCHEMA)}\n"
+            "Retorne apenas o JSON. Texto da nota:\n"
             f"Arquivo: {file_name}\n{clean_text}"
         )
 
-        response = self._request_completion(prompt)
-        content = response.choices[0].message.content
-        return json.loads(content)
+    @staticmethod
+    def _build_batch_prompt(batch: list[PendingDocument]) -> str:
+        documents = '\n\n'.join(
+            f"Arquivo: {document.file_name}\n{document.clean_text}" for document in batch
+        )
+        return (
+            f"Leia o texto bruto de {len(batch)} NFSe em português e devolva um objeto JSON "
+            f'{{"{BATCH_KEY}": [...]}} com um objeto por nota, usando em file_name o nome indicado '
+            "antes de cada nota. Campos de cada nota, agrupados pelo formato do valor (null se o "
+            "campo não existir na nota):\n"
+            f"{field_list(PAYLOAD_SCHEMA)}\n"
+            "Retorne apenas o JSON. Notas:\n"
+            f"{documents}"
+        )
+
+    @staticmethod
+    def _build_fields_prompt(clean_text: str, fields: list[str]) -> str:
+        return (
+            "Leia o texto bruto de uma NFSe em português. Os demais campos já foram lidos; "
+            "devolva um objeto JSON apenas com estes, agrupados pelo formato do valor (null se o "
+            "campo não existir na nota):\n"
+            f"{field_list(payload_schema(NFSePayload, fields))}\n"
+            "Retorne apenas o JSON. Trechos da nota:\n"
+            f"{clean_text}"
+        )
+
+    def save_payloads(self, payloads: list[Dict[str, Any]]) -> Dict[str, int]:
+        """Upserts many payloads at once; returns the ReinfNFS id per access key."""
+        return bulk_upsert([self.build_record(payload) for payload in payloads])
 
     def _persist_payload(self, payload_dict: Dict[str, Any]) -> ReinfNFS:
+        access_key, defaults = self.build_record(payload_dict)
+        nfse, _ = ReinfNFS.objects.update_or_create(
+            access_key=access_key,
+            defaults=defaults,
+        )
+        return nfse
+
+    def build_record(self, payload_dict: Dict[str, Any]) -> tuple[str, Dict[str, Any]]:
+        """Maps a payload to the ReinfNFS access key and column values."""
         payload = NFSePayload(**payload_dict)
         defaults = {
             'file_name': payload.file_name,
@@ -340,11 +562,7 @@ class NFSeImporter:
             'totals_net_value': self._to_decimal(payload.totals_net_value),
             'complementary_info': payload.complementary_info or '',
         }
-        nfse, _ = ReinfNFS.objects.update_or_create(
-            access_key=payload.access_key,
-            defaults=defaults,
-        )
-        return nfse
+        return payload.access_key, defaults
 
     @staticmethod
     def _parse_date(value: Optional[str]):
@@ -369,51 +587,120 @@ class NFSeImporter:
 
     @staticmethod
     def _normalize_text(text: Optional[str]) -> str:
-        if not text:
-            return ''
-        text = text.replace('\r', '\n')
-        cleaned_lines = []
-        for line in text.splitlines():
-            normalized_line = re.sub(r'\s+', ' ', line).strip()
-            if normalized_line:
-                cleaned_lines.append(normalized_line)
-        return '\n'.join(cleaned_lines)
+        return normalize_text(text)
 
     def _prepare_prompt_text(self, text: str) -> str:
-        normalized = self._normalize_text(text)
-        reduced = self._filter_relevant_content(normalized)
+        reduced = self._filter_relevant_content(self.KEYWORD_SETS.analyze(text))
         if len(reduced) > self.MAX_PROMPT_CHARS:
             return reduced[: self.MAX_PROMPT_CHARS]
         return reduced
 
     def is_service_invoice(self, text: str) -> bool:
-        normalized = self._normalize_text(text).lower()
-        matches = sum(1 for keyword in self.SERVICE_KEYWORDS if keyword in normalized)
+        analysis = self.KEYWORD_SETS.analyze(text)
+        return len(analysis.keywords('service')) >= self.SERVICE_MIN_MATCHES
+
+    def known_nfse_id(
+        self, pdf_path: Path, file_name: str, digest: Optional[str] = None
+    ) -> Optional[int]:
+        """Id of the ReinfNFS already imported for this file, if any.
+
+        The access key is looked for in the file name and then in the first
+        page (text layer or cached text, never OCR), before any extraction.
+        `digest` is the file hash when the caller already has it.
+        """
+        if not self.skip_known:
+            return None
+        nfse_id = self._find_access_key(access_key_candidates(file_name))
+        if nfse_id is not None:
+            return nfse_id
+
+        pdf_path = Path(pdf_path)
+        first_page = None
+        if self.text_cache.enabled:
+            known, _ = self.text_cache.lookup(digest or file_digest(pdf_path), self.ocr_language)
+            first_page = known.get(1)
+        if first_page is None:
+            first_page, _ = self.extractor.first_page(pdf_path, None)
+        return self._find_access_key(access_key_candidates(first_page))
+
+    @staticmethod
+    def _find_access_key(candidates: set[str]) -> Optional[int]:
+        if not candidates:
+            return None
+        return (
+            ReinfNFS.objects.filter(access_key__in=candidates)
+            .values_list('pk', flat=True)
+            .first()
+        )
+
+    def classify_early(
+        self, pdf_path: Path, digest: Optional[str] = None
+    ) -> tuple[Optional[bool], str]:
+        """Decides from the PDF metadata and first page whether to extract the whole file.
+
+        Returns (is service invoice, ImportJobFile.Classification); a None
+        decision means only the full text can tell. A first page without any
+        service keyword but with billing markers (boleto, fatura) rejects the
+        file before the other pages are read or OCR'd.
+        """
+        if not self.early_classification:
+            return None, ''
+        pdf_path = Path(pdf_path)
+        metadata, page_count = self.extractor.metadata(pdf_path)
+        decision = self._classify_excerpt(metadata)
+        if decision is not None:
+            return decision, ImportJobFile.Classification.METADATA
+
+        first_page, from_ocr = None, False
+        if self.text_cache.enabled:
+            known, _ = self.text_cache.lookup(digest or file_digest(pdf_path), self.ocr_language)
+            first_page = known.get(1)
+        if first_page is None:
+            # a scanned single page is OCR'd by the full extraction anyway
+            first_page, from_ocr = self.extractor.first_page(
+                pdf_path, self.classify_ocr_dpi if page_count > 1 else None
+            )
+        stage = (
+            ImportJobFile.Classification.FIRST_PAGE_OCR
+            if from_ocr
+            else ImportJobFile.Classification.FIRST_PAGE
+        )
+        if page_count == 1 and first_page:
+            # the first page is the whole document
+            return self.is_service_invoice(first_page), stage
+        decision = self._classify_excerpt(first_page)
+        return decision, stage if decision is not None else ''
+
+    def _classify_excerpt(self, text: str) -> Optional[bool]:
+        analysis = self.KEYWORD_SETS.analyze(text)
+        matches = len(analysis.keywords('service'))
         if matches >= self.SERVICE_MIN_MATCHES:
             return True
-        if any(re.search(pattern, normalized) for pattern in self.EXCLUDED_PATTERNS):
+        if not matches and analysis.hits['billing']:
             return False
-        return False
+        return None
 
     def has_billing_markers(self, text: str) -> bool:
-        normalized = self._normalize_text(text).lower()
-        if not normalized:
-            return False
-        return any(keyword in normalized for keyword in self.BILLING_KEYWORDS)
+        return bool(self.KEYWORD_SETS.analyze(text).hits['billing'])
 
-    def _request_completion(self, prompt: str):
+    def _request_completion(self, prompt: str, schema: Optional[Dict[str, Any]] = None):
         messages = [
             {'role': 'system', 'content': 'Você extrai dados estruturados de notas fiscais do Brasil.'},
             {'role': 'user', 'content': prompt},
         ]
+        with self._requests_lock:
+            self.llm_requests += 1
         last_error = None
-        for candidate in self.model_candidates:
+        registry = self.client.registry
+        for candidate in registry.usable(self.model_candidates):
             try:
-                response = self.client.chat.completions.create(
+                response = self.client.complete(
+                    schema={'name': 'nfse', 'schema': schema} if schema else None,
                     model=candidate,
                     temperature=0,
                     messages=messages,
                 )
+                registry.mark(candidate, True)
                 if candidate != self.model:
                     self.logger.warning('Modelo trocado para %s após fallback.', candidate)
                     self.model = candidate
@@ -426,6 +713,7 @@ class NFSeImporter:
                     )
                 if not self._is_model_not_found(exc):
                     raise
+                registry.mark(candidate, False)
                 self.logger.warning(
                     'Modelo %s indisponível (%s). Tentando próximo candidato.',
                     candidate,
@@ -444,6 +732,14 @@ class NFSeImporter:
         message = (getattr(exc, 'message', None) or str(exc)).lower()
         return 'model_not_found' in message or 'does not exist' in message
 
+    @staticmethod
+    def _is_context_length_exceeded(exc: Exception) -> bool:
+        code = getattr(exc, 'code', None)
+        if code == 'context_length_exceeded':
+            return True
+        message = (getattr(exc, 'message', None) or str(exc)).lower()
+        return 'context length' in message or 'context window' in message
+
     @staticmethod
     def _is_invalid_api_key(exc: Exception) -> bool:
         code = getattr(exc, 'code', None)
@@ -452,17 +748,17 @@ class NFSeImporter:
         message = (getattr(exc, 'message', None) or str(exc)).lower()
         return 'invalid api key' in message or 'incorrect api key' in message
 
-    def _filter_relevant_content(self, text: str) -> str:
+    @staticmethod
+    def _filter_relevant_content(analysis: TextAnalysis) -> str:
+        text = analysis.text
         lines = text.split('\n')
         relevant_indices = set()
         total_lines = len(lines)
-        for idx, line in enumerate(lines):
-            lower_line = line.lower()
-            if any(keyword in lower_line for keyword in self.RELEVANT_KEYWORDS):
-                start = max(0, idx - 2)
-                end = min(total_lines, idx + 3)
-                for i in range(start, end):
-                    relevant_indices.add(i)
+        for idx in analysis.lines('relevant'):
+            start = max(0, idx - 2)
+            end = min(total_lines, idx + 3)
+            for i in range(start, end):
+                relevant_indices.add(i)
 
         if not relevant_indices:
             return text
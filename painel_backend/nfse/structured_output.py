@@ -0,0 +1,134 @@
+import dataclasses
+import json
+import typing
+from typing import Any, Dict, Iterable, Optional
+
+from .hybrid import DATE_FIELDS, DATETIME_FIELDS
+
+# key holding the array of notes in a batch answer (JSON mode needs an object)
+BATCH_KEY = 'notas'
+
+_JSON_TYPES = {str: 'string', bool: 'boolean', int: 'integer', float: 'number'}
+# value format shown in the prompt, per JSON type
+_TYPE_LABELS = {'string': 'texto', 'boolean': 'true/false', 'number': 'número', 'integer': 'número'}
+_DATE_FORMATS = {
+    **{field: 'AAAA-MM-DD' for field in DATE_FIELDS},
+    **{field: 'AAAA-MM-DDTHH:MM:SS' for field in DATETIME_FIELDS},
+}
+
+
+def payload_schema(payload_class: type, fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """JSON schema of a payload dataclass, optionally limited to some fields.
+
+    `Optional[...]` fields are nullable and `Any` ones are numbers (the
+    amounts). Every field is required, as strict structured output asks.
+    """
+    hints = typing.get_type_hints(payload_class)
+    wanted = set(fields) if fields is not None else None
+    properties = {}
+    for field in dataclasses.fields(payload_class):
+        if wanted is not None and field.name not in wanted:
+            continue
+        annotation = hints[field.name]
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        nullable = typing.get_origin(annotation) is typing.Union and len(args) == 1
+        base = args[0] if nullable else annotation
+        json_type = _JSON_TYPES.get(base, 'number')
+        prop: Dict[str, Any] = {'type': [json_type, 'null'] if nullable else json_type}
+        if field.name in _DATE_FORMATS:
+            prop['description'] = _DATE_FORMATS[field.name]
+        properties[field.name] = prop
+    return {
+        'type': 'object',
+        'properties': properties,
+        'required': list(properties),
+        'additionalProperties': False,
+    }
+
+
+def batch_schema(item_schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Object holding an array of `item_schema` under BATCH_KEY."""
+    return {
+        'type': 'object',
+        'properties': {BATCH_KEY: {'type': 'array', 'items': item_schema}},
+        'required': [BATCH_KEY],
+        'additionalProperties': False,
+    }
+
+
+def field_list(schema: Dict[str, Any]) -> str:
+    """The schema fields grouped by value format, one line per format (for the prompt)."""
+    groups: Dict[str, list[str]] = {}
+    for name, prop in schema['properties'].items():
+        json_type = prop['type'][0] if isinstance(prop['type'], list) else prop['type']
+        label = prop.get('description') or _TYPE_LABELS.get(json_type, json_type)
+        groups.setdefault(label, []).append(name)
+    return '\n'.join(f"{label}: {', '.join(names)}" for label, names in groups.items())
+
+
+def answer_content(response: Any) -> Optional[str]:
+    """Text of the first choice; ValueError when the model stopped at the token limit.
+
+    A cut answer may still parse (`{"service_value": 1234` of 1234.56), so it
+    is never handed to parse_json_answer.
+    """
+    choice = response.choices[0]
+    if getattr(choice, 'finish_reason', None) == 'length':
+        raise ValueError('Resposta do modelo cortada pelo limite de tokens.')
+    return choice.message.content
+
+
+def parse_json_answer(content: Optional[str]) -> Any:
+    """`json.loads` that tolerates the usual model slips.
+
+    Markdown fences, text around the JSON and trailing commas are repaired
+    before giving up with ValueError. Unbalanced JSON is never completed.
+    """
+    if not content or not content.strip():
+        raise ValueError('Resposta vazia do modelo.')
+    try:
+        return json.loads(content)
+    except ValueError:
+        pass
+
+    text = content.strip()
+    starts = [idx for idx in (text.find('{'), text.find('[')) if idx >= 0]
+    if not starts:
+        raise ValueError('Resposta do modelo não contém JSON.')
+    text = text[min(starts):]
+    end = max(text.rfind('}'), text.rfind(']'))
+    if end > 0:
+        text = text[: end + 1]
+    try:
+        return json.loads(_repair(text))
+    except ValueError as exc:
+        raise ValueError(f'Resposta do modelo não é um JSON válido: {exc}') from exc
+
+
+def _repair(text: str) -> str:
+    """Drops the commas before `}` and `]`, leaving strings untouched."""
+    out: list[str] = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in '}]':
+            _drop_trailing_comma(out)
+        out.append(char)
+    return ''.join(out)
+
+
+def _drop_trailing_comma(out: list[str]) -> None:
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
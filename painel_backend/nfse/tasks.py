@@ -1,28 +1,134 @@
+import logging
 import threading
-from pathlib import Path
-from time import perf_counter
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
 from django.core.files.storage import default_storage
-from django.db import close_old_connections
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
 
 from .models import ImportJob, ImportJobFile
+from .pipeline import ImportPipeline, JobRun, ocr_pool, process_file
 from .services import NFSeImporter
+from .uploads import JobFileBuilder
+
+logger = logging.getLogger(__name__)
+
+QUEUED_STATUSES = [ImportJob.Status.PENDING, ImportJob.Status.PROCESSING]
+OPEN_FILE_STATUSES = [ImportJobFile.Status.PENDING, ImportJobFile.Status.PROCESSING]
+
+CONCURRENCY_SEQUENTIAL = 'sequential'
+CONCURRENCY_PARALLEL = 'parallel'
+
 
-JOB_THREADS: dict[str, threading.Thread] = {}
-JOB_LOCK = threading.Lock()
+def lease_seconds() -> int:
+    return int(getattr(settings, 'NFSE_WORKER_LEASE_SECONDS', 300))
 
 
 def enqueue_job(job_id: str) -> None:
-    with JOB_LOCK:
-        thread = JOB_THREADS.get(job_id)
-        if thread and thread.is_alive():
-            return
+    """Makes the job claimable by a `manage.py nfse_worker` process."""
+    ImportJob.objects.filter(pk=job_id).exclude(status__in=QUEUED_STATUSES).update(
+        status=ImportJob.Status.PENDING, updated_at=timezone.now()
+    )
+
+
+def claim_next_job(worker_id: str, duration: Optional[int] = None) -> Optional[ImportJob]:
+    """Leases the oldest queued job whose lease is free or expired.
+
+    Uses `SELECT ... FOR UPDATE SKIP LOCKED` so concurrent workers never block
+    on (or claim) the same row.
+    """
+    now = timezone.now()
+    duration = duration or lease_seconds()
+    with transaction.atomic():
+        job = (
+            ImportJob.objects.select_for_update(skip_locked=True)
+            .filter(status__in=QUEUED_STATUSES)
+            .filter(Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now))
+            .filter(
+                Exists(
+                    ImportJobFile.objects.filter(
+                        job=OuterRef('pk'), status__in=OPEN_FILE_STATUSES
+                    )
+                )
+            )
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+
+        if job.lease_owner:
+            logger.warning(
+                'Recuperando job %s com lease expirado (worker anterior: %s).',
+                job.id,
+                job.lease_owner,
+            )
+            _recover_interrupted_files(job)
+
+        ImportJob.objects.filter(pk=job.pk).update(
+            lease_owner=worker_id,
+            lease_expires_at=now + timedelta(seconds=duration),
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+    job.refresh_from_db()
+    return job
+
+
+def renew_leases(worker_id: str, job_ids: list[str], duration: Optional[int] = None) -> set[str]:
+    """Extends the leases held by `worker_id`; returns the ids that were renewed."""
+    if not job_ids:
+        return set()
+    now = timezone.now()
+    duration = duration or lease_seconds()
+    ImportJob.objects.filter(pk__in=job_ids, lease_owner=worker_id).update(
+        lease_expires_at=now + timedelta(seconds=duration),
+        heartbeat_at=now,
+    )
+    renewed = ImportJob.objects.filter(
+        pk__in=job_ids, lease_owner=worker_id
+    ).values_list('pk', flat=True)
+    return {str(pk) for pk in renewed}
+
+
+def release_lease(job_id: str, worker_id: str) -> None:
+    ImportJob.objects.filter(pk=job_id, lease_owner=worker_id).update(
+        lease_owner='',
+        lease_expires_at=None,
+        attempts=0,
+    )
+
 
-        thread = threading.Thread(target=_run_job, args=(job_id,), daemon=True)
-        JOB_THREADS[job_id] = thread
-        thread.start()
+def _recover_interrupted_files(job: ImportJob) -> None:
+    """Requeues the files a dead worker left in processing.
+
+    Interruptions are counted per file, so only a file that was in flight
+    in NFSE_WORKER_MAX_ATTEMPTS crashes is failed; the files processed next
+    to it go back to pending.
+    """
+    max_attempts = int(getattr(settings, 'NFSE_WORKER_MAX_ATTEMPTS', 3))
+    now = timezone.now()
+    interrupted = job.files.filter(status=ImportJobFile.Status.PROCESSING)
+    interrupted.update(interruptions=F('interruptions') + 1, updated_at=now)
+    interrupted.filter(interruptions__gte=max_attempts).update(
+        status=ImportJobFile.Status.ERROR,
+        stage=ImportJobFile.Stage.ERROR,
+        progress=100,
+        message='Processamento interrompido repetidamente; verifique o arquivo.',
+        updated_at=now,
+    )
+    interrupted.update(
+        status=ImportJobFile.Status.PENDING,
+        stage=ImportJobFile.Stage.QUEUED,
+        progress=0,
+        updated_at=now,
+    )
 
 
-def _run_job(job_id: str) -> None:
+def run_job(job_id: str, stop_event: Optional[threading.Event] = None) -> None:
     close_old_connections()
     try:
         job = ImportJob.objects.get(id=job_id)
@@ -36,88 +142,88 @@ def _run_job(job_id: str) -> None:
         ocr_language=options.get('ocrLanguage'),
         company_code=options.get('companyCode'),
         competence_period=options.get('competencePeriod'),
+        use_llm_cache=not options.get('bypassLlmCache'),
+        hybrid=options.get('hybridExtraction'),
+        batch_size=options.get('llmBatchSize'),
+        force_refresh=bool(options.get('forceRefresh')),
+        # scanned pages are OCR'd in parallel in both concurrency modes
+        ocr_executor=ocr_pool(),
+    )
+    mode = options.get('concurrency') or getattr(
+        settings, 'NFSE_CONCURRENCY_MODE', CONCURRENCY_PARALLEL
     )
+    run = JobRun(job=job, importer=importer, parallel=mode == CONCURRENCY_PARALLEL)
 
+    # counters are updated incrementally from here on; start from a recount
+    job.refresh_totals()
     job.status = ImportJob.Status.PROCESSING
     job.save(update_fields=['status', 'updated_at'])
 
-    files = job.files.filter(status__in=['pending', 'processing']).order_by('created_at')
-    for job_file in files:
-        _process_file(importer, job, job_file)
-
+    # Files can be re-queued (reprocess) while the job is running; keep going
+    # until nothing is left so the lease is only released on an idle job.
+    while not (stop_event and stop_event.is_set()):
+        if expand_archives(job):
+            run.flush_totals(force=True)
+            job.refresh_totals()
+        files = list(
+            job.files.filter(status__in=OPEN_FILE_STATUSES).order_by('created_at')
+        )
+        if not files:
+            break
+        if run.parallel:
+            pipeline = ImportPipeline(
+                run, stop_event=stop_event, workers=_max_parallel_files(options)
+            )
+            pipeline.process(files)
+        else:
+            for job_file in files:
+                if stop_event and stop_event.is_set():
+                    break
+                process_file(run, job_file)
+                run.flush_totals(force=True)
+
+    run.save_metrics()
     job.refresh_totals()
 
 
-def _process_file(importer: NFSeImporter, job: ImportJob, job_file: ImportJobFile) -> None:
-    job_file.status = ImportJobFile.Status.PROCESSING
-    job_file.stage = ImportJobFile.Stage.OCR
-    job_file.progress = 5
-    job_file.message = ''
-    job_file.save(update_fields=['status', 'stage', 'progress', 'message', 'updated_at'])
-
-    try:
-        file_path = _resolve_path(job_file.stored_file.name)
-        text_start = perf_counter()
-        text = importer.extract_text(Path(file_path))
-        text_time = perf_counter() - text_start
-        has_billing_markers = importer.has_billing_markers(text)
-
-        if not importer.is_service_invoice(text):
-            job_file.status = ImportJobFile.Status.IGNORED
-            job_file.stage = ImportJobFile.Stage.DONE
-            job_file.progress = 100
-            job_file.message = 'Ignorado: não parece ser NF de serviços.'
-            job_file.save(
+def expand_archives(job: ImportJob) -> int:
+    """Expands the ZIP placeholders of an asynchronous upload; returns how many."""
+    placeholders = list(
+        job.files.filter(status__in=OPEN_FILE_STATUSES, file_name__iendswith='.zip')
+    )
+    builder = JobFileBuilder()
+    for placeholder in placeholders:
+        placeholder.status = ImportJobFile.Status.PROCESSING
+        placeholder.message = 'Descompactando arquivo ZIP.'
+        placeholder.save(update_fields=['status', 'message', 'updated_at'])
+        archive_name = placeholder.stored_file.name
+        try:
+            job_files = builder.expand_archive(job, placeholder.file_name, archive_name)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.warning('Falha ao descompactar %s: %s', placeholder.file_name, exc)
+            # the ZIP is kept so it is still offered in the "outros" download
+            placeholder.status = ImportJobFile.Status.ERROR
+            placeholder.stage = ImportJobFile.Stage.ERROR
+            placeholder.progress = 100
+            placeholder.message = str(exc)
+            placeholder.save(
                 update_fields=['status', 'stage', 'progress', 'message', 'updated_at']
             )
-            job.refresh_totals()
-            return
-
-        job_file.stage = ImportJobFile.Stage.AI
-        job_file.progress = 65
-        job_file.save(update_fields=['stage', 'progress', 'updated_at'])
-
-        nfse = importer.process_file(
-            file_path, pre_extracted={'text': text, 'time': text_time}
-        )
-
-        job_file.status = ImportJobFile.Status.COMPLETED
-        job_file.stage = ImportJobFile.Stage.DONE
-        job_file.progress = 100
-        job_file.message = 'NF importada com sucesso.'
-        job_file.result = nfse
-        job_file.export_to_others = has_billing_markers
-        job_file.save(
-            update_fields=[
-                'status',
-                'stage',
-                'progress',
-                'message',
-                'result',
-                'export_to_others',
-                'updated_at',
-            ]
-        )
-    except Exception as exc:  # pylint: disable=broad-except
-        job_file.status = ImportJobFile.Status.ERROR
-        job_file.stage = ImportJobFile.Stage.ERROR
-        job_file.progress = 100
-        job_file.message = str(exc)
-        job_file.save(
-            update_fields=['status', 'stage', 'progress', 'message', 'updated_at']
-        )
-    finally:
-        job.refresh_totals()
-
-
-def _resolve_path(stored_name: str) -> str:
-    storage = default_storage
-    if hasattr(storage, 'path'):
-        return storage.path(stored_name)
-    # fallback: download to a temporary file
-    tmp_dir = Path('/tmp/nfse_uploads')
-    tmp_dir.mkdir(parents=True, exist_ok=True)
-    destination = tmp_dir / Path(stored_name).name
-    with storage.open(stored_name, 'rb') as source, open(destination, 'wb') as target:
-        target.write(source.read())
-    return str(destination)
+            continue
+
+        with transaction.atomic():
+            ImportJobFile.objects.bulk_create(job_files)
+            placeholder.delete()
+        try:
+            default_storage.delete(archive_name)
+        except Exception:  # pragma: no cover - limpeza best-effort
+            pass
+    return len(placeholders)
+
+
+def _max_parallel_files(options: dict) -> int:
+    limit = int(getattr(settings, 'NFSE_JOB_MAX_PARALLEL_FILES', 4))
+    requested = options.get('maxParallelFiles')
+    if requested:
+        limit = min(limit, int(requested))
+    return max(1, limit)
@@ -0,0 +1,108 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from auditlog.models import AuditLog
+from auditlog.registry import register_model
+from nfse.models import ReinfNFS
+from nfse.persistence import bulk_upsert
+
+ACCESS_KEYS = [
+    '31062002212345678000195000000000000124010000000001',
+    '31062002212345678000195000000000000124010000000002',
+]
+
+
+def record(access_key: str, **values):
+    return access_key, {
+        'file_name': f'{access_key[-4:]}.pdf',
+        'number': access_key[-4:],
+        'emitter_name': 'EMPRESA PRESTADORA LTDA',
+        'emitter_cnpj': '12345678000195',
+        'taker_name': 'CLIENTE TOMADOR SA',
+        'service_value': Decimal('1000.00'),
+        **values,
+    }
+
+
+class BulkUpsertTests(TestCase):
+    # the sample NF seeded by the migrations is left out
+    notes = ReinfNFS.objects.filter(access_key__in=ACCESS_KEYS)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # idempotent; the project settings already audit ReinfNFS
+        register_model(ReinfNFS)
+
+    def audit_logs(self):
+        return AuditLog.objects.filter(model_name='ReinfNFS').order_by('id')
+
+    def test_creates_rows_and_returns_their_ids(self):
+        ids = bulk_upsert([record(key) for key in ACCESS_KEYS])
+
+        self.assertEqual(set(ids), set(ACCESS_KEYS))
+        self.assertEqual(dict(self.notes.values_list('access_key', 'pk')), ids)
+
+    def test_updates_existing_rows_in_place(self):
+        first = bulk_upsert([record(ACCESS_KEYS[0])])
+
+        second = bulk_upsert([record(ACCESS_KEYS[0], service_value=Decimal('1500.00'))])
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.notes.get().service_value, Decimal('1500.00'))
+
+    def test_last_record_of_a_repeated_key_wins(self):
+        bulk_upsert(
+            [
+                record(ACCESS_KEYS[0], number='1'),
+                record(ACCESS_KEYS[0], number='2'),
+            ]
+        )
+
+        self.assertEqual(self.notes.get().number, '2')
+
+    def test_small_chunks_write_every_record(self):
+        ids = bulk_upsert([record(key) for key in ACCESS_KEYS], chunk_size=1)
+
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(self.notes.count(), 2)
+
+    def test_new_rows_get_create_entries(self):
+        ids = bulk_upsert([record(key) for key in ACCESS_KEYS])
+
+        logs = list(self.audit_logs())
+        self.assertEqual([log.action for log in logs], [AuditLog.Action.CREATE] * 2)
+        self.assertEqual(
+            {log.object_pk for log in logs}, {str(pk) for pk in ids.values()}
+        )
+        self.assertEqual(logs[0].changes['after']['service_value'], '1000.00')
+
+    def test_changed_rows_get_update_entries_with_the_diff(self):
+        ids = bulk_upsert([record(ACCESS_KEYS[0])])
+
+        bulk_upsert([record(ACCESS_KEYS[0], service_value=Decimal('1500.00'))])
+
+        update = self.audit_logs().last()
+        self.assertEqual(update.action, AuditLog.Action.UPDATE)
+        self.assertEqual(update.object_pk, str(ids[ACCESS_KEYS[0]]))
+        self.assertEqual(
+            update.changes['service_value'], {'before': '1000.00', 'after': '1500.00'}
+        )
+
+    def test_unchanged_rows_get_no_entry(self):
+        bulk_upsert([record(ACCESS_KEYS[0])])
+
+        bulk_upsert([record(ACCESS_KEYS[0])])
+
+        self.assertEqual(self.audit_logs().count(), 1)
+
+    def test_audit_entries_are_written_in_one_query(self):
+        bulk_upsert([record(ACCESS_KEYS[0])])
+        records = [record(key, service_value=Decimal('2000.00')) for key in ACCESS_KEYS]
+
+        # existing rows, upsert, ids and the audit INSERT
+        with self.assertNumQueries(4):
+            bulk_upsert(records)
+
+        self.assertEqual(self.audit_logs().count(), 3)
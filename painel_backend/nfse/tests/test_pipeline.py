@@ -0,0 +1,119 @@
+import threading
+from collections import Counter
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+
+from nfse.models import ImportJob, ImportJobFile
+from nfse.pipeline import ImportPipeline, JobRun, _ignore_file, process_file
+from nfse.services import NFSeImporter
+
+# long enough for a healthy run, short enough to report a hang
+PIPELINE_TIMEOUT = 30
+
+
+def importer(batch_size: int = 1) -> NFSeImporter:
+    # the unreachable endpoint makes any request that slips through fail fast
+    return NFSeImporter(model='llama3.2', base_url='http://127.0.0.1:9/v1', batch_size=batch_size)
+
+
+def extracted(run, work) -> bool:
+    work.text = 'Nota fiscal de serviços eletrônica'
+    work.job_file.classified_by = ImportJobFile.Classification.FIRST_PAGE
+    return True
+
+
+class PipelineErrorTests(TransactionTestCase):
+    def setUp(self):
+        self.job = ImportJob.objects.create(status=ImportJob.Status.PROCESSING)
+        ImportJobFile.objects.bulk_create(
+            [ImportJobFile(job=self.job, file_name=f'nf_{idx:02}.pdf') for idx in range(12)]
+        )
+        for target, replacement in (
+            ('nfse.pipeline.resolve_path', lambda name: name),
+            ('nfse.pipeline._extract_stage', extracted),
+        ):
+            patcher = mock.patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_pipeline(self, run: JobRun) -> None:
+        pipeline = ImportPipeline(run, workers=2, queue_size=2)
+        thread = threading.Thread(target=pipeline.process, args=(list(self.job.files.all()),))
+        thread.daemon = True
+        thread.start()
+        thread.join(PIPELINE_TIMEOUT)
+        self.assertFalse(thread.is_alive(), 'o pipeline travou')
+
+    def statuses(self) -> Counter:
+        return Counter(self.job.files.values_list('status', flat=True))
+
+    def test_failing_batch_request_fails_its_files_without_hanging(self):
+        run = JobRun(job=self.job, importer=importer(batch_size=2), parallel=True)
+
+        with mock.patch.object(
+            NFSeImporter,
+            'extract_payloads',
+            side_effect=RuntimeError('Nenhum modelo disponível para a requisição.'),
+        ):
+            self.run_pipeline(run)
+
+        self.assertEqual(self.statuses(), Counter({ImportJobFile.Status.ERROR: 12}))
+        self.assertEqual(
+            set(self.job.files.values_list('message', flat=True)),
+            {'Nenhum modelo disponível para a requisição.'},
+        )
+
+    def test_unreachable_model_fails_every_file_of_the_batch(self):
+        run = JobRun(job=self.job, importer=importer(batch_size=2), parallel=True)
+
+        with mock.patch.object(
+            NFSeImporter, '_request_completion', side_effect=RuntimeError('sem modelo')
+        ):
+            self.run_pipeline(run)
+
+        self.assertEqual(self.statuses(), Counter({ImportJobFile.Status.ERROR: 12}))
+
+    def test_failing_file_does_not_stop_the_others(self):
+        run = JobRun(job=self.job, importer=importer(), parallel=True)
+
+        def extract(run, work):
+            if work.job_file.file_name == 'nf_03.pdf':
+                raise ValueError('PDF corrompido')
+            _ignore_file(run, work.job_file)
+            return False
+
+        with mock.patch('nfse.pipeline._extract_stage', extract):
+            self.run_pipeline(run)
+
+        self.assertEqual(
+            self.statuses(),
+            Counter({ImportJobFile.Status.IGNORED: 11, ImportJobFile.Status.ERROR: 1}),
+        )
+        self.assertEqual(self.job.files.get(file_name='nf_03.pdf').message, 'PDF corrompido')
+
+    def test_failing_llm_stage_fails_the_file(self):
+        run = JobRun(job=self.job, importer=importer(), parallel=True)
+
+        with mock.patch.object(NFSeImporter, 'extract_payload', side_effect=ValueError('JSON')):
+            self.run_pipeline(run)
+
+        self.assertEqual(self.statuses(), Counter({ImportJobFile.Status.ERROR: 12}))
+
+
+class ProcessFileTests(TestCase):
+    def test_failure_after_classification_keeps_it(self):
+        job = ImportJob.objects.create(status=ImportJob.Status.PROCESSING)
+        job_file = ImportJobFile.objects.create(job=job, file_name='nf.pdf')
+        run = JobRun(job=job, importer=importer())
+
+        with mock.patch('nfse.pipeline.resolve_path', lambda name: name), mock.patch(
+            'nfse.pipeline._extract_stage', extracted
+        ), mock.patch.object(NFSeImporter, 'extract_payload', side_effect=ValueError('JSON')):
+            process_file(run, job_file)
+
+        job_file.refresh_from_db()
+        self.assertEqual(job_file.status, ImportJobFile.Status.ERROR)
+        self.assertEqual(job_file.stage, ImportJobFile.Stage.ERROR)
+        self.assertEqual(job_file.message, 'JSON')
+        self.assertEqual(job_file.classified_by, ImportJobFile.Classification.FIRST_PAGE)
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from nfse.structured_output import answer_content, parse_json_answer
+
+
+def completion(content: str, finish_reason: str = 'stop'):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(finish_reason=finish_reason, message=message)])
+
+
+class ParseJSONAnswerTests(SimpleTestCase):
+    def test_plain_json(self):
+        self.assertEqual(parse_json_answer('{"number": "12"}'), {'number': '12'})
+
+    def test_markdown_fence_and_surrounding_text(self):
+        content = 'Segue o JSON:\n```json\n{"number": "12"}\n```\nQualquer dúvida, avise.'
+        self.assertEqual(parse_json_answer(content), {'number': '12'})
+
+    def test_trailing_commas(self):
+        self.assertEqual(
+            parse_json_answer('{"notas": [{"a": 1,}, {"a": 2},],}'),
+            {'notas': [{'a': 1}, {'a': 2}]},
+        )
+
+    def test_commas_inside_strings_are_kept(self):
+        self.assertEqual(parse_json_answer('{"a": "x,]", }'), {'a': 'x,]'})
+
+    def test_truncated_answer_is_not_completed(self):
+        with self.assertRaises(ValueError):
+            parse_json_answer('{"number": "12", "service_value": 1234')
+
+    def test_empty_answer(self):
+        with self.assertRaisesMessage(ValueError, 'Resposta vazia'):
+            parse_json_answer('  ')
+
+    def test_answer_without_json(self):
+        with self.assertRaisesMessage(ValueError, 'não contém JSON'):
+            parse_json_answer('Não encontrei a nota.')
+
+
+class AnswerContentTests(SimpleTestCase):
+    def test_returns_the_message_content(self):
+        self.assertEqual(answer_content(completion('{}')), '{}')
+
+    def test_answer_cut_at_the_token_limit_fails(self):
+        with self.assertRaisesMessage(ValueError, 'limite de tokens'):
+            answer_content(completion('{"service_value": 1234', finish_reason='length'))
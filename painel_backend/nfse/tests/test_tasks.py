@@ -0,0 +1,92 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from nfse.models import ImportJob, ImportJobFile
+from nfse.tasks import claim_next_job, release_lease, renew_leases
+
+
+class JobLeaseTests(TestCase):
+    def create_job(self, *file_statuses, **fields) -> ImportJob:
+        job = ImportJob.objects.create(status=ImportJob.Status.PENDING, **fields)
+        for idx, file_status in enumerate(file_statuses):
+            ImportJobFile.objects.create(job=job, file_name=f'nf_{idx}.pdf', status=file_status)
+        return job
+
+    def expire_lease(self, job: ImportJob, owner: str = 'worker-morto') -> None:
+        ImportJob.objects.filter(pk=job.pk).update(
+            lease_owner=owner, lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_claims_the_oldest_job_with_open_files(self):
+        self.create_job(ImportJobFile.Status.COMPLETED)
+        oldest = self.create_job(ImportJobFile.Status.PENDING)
+        self.create_job(ImportJobFile.Status.PENDING)
+
+        job = claim_next_job('worker-1', duration=60)
+
+        self.assertEqual(job.pk, oldest.pk)
+        self.assertEqual(job.lease_owner, 'worker-1')
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.lease_expires_at, timezone.now())
+
+    def test_leased_job_is_not_claimed_twice(self):
+        self.create_job(ImportJobFile.Status.PENDING)
+
+        self.assertIsNotNone(claim_next_job('worker-1'))
+        self.assertIsNone(claim_next_job('worker-2'))
+
+    def test_released_job_can_be_claimed_again(self):
+        self.create_job(ImportJobFile.Status.PENDING)
+        job = claim_next_job('worker-1')
+
+        release_lease(str(job.pk), 'worker-1')
+        job.refresh_from_db()
+
+        self.assertEqual(job.lease_owner, '')
+        self.assertIsNone(job.lease_expires_at)
+        self.assertEqual(job.attempts, 0)
+        self.assertEqual(claim_next_job('worker-2').pk, job.pk)
+
+    def test_release_by_another_worker_is_ignored(self):
+        self.create_job(ImportJobFile.Status.PENDING)
+        job = claim_next_job('worker-1')
+
+        release_lease(str(job.pk), 'worker-2')
+        job.refresh_from_db()
+
+        self.assertEqual(job.lease_owner, 'worker-1')
+
+    def test_only_the_owner_renews_a_lease(self):
+        job = self.create_job(ImportJobFile.Status.PENDING)
+        claim_next_job('worker-1')
+
+        self.assertEqual(renew_leases('worker-2', [str(job.pk)]), set())
+        self.assertEqual(renew_leases('worker-1', [str(job.pk)]), {str(job.pk)})
+
+    @override_settings(NFSE_WORKER_MAX_ATTEMPTS=3)
+    def test_expired_lease_requeues_interrupted_files(self):
+        job = self.create_job(ImportJobFile.Status.PROCESSING, ImportJobFile.Status.PENDING)
+        self.expire_lease(job)
+
+        claimed = claim_next_job('worker-1')
+
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(
+            list(job.files.order_by('file_name').values_list('status', 'interruptions')),
+            [(ImportJobFile.Status.PENDING, 1), (ImportJobFile.Status.PENDING, 0)],
+        )
+
+    @override_settings(NFSE_WORKER_MAX_ATTEMPTS=3)
+    def test_only_the_file_interrupted_every_time_fails(self):
+        job = self.create_job(ImportJobFile.Status.PROCESSING, ImportJobFile.Status.PROCESSING)
+        job.files.filter(file_name='nf_0.pdf').update(interruptions=2)
+        self.expire_lease(job)
+
+        claim_next_job('worker-1')
+
+        self.assertEqual(
+            list(job.files.order_by('file_name').values_list('status', 'interruptions')),
+            [(ImportJobFile.Status.ERROR, 3), (ImportJobFile.Status.PENDING, 1)],
+        )
@@ -0,0 +1,52 @@
+from django.test import SimpleTestCase
+
+from nfse.text_analysis import Hit, KeywordAutomaton, KeywordSets
+
+
+class KeywordAutomatonTests(SimpleTestCase):
+    def test_finds_every_occurrence(self):
+        automaton = KeywordAutomaton(['nfse', 'tomador'])
+
+        hits = automaton.find('nfse do tomador\ntomador')
+
+        self.assertEqual(
+            hits, [Hit(0, 0, 'nfse'), Hit(8, 0, 'tomador'), Hit(16, 1, 'tomador')]
+        )
+
+    def test_reports_overlapping_keywords(self):
+        automaton = KeywordAutomaton(['iss', 'issqn', 'sq'])
+
+        hits = automaton.find('issqn')
+
+        self.assertEqual(
+            sorted((hit.start, hit.keyword) for hit in hits),
+            [(0, 'iss'), (0, 'issqn'), (2, 'sq')],
+        )
+
+    def test_follows_failure_links(self):
+        # "nota fiscal" fails after "nota f" and must still find "fatura"
+        automaton = KeywordAutomaton(['nota fiscal', 'fatura'])
+
+        hits = automaton.find('nota fatura')
+
+        self.assertEqual(hits, [Hit(5, 0, 'fatura')])
+
+    def test_ignores_duplicates_and_empty_keywords(self):
+        automaton = KeywordAutomaton(['dps', 'dps', ''])
+
+        self.assertEqual(automaton.find('dps'), [Hit(0, 0, 'dps')])
+
+    def test_no_keywords(self):
+        self.assertEqual(KeywordAutomaton([]).find('qualquer texto'), [])
+
+
+class KeywordSetsTests(SimpleTestCase):
+    def test_groups_share_one_scan(self):
+        sets = KeywordSets(service=['nfse', 'iss'], billing=['boleto'])
+
+        analysis = sets.analyze('NFSe  com   ISS\nBoleto anexo')
+
+        self.assertEqual(analysis.text, 'NFSe com ISS\nBoleto anexo')
+        self.assertEqual(analysis.keywords('service'), {'nfse', 'iss'})
+        self.assertEqual(analysis.lines('billing'), {1})
+        self.assertIs(sets.analyze('NFSe  com   ISS\nBoleto anexo'), analysis)
@@ -0,0 +1,94 @@
+import hashlib
+import io
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import ValidationError
+
+from nfse.uploads import (
+    UploadOffsetConflict,
+    append_chunk,
+    finalize_upload,
+    start_upload_session,
+)
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root, NFSE_UPLOAD_TMP_DIR='')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.session = start_upload_session(None, 'nota.pdf', 10, checksum=sha256(b'helloworld'))
+
+    def append(self, offset: int, data: bytes, length=None, checksum: str = '') -> int:
+        length = len(data) if length is None else length
+        return append_chunk(self.session, offset, io.BytesIO(data), length, checksum)
+
+    def partial_bytes(self) -> bytes:
+        return Path(self.session.partial_path).read_bytes()
+
+    def test_chunks_are_appended_in_order(self):
+        self.assertEqual(self.append(0, b'hello', checksum=sha256(b'hello')), 5)
+        self.session.refresh_from_db()
+        self.assertEqual(self.append(5, b'world'), 10)
+
+        self.assertEqual(self.partial_bytes(), b'helloworld')
+
+    def test_wrong_offset_is_a_conflict_with_the_expected_offset(self):
+        self.append(0, b'hello')
+
+        # a stale session object: the offset is checked again under the lock
+        with self.assertRaises(UploadOffsetConflict) as raised:
+            self.append(0, b'hello')
+
+        self.assertEqual(raised.exception.detail['offset'], 5)
+        self.assertEqual(self.partial_bytes(), b'hello')
+
+    def test_chunk_with_wrong_checksum_is_not_written(self):
+        with self.assertRaisesMessage(ValidationError, 'Checksum do trecho'):
+            self.append(0, b'hello', checksum=sha256(b'other'))
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.offset, 0)
+        self.assertEqual(self.partial_bytes(), b'')
+
+    def test_incomplete_chunk_is_not_written(self):
+        with self.assertRaisesMessage(ValidationError, 'Trecho incompleto'):
+            self.append(0, b'hel', length=5)
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.offset, 0)
+        self.assertEqual(self.partial_bytes(), b'')
+
+    def test_chunk_past_the_declared_size_is_rejected(self):
+        with self.assertRaisesMessage(ValidationError, 'ultrapassa o tamanho'):
+            self.append(0, b'hello world')
+
+    def test_finalize_moves_the_verified_file_to_storage(self):
+        self.append(0, b'helloworld')
+        self.session.refresh_from_db()
+
+        session = finalize_upload(self.session)
+
+        self.assertTrue(session.upload_token)
+        self.assertEqual((Path(self.media_root) / session.upload_token).read_bytes(), b'helloworld')
+        self.assertFalse(Path(self.session.partial_path).exists())
+
+    def test_finalize_with_wrong_checksum_restarts_the_upload(self):
+        self.append(0, b'hellowordl')
+        self.session.refresh_from_db()
+
+        with self.assertRaisesMessage(ValidationError, 'upload foi reiniciado'):
+            finalize_upload(self.session)
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.offset, 0)
+        self.assertEqual(self.partial_bytes(), b'')
@@ -0,0 +1,69 @@
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase
+
+from nfse.xml_importer import parse_nfse_xml
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+
+class ParseNFSeXMLTests(SimpleTestCase):
+    def parse_text(self, content: str, encoding: str = 'utf-8'):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'nota.xml'
+            path.write_bytes(content.encode(encoding))
+            return parse_nfse_xml(path, path.name)
+
+    def test_national_note_uses_the_id_as_access_key(self):
+        payloads, voided = parse_nfse_xml(FIXTURES / 'nacional.xml', 'nacional.xml')
+
+        self.assertEqual(voided, 0)
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual(
+            payloads[0]['access_key'], '31062002212345678000195000000000000124010000000001'
+        )
+        self.assertEqual(payloads[0]['number'], '12')
+        self.assertEqual(payloads[0]['service_value'], '1000.00')
+        self.assertEqual(payloads[0]['file_name'], 'nacional.xml')
+
+    def test_abrasf_list_yields_every_note(self):
+        payloads, voided = parse_nfse_xml(FIXTURES / 'abrasf.xml', 'abrasf.xml')
+
+        self.assertEqual(voided, 0)
+        self.assertEqual([payload['number'] for payload in payloads], ['101', '102'])
+        # IBGE code + emitter CNPJ + note number
+        self.assertEqual(payloads[0]['access_key'], '355030812345678000195000000000000101')
+
+    def test_cancelled_abrasf_notes_are_skipped_and_counted(self):
+        payloads, voided = parse_nfse_xml(FIXTURES / 'abrasf_voided.xml', 'abrasf_voided.xml')
+
+        self.assertEqual(voided, 1)
+        self.assertEqual([payload['number'] for payload in payloads], ['102'])
+
+    def test_doctype_is_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'DOCTYPE'):
+            self.parse_text('<?xml version="1.0"?><!DOCTYPE x SYSTEM "file:///etc/passwd"><x/>')
+
+    def test_doctype_is_rejected_in_other_encodings(self):
+        content = (
+            '<?xml version="1.0" encoding="UTF-16"?>'
+            '<!DOCTYPE x [<!ENTITY e "boom">]><x>&e;</x>'
+        )
+        with self.assertRaisesMessage(ValueError, 'DOCTYPE'):
+            self.parse_text(content, 'utf-16')
+
+    def test_national_note_without_valid_access_key_fails(self):
+        content = (FIXTURES / 'nacional.xml').read_text(encoding='utf-8').replace(
+            'Id="NFS31062002212345678000195000000000000124010000000001"', 'Id="NFS123"'
+        )
+        with self.assertRaisesMessage(ValueError, 'sem chave de acesso válida'):
+            self.parse_text(content)
+
+    def test_invalid_xml_raises_value_error(self):
+        with self.assertRaisesMessage(ValueError, 'XML inválido'):
+            self.parse_text('<NFSe><infNFSe>')
+
+    def test_xml_without_notes_raises_value_error(self):
+        with self.assertRaisesMessage(ValueError, 'sem NFS-e reconhecida'):
+            self.parse_text('<?xml version="1.0"?><Outro/>')
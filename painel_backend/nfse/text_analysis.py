@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from .extraction import normalize_text
+
+
+class Hit(NamedTuple):
+    start: int  # offset in the lowercased normalized text
+    line: int  # 0-based line of the normalized text
+    keyword: str
+
+
+class KeywordAutomaton:
+    """Aho–Corasick automaton: every occurrence of every keyword in one pass.
+
+    Overlapping occurrences are all reported ("iss" inside "issqn" too).
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: list[Dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[tuple[str, ...]] = [()]
+        for keyword in dict.fromkeys(keywords):
+            if keyword:
+                self._add(keyword)
+        self._link()
+
+    def _add(self, keyword: str) -> None:
+        state = 0
+        for char in keyword:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[state][char] = following
+            state = following
+        self._out[state] += (keyword,)
+
+    def _link(self) -> None:
+        # breadth first, so the failure state of every parent is ready
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, following in self._goto[state].items():
+                pending.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[following] = target if target != following else 0
+                self._out[following] += self._out[self._fail[following]]
+
+    def find(self, text: str) -> list[Hit]:
+        goto, fail, out = self._goto, self._fail, self._out
+        hits = []
+        state = line = 0
+        for position, char in enumerate(text):
+            if char == '\n':
+                line += 1
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                hits.extend(
+                    Hit(position - len(keyword) + 1, line, keyword) for keyword in out[state]
+                )
+        return hits
+
+
+@dataclass
+class TextAnalysis:
+    """A normalized text and where each keyword set was found in it."""
+
+    text: str
+    hits: Dict[str, list[Hit]]
+
+    def keywords(self, group: str) -> set[str]:
+        return {hit.keyword for hit in self.hits.get(group, ())}
+
+    def lines(self, group: str) -> set[int]:
+        return {hit.line for hit in self.hits.get(group, ())}
+
+
+class KeywordSets:
+    """Named keyword sets (lowercase) matched together by one automaton.
+
+    `analyze` normalizes the text once and keeps the last results, so the
+    classification and the prompt filtering of the same text share one scan.
+    """
+
+    CACHE_SIZE = 32
+
+    def __init__(self, **sets: Iterable[str]):
+        self._groups: Dict[str, tuple[str, ...]] = {}
+        for group, keywords in sets.items():
+            for keyword in keywords:
+                self._groups[keyword] = self._groups.get(keyword, ()) + (group,)
+        self.names = tuple(sets)
+        self.automaton = KeywordAutomaton(self._groups)
+        self._recent: OrderedDict[str, TextAnalysis] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def analyze(self, text: Optional[str]) -> TextAnalysis:
+        text = text or ''
+        with self._lock:
+            cached = self._recent.get(text)
+            if cached is not None:
+                self._recent.move_to_end(text)
+                return cached
+
+        normalized = normalize_text(text)
+        hits: Dict[str, list[Hit]] = {name: [] for name in self.names}
+        for hit in self.automaton.find(normalized.lower()):
+            for group in self._groups[hit.keyword]:
+                hits[group].append(hit)
+        analysis = TextAnalysis(normalized, hits)
+        with self._lock:
+            self._recent[text] = analysis
+            if len(self._recent) > self.CACHE_SIZE:
+                self._recent.popitem(last=False)
+        return analysis
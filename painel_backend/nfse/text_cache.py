@@ -0,0 +1,147 @@
+import hashlib
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from .extraction import join_pages
+from .models import ExtractedPageText
+
+logger = logging.getLogger(__name__)
+
+PageExtractor = Callable[[Path, Optional[Dict[int, str]]], list[str]]
+
+# stores between two recounts of the cached bytes (other workers write too)
+RECOUNT_EVERY = 50
+
+
+def file_digest(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handler:
+        for chunk in iter(lambda: handler.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PageTextCache:
+    """Persistent cache of extracted page text.
+
+    Entries are keyed by the SHA-256 of the PDF bytes, the OCR language and
+    the `OCRSettings` fingerprint, one row per page. When the stored text
+    exceeds `max_bytes`, the least recently used documents are evicted. The
+    size is kept as a running total, recounted every RECOUNT_EVERY stores.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, ocr_fingerprint: str = ''):
+        if max_bytes is None:
+            max_bytes = int(getattr(settings, 'NFSE_TEXT_CACHE_MAX_BYTES', 0))
+        self.max_bytes = max_bytes
+        self.ocr_fingerprint = ocr_fingerprint
+        self._total_bytes: Optional[int] = None
+        self._stores = 0
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get_or_extract(
+        self,
+        pdf_path: Path,
+        ocr_language: str,
+        extract: PageExtractor,
+        digest: Optional[str] = None,
+    ) -> str:
+        """Text of the PDF, from the cache when possible (`digest` saves hashing it again)."""
+        pdf_path = Path(pdf_path)
+        if not self.enabled:
+            return join_pages(extract(pdf_path, None))
+
+        digest = digest or file_digest(pdf_path)
+        known, page_count = self.lookup(digest, ocr_language)
+        if known and len(known) == page_count:
+            self.logger.info('Texto de %s reaproveitado do cache (%s).', pdf_path.name, digest[:12])
+            self.touch(digest, ocr_language)
+            return join_pages([known[idx] for idx in range(1, page_count + 1)])
+
+        pages = extract(pdf_path, known or None)
+        self.store(digest, ocr_language, pages, skip=set(known))
+        return join_pages(pages)
+
+    def _entries(self, digest: str, ocr_language: str):
+        return ExtractedPageText.objects.filter(
+            content_hash=digest, ocr_language=ocr_language, ocr_fingerprint=self.ocr_fingerprint
+        )
+
+    def lookup(self, digest: str, ocr_language: str) -> tuple[Dict[int, str], int]:
+        rows = self._entries(digest, ocr_language).values_list('page_number', 'page_count', 'text')
+        known = {}
+        page_count = 0
+        for page_number, count, text in rows:
+            known[page_number] = text
+            page_count = count
+        return known, page_count
+
+    def touch(self, digest: str, ocr_language: str) -> None:
+        self._entries(digest, ocr_language).update(last_used_at=timezone.now())
+
+    def store(
+        self, digest: str, ocr_language: str, pages: list[str], skip: Optional[set] = None
+    ) -> None:
+        skip = skip or set()
+        entries = [
+            ExtractedPageText(
+                content_hash=digest,
+                ocr_language=ocr_language,
+                ocr_fingerprint=self.ocr_fingerprint,
+                page_number=idx,
+                page_count=len(pages),
+                text=text,
+                size=len(text.encode('utf-8')),
+            )
+            for idx, text in enumerate(pages, start=1)
+            if idx not in skip
+        ]
+        if entries:
+            # another worker may have cached the same document meanwhile
+            ExtractedPageText.objects.bulk_create(entries, ignore_conflicts=True)
+        if skip:
+            self.touch(digest, ocr_language)
+
+        self._stores += 1
+        if self._total_bytes is None or self._stores % RECOUNT_EVERY == 0:
+            self._total_bytes = self._stored_bytes()
+        else:
+            self._total_bytes += sum(entry.size for entry in entries)
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    @staticmethod
+    def _stored_bytes() -> int:
+        return ExtractedPageText.objects.aggregate(total=Sum('size'))['total'] or 0
+
+    def evict(self) -> None:
+        total = self._stored_bytes()
+        self._total_bytes = total
+        if total <= self.max_bytes:
+            return
+        # free a little more than needed so eviction does not run on every store
+        to_free = total - int(self.max_bytes * 0.9)
+        freed = 0
+        digests = set()
+        oldest = ExtractedPageText.objects.order_by('last_used_at').values_list(
+            'content_hash', 'size'
+        )
+        for digest, size in oldest.iterator(chunk_size=500):
+            digests.add(digest)
+            freed += size
+            if freed >= to_free:
+                break
+        ExtractedPageText.objects.filter(content_hash__in=digests).delete()
+        self._total_bytes = total - freed
+        self.logger.info(
+            'Cache de texto: %s documentos removidos (%s bytes).', len(digests), freed
+        )
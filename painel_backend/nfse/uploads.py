@@ -0,0 +1,276 @@
+import hashlib
+import logging
+import shutil
+import tempfile
+import uuid
+import zipfile
+from datetime import timedelta
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import ImportJob, ImportJobFile, UploadSession
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 64 * 1024
+# ZIP members that become job files
+ARCHIVE_MEMBERS = ('.pdf', '.xml')
+
+
+class InvalidArchive(ValueError):
+    """The uploaded ZIP is corrupt or has no PDFs or XMLs."""
+
+
+class JobFileBuilder:
+    """Turns upload descriptors into `ImportJobFile` rows, expanding ZIPs.
+
+    With `expand_async`, a ZIP becomes a single placeholder file and the
+    worker expands it later (see `expand_archive`), so the request returns
+    as soon as the job exists.
+    """
+
+    def __init__(self, expand_async: bool = False):
+        self.expand_async = expand_async
+
+    def prepare_job_files(self, job: ImportJob, descriptor: dict) -> list[ImportJobFile]:
+        file_name = descriptor['fileName']
+        upload_token = descriptor['uploadToken']
+        is_zip = is_archive(file_name)
+        if not is_zip or self.expand_async:
+            job_file = ImportJobFile(
+                job=job,
+                file_name=file_name,
+                file_size=descriptor.get('size') or 0,
+                message='Aguardando descompactação.' if is_zip else '',
+            )
+            job_file.stored_file.name = upload_token
+            return [job_file]
+        try:
+            return self.expand_archive(job, file_name, upload_token)
+        except InvalidArchive as exc:
+            raise ValidationError({'detail': str(exc)}) from exc
+        finally:
+            try:
+                default_storage.delete(upload_token)
+            except Exception:  # pragma: no cover - limpeza best-effort
+                pass
+
+    def expand_archive(
+        self, job: ImportJob, original_name: str, upload_token: str
+    ) -> list[ImportJobFile]:
+        """Copies every PDF and XML of the ZIP to storage, streaming each member in chunks."""
+        extracted_files: list[ImportJobFile] = []
+        try:
+            with default_storage.open(upload_token, 'rb') as uploaded_file:
+                with zipfile.ZipFile(uploaded_file) as archive:
+                    for member in archive.infolist():
+                        if member.is_dir() or not member.filename.lower().endswith(ARCHIVE_MEMBERS):
+                            continue
+                        extracted_name = Path(member.filename).name
+                        with archive.open(member) as source:
+                            content = File(source, name=extracted_name)
+                            # avoid File.size seeking through the compressed stream
+                            content.size = member.file_size
+                            saved_name = default_storage.save(
+                                storage_name_for(extracted_name), content
+                            )
+                        job_file = ImportJobFile(
+                            job=job,
+                            file_name=extracted_name,
+                            file_size=member.file_size,
+                        )
+                        job_file.stored_file.name = saved_name
+                        extracted_files.append(job_file)
+        except zipfile.BadZipFile as exc:
+            raise InvalidArchive(f'Arquivo ZIP inválido ({original_name}).') from exc
+
+        if not extracted_files:
+            raise InvalidArchive(
+                f'O arquivo ZIP {original_name} não contém PDFs ou XMLs válidos.'
+            )
+        return extracted_files
+
+
+def is_archive(file_name: str) -> bool:
+    return file_name.lower().endswith('.zip')
+
+
+def storage_name_for(filename: str) -> str:
+    today_path = timezone.now().strftime('%Y/%m/%d')
+    safe_name = Path(filename).name
+    return str(Path('nfse/uploads') / today_path / f'{uuid.uuid4()}_{safe_name}')
+
+
+class UploadOffsetConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'O trecho não começa onde o upload parou.'
+    default_code = 'offset_conflict'
+
+    def __init__(self, offset: int):
+        super().__init__()
+        # keep the offset numeric in the response body
+        self.detail = {'detail': self.detail, 'offset': offset}
+
+
+def max_chunk_bytes() -> int:
+    return int(getattr(settings, 'NFSE_UPLOAD_MAX_CHUNK_BYTES', 16 * 1024 * 1024))
+
+
+def _partial_dir() -> Path:
+    directory = getattr(settings, 'NFSE_UPLOAD_TMP_DIR', '') or (
+        Path(settings.MEDIA_ROOT) / 'nfse' / 'partial'
+    )
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def start_upload_session(
+    user, file_name: str, size: int, checksum: str = ''
+) -> UploadSession:
+    purge_stale_sessions()
+    session_id = uuid.uuid4()
+    partial_path = _partial_dir() / f'{session_id}.part'
+    partial_path.touch()
+    return UploadSession.objects.create(
+        id=session_id,
+        created_by=user if getattr(user, 'is_authenticated', False) else None,
+        file_name=Path(file_name).name,
+        size=size,
+        checksum=checksum.lower(),
+        partial_path=str(partial_path),
+    )
+
+
+def append_chunk(
+    session: UploadSession,
+    offset: int,
+    stream: BinaryIO,
+    length: int,
+    checksum: str = '',
+) -> int:
+    """Writes `length` bytes read from `stream` at `offset`; returns the new offset.
+
+    The chunk only counts once all of it arrived (and matched `checksum`,
+    a SHA-256 hex digest, when given), so the client can simply retry. It
+    is spooled to a temporary file first: the session row is only locked
+    to check the offset and append, never while the body is read.
+    """
+    if length <= 0:
+        raise ValidationError({'detail': 'Trecho vazio.'})
+    if length > max_chunk_bytes():
+        raise ValidationError(
+            {'detail': f'Trecho maior que o permitido ({max_chunk_bytes()} bytes).'}
+        )
+    # rejects a stale offset before the body is read; checked again under the lock
+    _check_chunk(session, offset, length)
+
+    digest = hashlib.sha256()
+    received = 0
+    with tempfile.TemporaryFile(dir=_partial_dir()) as chunk:
+        while received < length:
+            data = stream.read(min(COPY_CHUNK_SIZE, length - received))
+            if not data:
+                break
+            chunk.write(data)
+            digest.update(data)
+            received += len(data)
+        if received != length:
+            raise ValidationError({'detail': 'Trecho incompleto; envie novamente.'})
+        if checksum and digest.hexdigest() != checksum.lower():
+            raise ValidationError({'detail': 'Checksum do trecho não confere; envie novamente.'})
+        chunk.seek(0)
+
+        with transaction.atomic():
+            # the row lock serializes concurrent PUTs to the same session
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            _check_chunk(session, offset, length)
+            with open(session.partial_path, 'r+b') as target:
+                target.seek(offset)
+                try:
+                    shutil.copyfileobj(chunk, target, COPY_CHUNK_SIZE)
+                except OSError:
+                    target.truncate(offset)
+                    raise
+            session.offset = offset + length
+            UploadSession.objects.filter(pk=session.pk).update(
+                offset=session.offset, updated_at=timezone.now()
+            )
+    return session.offset
+
+
+def _check_chunk(session: UploadSession, offset: int, length: int) -> None:
+    if session.completed:
+        raise ValidationError({'detail': 'Upload já finalizado.'})
+    if offset != session.offset:
+        raise UploadOffsetConflict(session.offset)
+    if offset + length > session.size:
+        raise ValidationError({'detail': 'O trecho ultrapassa o tamanho declarado.'})
+
+
+def finalize_upload(session: UploadSession, checksum: str = '') -> UploadSession:
+    """Verifies the SHA-256 of the assembled file and moves it to storage."""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.completed:
+            # finalize retried after a dropped response
+            return session
+        if session.offset != session.size:
+            raise UploadOffsetConflict(session.offset)
+
+        partial_path = Path(session.partial_path)
+        expected = (checksum or session.checksum).lower()
+        corrupted = bool(expected) and _file_sha256(partial_path) != expected
+        if corrupted:
+            # the bytes on disk are unusable: start over
+            with open(partial_path, 'wb'):
+                pass
+            UploadSession.objects.filter(pk=session.pk).update(
+                offset=0, updated_at=timezone.now()
+            )
+        else:
+            with open(partial_path, 'rb') as source:
+                session.upload_token = default_storage.save(
+                    storage_name_for(session.file_name), File(source, name=session.file_name)
+                )
+            UploadSession.objects.filter(pk=session.pk).update(
+                upload_token=session.upload_token, updated_at=timezone.now()
+            )
+
+    if corrupted:
+        raise ValidationError(
+            {'detail': 'Checksum do arquivo não confere; o upload foi reiniciado.'}
+        )
+    partial_path.unlink(missing_ok=True)
+    return session
+
+
+def purge_stale_sessions(max_age: Optional[timedelta] = None) -> int:
+    """Drops sessions (and their partial files) untouched for too long."""
+    if max_age is None:
+        max_age = timedelta(hours=int(getattr(settings, 'NFSE_UPLOAD_SESSION_TTL_HOURS', 24)))
+    stale = UploadSession.objects.filter(updated_at__lt=timezone.now() - max_age)
+    removed = 0
+    for session in stale.only('pk', 'partial_path'):
+        Path(session.partial_path).unlink(missing_ok=True)
+        session.delete()
+        removed += 1
+    if removed:
+        logger.info('%s sessões de upload expiradas removidas.', removed)
+    return removed
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handler:
+        for chunk in iter(lambda: handler.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,121 @@
+import logging
+import os
+import socket
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .tasks import claim_next_job, lease_seconds, release_lease, renew_leases, run_job
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    """Claims import jobs from the database queue and runs them.
+
+    Each worker process runs `concurrency` slots; every slot leases one job at
+    a time. A heartbeat thread keeps the leases alive, so a job whose worker
+    dies is picked up by another process once its lease expires.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        poll_interval: Optional[float] = None,
+        lease_duration: Optional[int] = None,
+        worker_id: Optional[str] = None,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval or float(
+            getattr(settings, 'NFSE_WORKER_POLL_INTERVAL', 5)
+        )
+        self.lease_duration = lease_duration or lease_seconds()
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.stop_event = threading.Event()
+        self._active: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.logger = logger.getChild(self.__class__.__name__)
+
+    def run(self, burst: bool = False) -> None:
+        """Processes jobs until `stop()` is called (or the queue is empty, if `burst`)."""
+        heartbeat = threading.Thread(
+            target=self._heartbeat_loop, name='nfse-worker-heartbeat', daemon=True
+        )
+        heartbeat.start()
+
+        slots = [
+            threading.Thread(
+                target=self._slot_loop, args=(burst,), name=f'nfse-worker-{idx}'
+            )
+            for idx in range(self.concurrency)
+        ]
+        for slot in slots:
+            slot.start()
+        # join with a timeout so the main thread keeps handling signals
+        while any(slot.is_alive() for slot in slots):
+            for slot in slots:
+                slot.join(timeout=1)
+        self.stop_event.set()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        with self._lock:
+            for job_stop in self._active.values():
+                job_stop.set()
+
+    def _slot_loop(self, burst: bool) -> None:
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                job = claim_next_job(self.worker_id, self.lease_duration)
+                if job is None:
+                    if burst:
+                        return
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+                self._run_claimed(str(job.pk))
+        finally:
+            connection.close()
+
+    def _run_claimed(self, job_id: str) -> None:
+        job_stop = threading.Event()
+        with self._lock:
+            self._active[job_id] = job_stop
+        if self.stop_event.is_set():
+            job_stop.set()
+
+        self.logger.info('Worker %s processando job %s.', self.worker_id, job_id)
+        try:
+            run_job(job_id, stop_event=job_stop)
+        except Exception:  # pylint: disable=broad-except
+            # keep the lease: the job becomes claimable again once it expires,
+            # which doubles as a back-off for persistent failures
+            self.logger.exception('Falha inesperada ao processar o job %s.', job_id)
+        else:
+            release_lease(job_id, self.worker_id)
+        finally:
+            with self._lock:
+                self._active.pop(job_id, None)
+
+    def _heartbeat_loop(self) -> None:
+        interval = max(1.0, self.lease_duration / 3)
+        while not self.stop_event.wait(interval):
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            try:
+                renewed = renew_leases(self.worker_id, list(active), self.lease_duration)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception('Falha ao renovar leases do worker %s.', self.worker_id)
+                close_old_connections()
+                continue
+            for job_id, job_stop in active.items():
+                if job_id not in renewed:
+                    self.logger.warning(
+                        'Lease do job %s perdido; interrompendo processamento local.', job_id
+                    )
+                    job_stop.set()
+        connection.close()
@@ -0,0 +1,362 @@
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Any, Callable, Dict, NamedTuple, Optional
+from xml.parsers import expat
+
+from .hybrid import only_digits, valid_access_key
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class XMLRule(NamedTuple):
+    """Value of `field` is the text of the element whose path ends with `path`."""
+
+    field: str
+    path: tuple[str, ...]
+    convert: Optional[Callable[[str], Any]] = None
+
+
+def _flag(*true_codes: str) -> Callable[[str], bool]:
+    return lambda value: value.strip() in true_codes
+
+
+def _decimal(value: str) -> Optional[str]:
+    try:
+        return str(Decimal(value.strip()))
+    except InvalidOperation:
+        return None
+
+
+def _rate(value: str) -> Optional[str]:
+    # ABRASF 1.0 sends the rate as a fraction (0.02); ISS is never below 2%
+    rate = _decimal(value)
+    if rate is not None and Decimal(rate) < 1:
+        return str(Decimal(rate) * 100)
+    return rate
+
+
+def _date(value: str) -> str:
+    return value.strip()[:10]
+
+
+def _coded(names: Dict[str, str]) -> Callable[[str], str]:
+    return lambda value: names.get(value.strip(), value.strip())
+
+
+# national standard (Sistema Nacional NFS-e): NFSe/infNFSe (with DPS/infDPS inside)
+NATIONAL_ROOT = 'infNFSe'
+NATIONAL_TAXATION = {
+    '1': 'Operação Tributável',
+    '2': 'Imunidade',
+    '3': 'Exportação de Serviço',
+    '4': 'Não Incidência',
+}
+NATIONAL_SPECIAL_REGIME = {
+    '0': 'Nenhum',
+    '1': 'Ato Cooperado',
+    '2': 'Estimativa',
+    '3': 'Microempresa Municipal',
+    '4': 'Notário ou Registrador',
+    '5': 'Profissional Autônomo',
+    '6': 'Sociedade de Profissionais',
+}
+NATIONAL_RULES = [
+    XMLRule('number', ('infNFSe', 'nNFSe')),
+    XMLRule('municipality', ('infNFSe', 'xLocEmi')),
+    XMLRule('service_location', ('infNFSe', 'xLocPrestacao')),
+    XMLRule('municipal_incidence_city', ('infNFSe', 'xLocIncid')),
+    XMLRule('emission_datetime', ('infNFSe', 'dhProc')),
+    XMLRule('competence', ('infDPS', 'dCompet'), _date),
+    XMLRule('dps_number', ('infDPS', 'nDPS')),
+    XMLRule('dps_series', ('infDPS', 'serie')),
+    XMLRule('dps_emission_datetime', ('infDPS', 'dhEmi')),
+    XMLRule('emitter_cnpj', ('emit', 'CNPJ')),
+    XMLRule('emitter_cnpj', ('emit', 'CPF')),
+    XMLRule('emitter_inscription', ('emit', 'IM')),
+    XMLRule('emitter_name', ('emit', 'xNome')),
+    XMLRule('emitter_phone', ('emit', 'fone')),
+    XMLRule('emitter_email', ('emit', 'email')),
+    XMLRule('emitter_address', ('emit', 'enderNac', 'xLgr')),
+    XMLRule('emitter_address', ('emit', 'enderNac', 'nro')),
+    XMLRule('emitter_address', ('emit', 'enderNac', 'xBairro')),
+    XMLRule('emitter_zipcode', ('emit', 'enderNac', 'CEP')),
+    XMLRule('emitter_optante_simples', ('regTrib', 'opSimpNac'), _flag('2', '3')),
+    XMLRule('emitter_regime_especial', ('regTrib', 'regEspTrib'), _coded(NATIONAL_SPECIAL_REGIME)),
+    XMLRule('taker_cnpj', ('toma', 'CNPJ')),
+    XMLRule('taker_cnpj', ('toma', 'CPF')),
+    XMLRule('taker_cnpj', ('toma', 'NIF')),
+    XMLRule('taker_name', ('toma', 'xNome')),
+    XMLRule('taker_phone', ('toma', 'fone')),
+    XMLRule('taker_email', ('toma', 'email')),
+    XMLRule('taker_address', ('toma', 'end', 'xLgr')),
+    XMLRule('taker_address', ('toma', 'end', 'nro')),
+    XMLRule('taker_address', ('toma', 'end', 'xBairro')),
+    XMLRule('taker_zipcode', ('toma', 'end', 'endNac', 'CEP')),
+    XMLRule('service_national_code', ('cServ', 'cTribNac')),
+    XMLRule('service_municipal_code', ('cServ', 'cTribMun')),
+    XMLRule('service_description', ('cServ', 'xDescServ')),
+    XMLRule('service_value', ('vServPrest', 'vServ'), _decimal),
+    XMLRule('service_base_calculo', ('infNFSe', 'valores', 'vBC'), _decimal),
+    XMLRule('service_iss_rate', ('infNFSe', 'valores', 'pAliqAplic'), _decimal),
+    XMLRule('service_iss_rate', ('tribMun', 'pAliq'), _decimal),
+    XMLRule('service_iss_value', ('infNFSe', 'valores', 'vISSQN'), _decimal),
+    XMLRule('service_iss_retido', ('tribMun', 'tpRetISSQN'), _flag('2', '3')),
+    XMLRule('municipal_taxation', ('tribMun', 'tribISSQN'), _coded(NATIONAL_TAXATION)),
+    XMLRule('totals_retained_value', ('infNFSe', 'valores', 'vTotalRet'), _decimal),
+    XMLRule('totals_net_value', ('infNFSe', 'valores', 'vLiq'), _decimal),
+    XMLRule('complementary_info', ('infoCompl', 'xInfComp')),
+]
+
+# ABRASF 1.0 and 2.0x (most municipal webservices): CompNfse/Nfse/InfNfse
+ABRASF_ROOT = 'InfNfse'
+ABRASF_SPECIAL_REGIME = {
+    '1': 'Microempresa Municipal',
+    '2': 'Estimativa',
+    '3': 'Sociedade de Profissionais',
+    '4': 'Cooperativa',
+    '5': 'Microempresário Individual (MEI)',
+    '6': 'Microempresário e Empresa de Pequeno Porte (ME EPP)',
+}
+ABRASF_RULES = [
+    XMLRule('number', ('InfNfse', 'Numero')),
+    XMLRule('emission_datetime', ('InfNfse', 'DataEmissao')),
+    XMLRule('competence', ('InfNfse', 'Competencia'), _date),
+    XMLRule('competence', ('InfDeclaracaoPrestacaoServico', 'Competencia'), _date),
+    XMLRule('dps_number', ('IdentificacaoRps', 'Numero')),
+    XMLRule('dps_series', ('IdentificacaoRps', 'Serie')),
+    XMLRule('dps_emission_datetime', ('InfNfse', 'DataEmissaoRps')),
+    XMLRule('dps_emission_datetime', ('Rps', 'DataEmissao')),
+    XMLRule('municipality', ('OrgaoGerador', 'CodigoMunicipio')),
+    XMLRule('service_location', ('Servico', 'CodigoMunicipio')),
+    XMLRule('municipal_incidence_city', ('Servico', 'MunicipioIncidencia')),
+    XMLRule('emitter_cnpj', ('IdentificacaoPrestador', 'CpfCnpj', 'Cnpj')),
+    XMLRule('emitter_cnpj', ('IdentificacaoPrestador', 'CpfCnpj', 'Cpf')),
+    XMLRule('emitter_cnpj', ('IdentificacaoPrestador', 'Cnpj')),
+    XMLRule('emitter_cnpj', ('Prestador', 'CpfCnpj', 'Cnpj')),
+    XMLRule('emitter_cnpj', ('Prestador', 'CpfCnpj', 'Cpf')),
+    XMLRule('emitter_inscription', ('IdentificacaoPrestador', 'InscricaoMunicipal')),
+    XMLRule('emitter_inscription', ('Prestador', 'InscricaoMunicipal')),
+    XMLRule('emitter_name', ('PrestadorServico', 'RazaoSocial')),
+    XMLRule('emitter_phone', ('PrestadorServico', 'Contato', 'Telefone')),
+    XMLRule('emitter_email', ('PrestadorServico', 'Contato', 'Email')),
+    XMLRule('emitter_address', ('PrestadorServico', 'Endereco', 'Endereco')),
+    XMLRule('emitter_address', ('PrestadorServico', 'Endereco', 'Numero')),
+    XMLRule('emitter_address', ('PrestadorServico', 'Endereco', 'Bairro')),
+    XMLRule('emitter_zipcode', ('PrestadorServico', 'Endereco', 'Cep')),
+    XMLRule('emitter_optante_simples', ('OptanteSimplesNacional',), _flag('1')),
+    XMLRule(
+        'emitter_regime_especial', ('RegimeEspecialTributacao',), _coded(ABRASF_SPECIAL_REGIME)
+    ),
+    XMLRule('taker_cnpj', ('IdentificacaoTomador', 'CpfCnpj', 'Cnpj')),
+    XMLRule('taker_cnpj', ('IdentificacaoTomador', 'CpfCnpj', 'Cpf')),
+    XMLRule('taker_name', ('TomadorServico', 'RazaoSocial')),
+    XMLRule('taker_name', ('Tomador', 'RazaoSocial')),
+    XMLRule('taker_phone', ('Tomador', 'Contato', 'Telefone')),
+    XMLRule('taker_phone', ('TomadorServico', 'Contato', 'Telefone')),
+    XMLRule('taker_email', ('Tomador', 'Contato', 'Email')),
+    XMLRule('taker_email', ('TomadorServico', 'Contato', 'Email')),
+    XMLRule('taker_address', ('Tomador', 'Endereco', 'Endereco')),
+    XMLRule('taker_address', ('Tomador', 'Endereco', 'Numero')),
+    XMLRule('taker_address', ('Tomador', 'Endereco', 'Bairro')),
+    XMLRule('taker_address', ('TomadorServico', 'Endereco', 'Endereco')),
+    XMLRule('taker_address', ('TomadorServico', 'Endereco', 'Numero')),
+    XMLRule('taker_address', ('TomadorServico', 'Endereco', 'Bairro')),
+    XMLRule('taker_zipcode', ('Tomador', 'Endereco', 'Cep')),
+    XMLRule('taker_zipcode', ('TomadorServico', 'Endereco', 'Cep')),
+    XMLRule('service_national_code', ('Servico', 'ItemListaServico')),
+    XMLRule('service_municipal_code', ('Servico', 'CodigoTributacaoMunicipio')),
+    XMLRule('service_description', ('Servico', 'Discriminacao')),
+    XMLRule('service_value', ('Valores', 'ValorServicos'), _decimal),
+    XMLRule('service_base_calculo', ('ValoresNfse', 'BaseCalculo'), _decimal),
+    XMLRule('service_base_calculo', ('Valores', 'BaseCalculo'), _decimal),
+    XMLRule('service_iss_rate', ('ValoresNfse', 'Aliquota'), _rate),
+    XMLRule('service_iss_rate', ('Valores', 'Aliquota'), _rate),
+    XMLRule('service_iss_value', ('ValoresNfse', 'ValorIss'), _decimal),
+    XMLRule('service_iss_value', ('Valores', 'ValorIss'), _decimal),
+    XMLRule('service_iss_retido', ('Servico', 'IssRetido'), _flag('1')),
+    XMLRule('service_iss_retido', ('Valores', 'IssRetido'), _flag('1')),
+    XMLRule('totals_retained_value', ('Valores', 'ValorIssRetido'), _decimal),
+    XMLRule('totals_net_value', ('ValoresNfse', 'ValorLiquidoNfse'), _decimal),
+    XMLRule('totals_net_value', ('Valores', 'ValorLiquidoNfse'), _decimal),
+    XMLRule('complementary_info', ('InfNfse', 'OutrasInformacoes')),
+]
+# ABRASF: siblings of Nfse inside CompNfse that void the note
+ABRASF_CONTAINER = 'CompNfse'
+ABRASF_VOIDED = {'NfseCancelamento': 'cancelada', 'NfseSubstituicao': 'substituída'}
+# parts of an address, joined in the order they appear
+JOINED_FIELDS = {'emitter_address', 'taker_address'}
+
+
+class XMLNotes(NamedTuple):
+    payloads: list[Dict[str, Any]]
+    voided: int  # cancelled or replaced notes left out
+
+
+def is_xml(file_name: str) -> bool:
+    return file_name.lower().endswith('.xml')
+
+
+def parse_nfse_xml(path: Path, file_name: str) -> XMLNotes:
+    """Payloads (NFSePayload fields) of every valid NFS-e in the XML file.
+
+    Both the national standard and ABRASF layouts are read, including
+    lists of notes (ABRASF query answers), with a streaming parser. ABRASF
+    notes that were cancelled or replaced are left out and counted.
+    """
+    reader = _NoteReader(file_name)
+    with open(path, 'rb') as handler:
+        try:
+            for chunk in iter(lambda: handler.read(READ_CHUNK_BYTES), b''):
+                reader.parser.Parse(chunk, False)
+            reader.parser.Parse(b'', True)
+        except expat.ExpatError as exc:
+            raise ValueError(f'XML inválido: {exc}') from exc
+    if not reader.payloads:
+        if reader.voided:
+            raise ValueError('XML só contém NFS-e canceladas ou substituídas.')
+        raise ValueError('XML sem NFS-e reconhecida (padrão nacional ou ABRASF).')
+    return XMLNotes(reader.payloads, reader.voided)
+
+
+class _NoteReader:
+    """Expat handlers collecting the notes of one file as it is read.
+
+    DTDs are refused by the parser itself, so no entity is ever declared
+    or expanded, whatever the encoding or position of the declaration.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.payloads: list[Dict[str, Any]] = []
+        self.voided = 0
+        self.stack: list[str] = []
+        self.text: list[str] = []
+        self.note: Optional[_Note] = None
+        # an ABRASF note is kept until its CompNfse ends, in case a
+        # cancellation or replacement follows it
+        self.pending: Optional[Dict[str, Any]] = None
+        self.pending_depth = -1
+        self.pending_voided = False
+
+        parser = expat.ParserCreate(namespace_separator='}')
+        parser.buffer_text = True
+        parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+        parser.StartDoctypeDeclHandler = self._reject_dtd
+        parser.EntityDeclHandler = self._reject_dtd
+        parser.ExternalEntityRefHandler = self._reject_dtd
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self.text.append
+        self.parser = parser
+
+    @staticmethod
+    def _reject_dtd(*args) -> None:
+        raise ValueError('XML com DOCTYPE ou entidades não é aceito.')
+
+    def _start(self, name: str, attributes: Dict[str, str]) -> None:
+        tag = name.rsplit('}', 1)[-1]
+        self.stack.append(tag)
+        self.text.clear()
+        if self.note is None and tag in (NATIONAL_ROOT, ABRASF_ROOT):
+            self.note = _Note(tag, len(self.stack) - 1, attributes.get('Id', ''))
+        elif self.pending is not None and tag in ABRASF_VOIDED:
+            self.pending_voided = True
+
+    def _end(self, name: str) -> None:
+        text = ''.join(self.text)
+        self.text.clear()
+        depth = len(self.stack) - 1
+        note = self.note
+        if note is not None and depth == note.depth:
+            self.note = None
+            self._finish(note.payload(self.file_name), depth)
+        elif note is not None:
+            if text.strip():
+                note.read(tuple(self.stack[note.depth :]), text)
+        elif self.pending is not None and depth == self.pending_depth:
+            self._release()
+        self.stack.pop()
+
+    def _finish(self, payload: Dict[str, Any], depth: int) -> None:
+        if ABRASF_CONTAINER not in self.stack[:depth]:
+            self.payloads.append(payload)
+            return
+        self.pending = payload
+        self.pending_depth = depth - 1 - self.stack[depth - 1 :: -1].index(ABRASF_CONTAINER)
+        self.pending_voided = False
+
+    def _release(self) -> None:
+        if self.pending_voided:
+            self.voided += 1
+        else:
+            self.payloads.append(self.pending)
+        self.pending = None
+        self.pending_depth = -1
+
+
+class _Note:
+    """Values of one NFS-e while its element is being read."""
+
+    def __init__(self, root: str, depth: int, element_id: str):
+        self.root = root
+        self.depth = depth
+        self.element_id = element_id
+        self.rules = _RULES_BY_LEAF[root]
+        self.values: Dict[str, Any] = {}
+
+    def read(self, path: tuple[str, ...], text: str) -> None:
+        for rule in self.rules.get(path[-1], ()):
+            if path[-len(rule.path) :] != rule.path:
+                continue
+            value = rule.convert(text) if rule.convert else text.strip()
+            if rule.field in JOINED_FIELDS:
+                self.values[rule.field] = ', '.join(
+                    part for part in (self.values.get(rule.field), value) if part
+                )
+            else:
+                self.values.setdefault(rule.field, value)
+            return
+
+    def payload(self, file_name: str) -> Dict[str, Any]:
+        values = self.values
+        if not values.get('number') or not values.get('emitter_cnpj'):
+            raise ValueError('NFS-e do XML sem número ou CNPJ do emitente.')
+        for field in ('emitter_cnpj', 'taker_cnpj'):
+            if values.get(field):
+                values[field] = only_digits(values[field]) or values[field]
+        if self.root == NATIONAL_ROOT:
+            # Id="NFS" + the 50-digit access key
+            access_key = only_digits(self.element_id)
+            if not valid_access_key(access_key):
+                raise ValueError(
+                    f'NFS-e {values["number"]} do XML sem chave de acesso válida '
+                    f'(Id "{self.element_id}").'
+                )
+        else:
+            # ABRASF notes have no access key: municipality + emitter + number
+            access_key = '{:0>7}{}{:0>15}'.format(
+                only_digits(values.get('municipality', '')),
+                values['emitter_cnpj'],
+                only_digits(values['number']),
+            )[:60]
+        retained = values.get('service_iss_retido')
+        return {
+            **values,
+            'file_name': file_name,
+            'access_key': access_key,
+            'municipality': values.get('municipality', ''),
+            'emitter_name': values.get('emitter_name', ''),
+            'taker_name': values.get('taker_name', ''),
+            'totals_service_value': values.get('service_value'),
+            'totals_iss_retido': retained,
+        }
+
+
+def _index(rules: list[XMLRule]) -> Dict[str, list[XMLRule]]:
+    by_leaf: Dict[str, list[XMLRule]] = {}
+    for rule in rules:
+        by_leaf.setdefault(rule.path[-1], []).append(rule)
+    return by_leaf
+
+
+_RULES_BY_LEAF = {NATIONAL_ROOT: _index(NATIONAL_RULES), ABRASF_ROOT: _index(ABRASF_RULES)}
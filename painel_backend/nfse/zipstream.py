@@ -0,0 +1,50 @@
+import zipfile
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+CHUNK_SIZE = 64 * 1024
+
+ZipEntry = tuple[str, Callable[[], BinaryIO]]
+
+
+class _StreamBuffer:
+    """Write-only sink handed to ZipFile; collected bytes are drained by the generator.
+
+    It has no `tell`/`seek`, so zipfile writes data descriptors instead of
+    seeking back to patch local headers.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        chunks, self._chunks = self._chunks, []
+        return b''.join(chunks)
+
+
+def iter_zip(entries: Iterable[ZipEntry], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yields a ZIP archive of `entries` (name, opener) piece by piece.
+
+    Each member is read `chunk_size` bytes at a time, so memory use does not
+    depend on the size of the files or of the archive.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, opener in entries:
+            with opener() as source, archive.open(name, 'w', force_zip64=True) as target:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    target.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    # central directory
+    yield buffer.drain()
@@ -206,3 +206,89 @@ AUDITLOG_INCLUDE_MODELS = [
 AUDITLOG_EXCLUDE_FIELDS = ['updated_at']
 # Toggle whether to persist actor/user reference
 AUDITLOG_LOG_ACTOR = True
+# Diff updates against the values read when the instance was loaded, instead
+# of fetching the row again before every save
+AUDITLOG_SNAPSHOT_ON_LOAD = True
+
+# NFSe import queue, consumed by `manage.py nfse_worker`
+NFSE_WORKER_LEASE_SECONDS = int(os.getenv('NFSE_WORKER_LEASE_SECONDS', '300'))
+NFSE_WORKER_POLL_INTERVAL = float(os.getenv('NFSE_WORKER_POLL_INTERVAL', '5'))
+# Attempts before files left in `processing` by crashed workers are marked as errors
+NFSE_WORKER_MAX_ATTEMPTS = int(os.getenv('NFSE_WORKER_MAX_ATTEMPTS', '3'))
+
+# Per-file parallelism inside a job: 'parallel' or 'sequential' (jobs may override via options)
+NFSE_CONCURRENCY_MODE = os.getenv('NFSE_CONCURRENCY_MODE', 'parallel')
+# Files of the same job processed at once (upper bound for the `maxParallelFiles` option)
+NFSE_JOB_MAX_PARALLEL_FILES = int(os.getenv('NFSE_JOB_MAX_PARALLEL_FILES', '4'))
+# Process-wide limits shared by every job running in a worker process
+# (NFSE_OCR_PROCESSES also caps concurrent Tesseract runs: one page per task;
+# NFSE_LLM_MAX_CONCURRENCY caps model requests in flight)
+NFSE_OCR_PROCESSES = int(os.getenv('NFSE_OCR_PROCESSES', str(os.cpu_count() or 2)))
+NFSE_LLM_MAX_CONCURRENCY = int(os.getenv('NFSE_LLM_MAX_CONCURRENCY', '8'))
+# Model requests: timeout, retries on 429/5xx/connection errors (jittered
+# backoff, Retry-After honored) and per-model rate limits (0 = unlimited).
+# NFSE_LLM_RATE_LIMITS overrides them per model: "gpt-4o-mini=500:200000,llama3.2=0:0"
+# (requests:tokens per minute)
+NFSE_LLM_TIMEOUT_SECONDS = float(os.getenv('NFSE_LLM_TIMEOUT_SECONDS', '120'))
+NFSE_LLM_MAX_RETRIES = int(os.getenv('NFSE_LLM_MAX_RETRIES', '5'))
+NFSE_LLM_REQUESTS_PER_MINUTE = int(os.getenv('NFSE_LLM_REQUESTS_PER_MINUTE', '0'))
+NFSE_LLM_TOKENS_PER_MINUTE = int(os.getenv('NFSE_LLM_TOKENS_PER_MINUTE', '0'))
+# Structured output asked of the model: json_schema, json_object or text; a
+# model that refuses a mode is moved to the next one automatically
+NFSE_LLM_OUTPUT_MODE = os.getenv('NFSE_LLM_OUTPUT_MODE', 'json_schema')
+# How long a model found (un)available on an endpoint is trusted, and whether
+# that is shared through the database with other workers
+NFSE_LLM_MODEL_TTL_SECONDS = int(os.getenv('NFSE_LLM_MODEL_TTL_SECONDS', '3600'))
+NFSE_LLM_MODEL_REGISTRY_DB = env_bool(os.getenv('NFSE_LLM_MODEL_REGISTRY_DB'), True)
+NFSE_LLM_RATE_LIMITS = {
+    model.strip(): [int(limit or 0) for limit in limits.split(':')]
+    for model, _, limits in (
+        item.partition('=') for item in os.getenv('NFSE_LLM_RATE_LIMITS', '').split(',')
+    )
+    if model.strip()
+}
+# Bounded queues between the extract/LLM/persist stages and how often their metrics are saved
+NFSE_PIPELINE_QUEUE_SIZE = int(os.getenv('NFSE_PIPELINE_QUEUE_SIZE', '8'))
+NFSE_PIPELINE_METRICS_INTERVAL = float(os.getenv('NFSE_PIPELINE_METRICS_INTERVAL', '2'))
+# Extracted PDF text cache (bytes of text kept in nfse_extractedpagetext; 0 disables it)
+NFSE_TEXT_CACHE_MAX_BYTES = int(os.getenv('NFSE_TEXT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Cache of parsed LLM answers keyed by (model, prompt hash); 0 entries disables it
+NFSE_LLM_CACHE_TTL_SECONDS = int(os.getenv('NFSE_LLM_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+NFSE_LLM_CACHE_MAX_ENTRIES = int(os.getenv('NFSE_LLM_CACHE_MAX_ENTRIES', '50000'))
+# Regex first, LLM only for missing/invalid fields (jobs may override via options)
+NFSE_HYBRID_EXTRACTION = env_bool(os.getenv('NFSE_HYBRID_EXTRACTION'), False)
+# Documents packed per model request in parallel jobs (1 disables batching),
+# the prompt size (characters) a batch may reach and how long it waits to fill up
+NFSE_LLM_BATCH_SIZE = int(os.getenv('NFSE_LLM_BATCH_SIZE', '1'))
+NFSE_LLM_CONTEXT_CHARS = int(os.getenv('NFSE_LLM_CONTEXT_CHARS', '32000'))
+NFSE_LLM_BATCH_LINGER_SECONDS = float(os.getenv('NFSE_LLM_BATCH_LINGER_SECONDS', '1'))
+# ReinfNFS rows written per bulk upsert statement
+NFSE_PERSIST_BATCH_SIZE = int(os.getenv('NFSE_PERSIST_BATCH_SIZE', '200'))
+# Minimum seconds between job counter updates while files are processed
+NFSE_JOB_TOTALS_FLUSH_INTERVAL = float(os.getenv('NFSE_JOB_TOTALS_FLUSH_INTERVAL', '1'))
+# Expand uploaded ZIPs in the worker instead of inside the job creation request
+NFSE_EXPAND_ZIP_ASYNC = env_bool(os.getenv('NFSE_EXPAND_ZIP_ASYNC'), False)
+# Chunked uploads: largest accepted chunk, where partial files live (default:
+# MEDIA_ROOT/nfse/partial, must be shared by all web workers) and how long an
+# idle session is kept
+NFSE_UPLOAD_MAX_CHUNK_BYTES = int(os.getenv('NFSE_UPLOAD_MAX_CHUNK_BYTES', str(16 * 1024 * 1024)))
+NFSE_UPLOAD_TMP_DIR = os.getenv('NFSE_UPLOAD_TMP_DIR', '')
+NFSE_UPLOAD_SESSION_TTL_HOURS = int(os.getenv('NFSE_UPLOAD_SESSION_TTL_HOURS', '24'))
+# Scanned pages: render at the first DPI and only retry at the next ones when
+# Tesseract's mean word confidence is below NFSE_OCR_MIN_CONFIDENCE
+NFSE_OCR_DPI_STEPS = [
+    int(dpi) for dpi in os.getenv('NFSE_OCR_DPI_STEPS', '200,300').split(',') if dpi.strip()
+]
+NFSE_OCR_MIN_CONFIDENCE = float(os.getenv('NFSE_OCR_MIN_CONFIDENCE', '70'))
+# Grayscale, binarize and deskew pages before OCR
+NFSE_OCR_PREPROCESS = env_bool(os.getenv('NFSE_OCR_PREPROCESS'), True)
+# OCR only the known zones of recognized layouts (nfse/layouts.py), falling
+# back to the full page when no layout matches or confidence is low
+NFSE_OCR_LAYOUT_ZONES = env_bool(os.getenv('NFSE_OCR_LAYOUT_ZONES'), True)
+# Decide from the PDF metadata and first page (a quick OCR at
+# NFSE_CLASSIFY_OCR_DPI when scanned) before extracting the other pages
+NFSE_EARLY_CLASSIFICATION = env_bool(os.getenv('NFSE_EARLY_CLASSIFICATION'), True)
+NFSE_CLASSIFY_OCR_DPI = int(os.getenv('NFSE_CLASSIFY_OCR_DPI', '100'))
+# Link files whose access key (file name or first page) is already imported
+# instead of processing them again; a job can force it with forceRefresh
+NFSE_ACCESS_KEY_DEDUP = env_bool(os.getenv('NFSE_ACCESS_KEY_DEDUP'), True)